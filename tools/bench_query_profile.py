@@ -0,0 +1,385 @@
+# bench_query_profile.py - Synthetic profiles + benchmark for query_profile.py
+#
+# query_profile.py is benchmarked against generated speedscope exports rather
+# than real recordings, so sizes well past a normal session (10M events) can
+# be tested and every run sees the same input.
+#
+# gen:    Writes a speedscope export in _Profiler_Export's exact layout
+#         (BOM, key order, no whitespace). Call trees are random but
+#         seeded; shape is controlled by depth, fan-out, reentrancy rate,
+#         frame count and ring-buffer wrap (the oldest fraction of events is
+#         dropped, leaving orphan closes like a wrapped DiagProfilerBufferSize
+#         buffer). Output is streamed, so memory stays flat at any size.
+#
+# bench:  For each size, generates (or reuses) a profile, then runs each
+#         query_profile.py command as a subprocess and records wall time
+#         (min and median over iterations) and peak RSS of the child.
+#         Results go to a JSON file; --compare prints ratios against an
+#         earlier results file.
+#
+# Usage:
+#   python tools/bench_query_profile.py gen OUT [--events 1M] [--depth 8] [--fanout 4]
+#                                       [--reentrancy 0.02] [--frames 60] [--wrap 0] [--seed 1]
+#   python tools/bench_query_profile.py bench [--sizes 100k,1M,10M] [--iterations 3]
+#                                       [--out bench_query_profile.json] [--compare OLD.json]
+#
+# Commands timed (per size):
+#   parse       summary with --no-index (stream + pair + aggregate)
+#   index       summary on a cold cache (parse + write .qpidx)
+#   summary     summary from the index
+#   callers     --callers
+#   function    --function <hottest root>
+#   timeline    --timeline over 100ms at mid-session
+#   reentrant   --reentrant
+#
+# Generated profiles are kept in --work-dir (default: %TEMP%/qp_bench) and
+# reused when the same size and shape are requested again.
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+QUERY_PROFILE = os.path.join(HERE, "query_profile.py")
+
+# Real Alt-Tabby profiler names first, so output reads like a real session
+_BASE_NAMES = [
+    "GUI_Repaint", "GUI_PaintRow", "WL_Upsert", "WL_Remove", "Enrich_Apply",
+    "Icon_Get", "Icon_Extract", "KSub_OnMsg", "Hook_KeyDown", "Hook_KeyUp",
+    "GUI_Activate", "Timer_Tick", "Store_Snapshot", "IPC_Send", "IPC_OnMessage",
+    "Proc_Resolve", "Win_GetTitle", "Blacklist_Check", "_FR_Record", "Theme_Apply",
+]
+
+_FLUSH_EVENTS = 65536
+
+
+def parse_count(text):
+    """'100k' / '1.5M' / '2000' -> int."""
+    text = text.strip().lower()
+    scale = {"k": 1_000, "m": 1_000_000, "g": 1_000_000_000}.get(text[-1:], 1)
+    return int(float(text[:-1] if scale > 1 else text) * scale)
+
+
+def frame_names(count):
+    names = _BASE_NAMES[:count]
+    names += [f"Func_{i:03d}" for i in range(len(names), count)]
+    return names
+
+
+class _Generator:
+    """Random call trees as (type, frame, at) events, oldest first."""
+
+    def __init__(self, n_frames, depth, fanout, reentrancy, seed):
+        self.rng = random.Random(seed)
+        self.n_frames = n_frames
+        self.depth = depth
+        self.fanout = fanout
+        self.reentrancy = reentrancy
+        # Zipf-like popularity: a few functions dominate, as in real sessions
+        self.weights = [1.0 / (i + 1) for i in range(n_frames)]
+        self.t = 0
+
+    def _pick(self, above=-1):
+        """A popular frame; children only call frames numbered above their
+        caller, so the call graph is layered like real code and recursion
+        only comes from the reentrancy rate."""
+        lo = above + 1
+        if lo >= self.n_frames:
+            return None
+        return lo + self.rng.choices(range(self.n_frames - lo), weights=self.weights[:self.n_frames - lo])[0]
+
+    def _work_us(self):
+        # Mostly short calls with a heavy tail of hitches
+        us = self.rng.expovariate(1 / 40)
+        if self.rng.random() < 0.01:
+            us *= 50
+        return max(1, int(us))
+
+    def _call(self, frame, stack, out):
+        rng = self.rng
+        out.append(("O", frame, self.t))
+        stack.append(frame)
+        self.t += self._work_us()
+        if len(stack) < self.depth:
+            for _ in range(rng.randint(0, self.fanout)):
+                if rng.random() < self.reentrancy:
+                    child = rng.choice(stack)  # re-enter something already running
+                else:
+                    child = self._pick(frame)
+                    if child is None:
+                        break
+                self._call(child, stack, out)
+                self.t += self._work_us()
+        stack.pop()
+        out.append(("C", frame, self.t))
+
+    def events(self, n_events):
+        """Yield batches of events until at least n_events were produced."""
+        produced = 0
+        while produced < n_events:
+            batch = []
+            while len(batch) < _FLUSH_EVENTS and produced + len(batch) < n_events:
+                self._call(self._pick(), [], batch)
+                self.t += int(self.rng.expovariate(1 / 2000))  # idle between trees
+            produced += len(batch)
+            yield batch
+
+
+def generate(out_path, events=1_000_000, depth=8, fanout=4, reentrancy=0.02,
+             frames=60, wrap=0.0, seed=1):
+    """Write a synthetic speedscope export. Returns the number of events written.
+
+    wrap drops that fraction of the oldest events, as the profiler's ring
+    buffer does once it fills.
+    """
+    names = frame_names(frames)
+    gen = _Generator(frames, depth, fanout, reentrancy, seed)
+    total = int(events / (1 - wrap)) if wrap else events
+    skip = total - events
+    written = 0
+    base = None  # _Profiler_Export times events from the oldest one kept
+    # endValue precedes the events (as in _Profiler_Export) but is only known
+    # once they are generated, so events go to a temp file first
+    tmp_path = out_path + ".events.tmp"
+    with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+        sep = ""
+        for batch in gen.events(total):
+            if skip >= len(batch):
+                skip -= len(batch)
+                continue
+            batch = batch[skip:]
+            skip = 0
+            if base is None:
+                base = batch[0][2]
+            f.write("".join(
+                f'{sep if i == 0 else ","}{{"type":"{typ}","frame":{fr},"at":{at - base}}}'
+                for i, (typ, fr, at) in enumerate(batch)
+            ))
+            sep = ","
+            written += len(batch)
+    try:
+        with open(out_path, "w", encoding="utf-8-sig", newline="") as f, \
+                open(tmp_path, encoding="utf-8", newline="") as events_file:
+            f.write('{"$schema":"https://www.speedscope.app/file-format-schema.json","version":"0.0.1",')
+            f.write('"shared":{"frames":[' + ",".join(
+                json.dumps({"name": n}, separators=(",", ":")) for n in names
+            ) + "]},")
+            f.write('"profiles":[{"type":"evented","name":"Alt-Tabby Profiler","unit":"microseconds",')
+            f.write(f'"startValue":0,"endValue":{gen.t - (base or 0)},"events":[')
+            shutil.copyfileobj(events_file, f)
+            f.write("]}]}")
+    finally:
+        os.remove(tmp_path)
+    return written
+
+
+def _run_measured(argv):
+    """Run argv to completion; returns (wall seconds, peak RSS bytes or None)."""
+    start = time.perf_counter()
+    proc = subprocess.Popen(argv, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if hasattr(os, "wait4"):
+        _, status, usage = os.wait4(proc.pid, 0)
+        wall = time.perf_counter() - start
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        err = proc.stderr.read()
+        proc.stderr.close()
+        # ru_maxrss is KB on Linux, bytes on macOS
+        peak = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    else:
+        _, err = proc.communicate()
+        wall = time.perf_counter() - start
+        peak = _windows_peak_rss(proc)
+    if proc.returncode != 0:
+        raise RuntimeError(f"{' '.join(argv)} failed ({proc.returncode}): {err.decode(errors='replace')}")
+    return wall, peak
+
+
+def _windows_peak_rss(proc):
+    """PeakWorkingSetSize of an exited child (its handle is still open)."""
+    import ctypes
+    from ctypes import wintypes
+
+    class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    counters = PROCESS_MEMORY_COUNTERS()
+    counters.cb = ctypes.sizeof(counters)
+    ok = ctypes.windll.psapi.GetProcessMemoryInfo(
+        wintypes.HANDLE(int(proc._handle)), ctypes.byref(counters), counters.cb
+    )
+    return counters.PeakWorkingSetSize if ok else None
+
+
+def _profile_end_us(path):
+    sys.path.insert(0, HERE)
+    import query_profile
+
+    _, profile, _ = query_profile.load_speedscope(path)
+    return profile["endValue"]
+
+
+def _commands(path, hot, mid_s):
+    return [
+        ("parse", [path, "--no-index"]),
+        ("index", [path]),
+        ("summary", [path]),
+        ("callers", [path, "--callers"]),
+        ("function", [path, "--function", hot]),
+        ("timeline", [path, "--timeline", f"{mid_s:.3f}", f"{mid_s + 0.1:.3f}"]),
+        ("reentrant", [path, "--reentrant"]),
+    ]
+
+
+def bench(sizes, iterations, shape, work_dir):
+    results = []
+    os.makedirs(work_dir, exist_ok=True)
+    for size in sizes:
+        tag = "_".join(f"{k}{v}" for k, v in sorted(shape.items()))
+        path = os.path.join(work_dir, f"synthetic_{size}_{tag}.speedscope.json")
+        if not os.path.exists(path):
+            print(f"Generating {size:,} events -> {path}")
+            t = time.perf_counter()
+            generate(path, events=size, **shape)
+            print(f"  {time.perf_counter() - t:.1f}s, {os.path.getsize(path) / 1e6:.0f} MB")
+        mid_s = _profile_end_us(path) / 2 / 1_000_000
+        hot = frame_names(shape["frames"])[0]
+
+        for name, args in _commands(path, hot, mid_s):
+            walls, peaks = [], []
+            for _ in range(iterations):
+                if name == "index":
+                    try:
+                        os.remove(path + ".qpidx")
+                    except FileNotFoundError:
+                        pass
+                wall, peak = _run_measured([sys.executable, QUERY_PROFILE, *args])
+                walls.append(wall)
+                if peak is not None:
+                    peaks.append(peak)
+            row = {
+                "size": size,
+                "command": name,
+                "min_s": round(min(walls), 4),
+                "median_s": round(statistics.median(walls), 4),
+                "peak_rss_mb": round(max(peaks) / 2**20, 1) if peaks else None,
+            }
+            results.append(row)
+            rss = f"{row['peak_rss_mb']:>8.1f}" if peaks else f"{'-':>8}"
+            print(f"  {size:>11,} {name:<10} {row['min_s']:>8.3f}s {row['median_s']:>8.3f}s {rss} MB")
+    return results
+
+
+def _environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=HERE,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    try:
+        import numpy
+        numpy_version = numpy.__version__
+    except ImportError:
+        numpy_version = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": numpy_version,
+        "platform": platform.platform(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def compare(old, new):
+    """Print new/old ratios for every (size, command) present in both."""
+    before = {(r["size"], r["command"]): r for r in old["results"]}
+    print()
+    print(f"Compared to {old['environment'].get('commit') or '?'} ({old['environment'].get('time', '?')}):")
+    print(f"  {'Size':>11} {'Command':<10} {'Before s':>9} {'After s':>9} {'Ratio':>6} {'RSS ratio':>10}")
+    for r in new["results"]:
+        b = before.get((r["size"], r["command"]))
+        if b is None:
+            continue
+        ratio = r["min_s"] / b["min_s"] if b["min_s"] else float("nan")
+        rss = (
+            f"{r['peak_rss_mb'] / b['peak_rss_mb']:>10.2f}"
+            if r.get("peak_rss_mb") and b.get("peak_rss_mb") else f"{'-':>10}"
+        )
+        flag = "  SLOWER" if ratio > 1.1 else "  faster" if ratio < 0.9 else ""
+        print(
+            f"  {r['size']:>11,} {r['command']:<10} {b['min_s']:>9.3f} {r['min_s']:>9.3f} "
+            f"{ratio:>6.2f}{rss}{flag}"
+        )
+
+
+def _add_shape_args(p):
+    p.add_argument("--depth", type=int, default=8, help="Maximum call depth (default: 8)")
+    p.add_argument("--fanout", type=int, default=4, help="Maximum children per call (default: 4)")
+    p.add_argument("--reentrancy", type=float, default=0.02,
+                   help="Chance a child re-enters a function already on the stack (default: 0.02)")
+    p.add_argument("--frames", type=int, default=60, help="Distinct functions (default: 60)")
+    p.add_argument("--wrap", type=float, default=0.0,
+                   help="Fraction of oldest events dropped, as by a wrapped ring buffer (default: 0)")
+    p.add_argument("--seed", type=int, default=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic profiles and benchmarks for query_profile.py")
+    sub = parser.add_subparsers(dest="mode", required=True)
+
+    p_gen = sub.add_parser("gen", help="Write one synthetic speedscope export")
+    p_gen.add_argument("out")
+    p_gen.add_argument("--events", type=parse_count, default=1_000_000, help="Event count, e.g. 500k, 10M")
+    _add_shape_args(p_gen)
+
+    p_bench = sub.add_parser("bench", help="Time every command across profile sizes")
+    p_bench.add_argument("--sizes", default="100k,1M", help="Comma-separated event counts (default: 100k,1M)")
+    p_bench.add_argument("--iterations", type=int, default=3)
+    p_bench.add_argument("--out", default="bench_query_profile.json", help="Results file (JSON)")
+    p_bench.add_argument("--compare", metavar="OLD", help="Earlier results file to compare against")
+    p_bench.add_argument("--work-dir", default=os.path.join(tempfile.gettempdir(), "qp_bench"))
+    _add_shape_args(p_bench)
+
+    args = parser.parse_args()
+    shape = {
+        "depth": args.depth, "fanout": args.fanout, "reentrancy": args.reentrancy,
+        "frames": args.frames, "wrap": args.wrap, "seed": args.seed,
+    }
+    if not 0 <= args.wrap < 1:
+        parser.error("--wrap must be in [0, 1)")
+
+    if args.mode == "gen":
+        t = time.perf_counter()
+        n = generate(args.out, events=args.events, **shape)
+        print(f"Wrote {n:,} events to {args.out} in {time.perf_counter() - t:.1f}s")
+        return
+
+    sizes = [parse_count(s) for s in args.sizes.split(",") if s.strip()]
+    print(f"  {'Size':>11} {'Command':<10} {'Min':>9} {'Median':>9} {'Peak RSS':>11}")
+    results = bench(sizes, args.iterations, shape, args.work_dir)
+    report = {"environment": _environment(), "shape": shape, "iterations": args.iterations, "results": results}
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {args.out}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,19 +7,65 @@
 # The profiler (@profile annotations in AHK source) emits speedscope-format
 # JSON via Profiler.Export(). This tool reads that JSON and computes:
 #   - Per-function call counts, total/self/avg/max times
+#   - Per-function latency percentiles (p50/p90/p99/p99.9) from mergeable
+#     log-bucketed histograms
 #   - Caller-callee relationships (who triggers each function)
+#   - Full call-path tree (hottest paths, folded stacks for flame graphs)
 #   - Timeline traces for specific time windows
-#   - Reentrancy detection (nested calls to the same function)
+#   - Reentrancy detection (nested calls to the same function) and its
+#     cost per interrupting callback
 #
 # Usage:
-#   python tools/query_profile.py <file>                     Summary table (sorted by total time)
+#   python tools/query_profile.py <file>                     Summary table (sorted by total time, p50-p99.9 latency)
+#   python tools/query_profile.py <file> <file>...           Summary merged across profiles (by function name)
+#   python tools/query_profile.py <file> --source [SRC]      Summary rows annotated with Profiler.Enter file:line + function size
 #   python tools/query_profile.py <file> --callers           Who calls each function (repaint trigger analysis)
 #   python tools/query_profile.py <file> --timeline 3.0 7.0  Event timeline for a time window (seconds)
+#   python tools/query_profile.py <file> --stack-at 3.5      Call stack at one instant (seconds)
 #   python tools/query_profile.py <file> --function <name>   Deep dive on one function (callers + per-call list)
 #   python tools/query_profile.py <file> --reentrant         Find functions that are called while already on the stack
+#   python tools/query_profile.py <file> --reentry-cost [N]  What reentrancy costs per (outer, callback) pair: suspended + extra latency
+#   python tools/query_profile.py <file> --paths [N]         Hottest full call paths (add --function X for paths ending in X)
+#   python tools/query_profile.py <file> --folded [OUT]      Folded stacks for flame graphs (flamegraph.pl, speedscope)
+#   python tools/query_profile.py <file> --span START END    Interaction latency START -> END (repeatable)
+#   python tools/query_profile.py <file> --jank [--budget MS] Top-level call trees over the frame budget (16.6ms)
+#   python tools/query_profile.py <file> --utilization [MS]  Busy % per bucket (10ms) by top-level function, burst windows
+#   python tools/query_profile.py <file> --outliers [Z]      Slow calls vs. their own function (robust z), with stack + children
+#   python tools/query_profile.py <file> --gaps [N]          Self time outside instrumented callees + largest uninstrumented windows
+#   python tools/query_profile.py <file> --query EXPR        Filter/group/sort calls (see QUERY LANGUAGE below)
+#   python tools/query_profile.py <file> --check budgets.json Pass/fail against per-function budgets (exit 1 on violation)
+#   python tools/query_profile.py <file> --repl              Interactive shell (tab-completes function names)
+#   python tools/query_profile.py <file> --serve 8765        Same commands over a local socket, for agents:
+#   python tools/query_profile.py --ask 8765 "function GUI_Repaint"
+#   python tools/query_profile.py <file> --export-chrome OUT Chrome Trace Event JSON for Perfetto / chrome://tracing
+#   python tools/query_profile.py <file> --export-pprof OUT  Gzipped pprof protobuf (pprof -top, -diff_base)
+#   python tools/query_profile.py <file> --archive OUT.qpa   Compact binary archive (~2 bytes/event); readable by every mode
+#   python tools/query_profile.py <file.qpa> --to-speedscope OUT  Back to speedscope JSON (lossless)
+#   python tools/query_profile.py --watch recorder [--check budgets.json]  Live report on each new profile (movers, budgets)
+#   python tools/query_profile.py --batch <dir|glob>         Parallel analysis of many profiles, per-file trend tables
+#   python tools/query_profile.py --diff <base> <candidate>  A/B compare two profiles (latency + call-rate significance tests)
 #
 # Input:  Speedscope JSON (typically release/recorder/profile_*.speedscope.json)
 #         Handles UTF-8 BOM (AHK's FileAppend writes BOM by default).
+#         Archives written by --archive (.qpa) are accepted anywhere a
+#         profile is.
+#         Events are streamed from disk in chunks, so the JSON text is never
+#         held in memory at once.
+#
+# Cache:  The first run writes <file>.qpidx next to the profile: paired calls,
+#         per-function aggregates and caller edges in a memory-mappable
+#         layout. Later runs open it instead of re-parsing the JSON. It is
+#         keyed by file size, mtime and content hash and rebuilt when stale.
+#         It costs disk: about 1.5-1.7x the size of the JSON (60 bytes/event),
+#         written for every profile loaded, --batch included (--watch only
+#         reads existing ones). --no-index bypasses it; delete *.qpidx to
+#         reclaim the space.
+#
+# Requires: numpy. Events are held as typed columns (13 bytes/event) and
+#         call pairing/aggregation runs as array operations. The pairing and
+#         call tables are int64 working arrays, so peak memory grows with
+#         DiagProfilerBufferSize at roughly 150-170 bytes/event (~500 MB
+#         for 3M events); a cached .qpidx run maps its arrays instead.
 #
 # Output: Plain text tables to stdout. Designed to be compact enough for
 #         AI agent context windows while still being useful to humans.
@@ -36,268 +82,3481 @@
 #
 #   # Find reentrancy bugs (functions calling themselves via message pump)
 #   python tools/query_profile.py <file> --reentrant
+#
+#   # ...and which timer/hook/message callbacks that re-entered cost the most
+#   python tools/query_profile.py <file> --reentry-cost
+#
+#   # Keypress-to-paint latency, and which frames blew the 16.6ms budget
+#   python tools/query_profile.py <file> --span INT_Tab_Down GUI_Repaint
+#
+#   # The 20 slowest repaints triggered from the komorebi subscription, 3-7s in
+#   python tools/query_profile.py <file> --query 'name=="GUI_Repaint" and caller=="KSub_OnMsg" and t in 3..7s sort by dur limit 20'
+#
+#   # Which callers produce slow GUI_* calls?
+#   python tools/query_profile.py <file> --query 'name~"^GUI_" and dur>2ms group by caller'
+#
+#   # Gate a build on a recorded session. budgets.json:
+#   #   {"functions": {"GUI_Repaint": {"max_p95_ms": 8, "max_calls_per_sec": 60,
+#   #                                  "max_self_share": 0.05},
+#   #                  "*": {"max_p99_ms": 16.6}}}
+#   # "*" applies to every function without its own entry.
+#   python tools/query_profile.py <file> --check budgets.json
+#
+#   # How have the hottest functions drifted across recorded sessions?
+#   python tools/query_profile.py --batch release/recorder --top 8
+#
+#   # Did a GUI_Repaint change actually help? (before/after sessions)
+#   python tools/query_profile.py --diff before.speedscope.json after.speedscope.json
 
+import bisect
+import cmd
+import contextlib
+import glob
+import gzip
+import hashlib
+import io
 import json
+import math
+import os
+import re
+import shlex
+import socket
+import socketserver
 import sys
+import time
+import zlib
 import argparse
-from collections import defaultdict
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
 
+import numpy as np
+
+try:
+    import zstandard  # optional: better archive compression than zlib
+except ImportError:
+    zstandard = None
+
+
+# Streaming reader tuning. 1 MiB chunks keep the buffer small while still
+# amortizing read() overhead; the buffer is compacted once the consumed
+# prefix passes _COMPACT_AT characters.
+_CHUNK_CHARS = 1 << 20
+_COMPACT_AT = 1 << 19
+
+# Fast path for the exact event shape _Profiler_Export writes. Anything else
+# (whitespace, key order, float timestamps) falls back to json raw_decode.
+_RX_AHK_EVENT = re.compile(r'\{"type":"([OC])","frame":(-?\d+),"at":(-?\d+)\},?')
+# skip_value hops between strings and brackets. A lone quote means a string
+# was cut off at the buffer edge and the buffer needs a refill.
+_RX_SKIP = re.compile(r'"(?:[^"\\]|\\.)*"|"|[\[\]{}]')
+_JSON_WS = " \t\r\n"
+_DECODER = json.JSONDecoder()
+
+
+class _JsonStream:
+    """Incremental reader over one JSON document.
+
+    Holds at most a chunk or two of text in memory. Values are decoded one
+    at a time with raw_decode, refilling the buffer whenever a value runs
+    past the end of what has been read so far.
+    """
+
+    def __init__(self, f):
+        self._f = f
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        if self._eof:
+            return False
+        chunk = self._f.read(_CHUNK_CHARS)
+        if not chunk:
+            self._eof = True
+            return False
+        if self._pos > _COMPACT_AT:
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+        self._buf += chunk
+        return True
+
+    def peek(self):
+        """Return the next non-whitespace character without consuming it."""
+        while True:
+            buf = self._buf
+            n = len(buf)
+            pos = self._pos
+            while pos < n and buf[pos] in _JSON_WS:
+                pos += 1
+            self._pos = pos
+            if pos < n:
+                return buf[pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, ch):
+        got = self.peek()
+        if got != ch:
+            raise ValueError(f"Malformed speedscope JSON: expected {ch!r}, got {got!r}")
+        self._pos += 1
+
+    def value(self):
+        """Decode the next complete JSON value."""
+        self.peek()
+        while True:
+            try:
+                val, end = _DECODER.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # A number at the buffer edge may decode short ("12" of "1234")
+            if end == len(self._buf) and self._fill():
+                continue
+            self._pos = end
+            return val
+
+    def skip_value(self):
+        """Skip the next value without materializing it (bracket matching)."""
+        if self.peek() not in "[{":
+            self.value()
+            return
+        depth = 0
+        while True:
+            buf = self._buf
+            pos = self._pos
+            for m in _RX_SKIP.finditer(buf, pos):
+                tok = m.group()
+                if tok[0] == '"':
+                    if len(tok) == 1:
+                        break
+                elif tok in "[{":
+                    depth += 1
+                else:
+                    depth -= 1
+                    if depth == 0:
+                        self._pos = m.end()
+                        return
+                pos = m.end()
+            else:
+                pos = len(buf)
+            self._pos = pos
+            if not self._fill():
+                raise ValueError("Malformed speedscope JSON: unexpected end of file")
+
+    def members(self):
+        """Iterate the keys of the object at the cursor.
+
+        The caller must consume (value/skip_value/descend) each member's value
+        before advancing the iterator.
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            if self.peek() == ",":
+                self._pos += 1
+                continue
+            self.expect("}")
+            return
+
+    def elements(self):
+        """Iterate the elements of the array at the cursor (same contract as members)."""
+        self.expect("[")
+        if self.peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield
+            if self.peek() == ",":
+                self._pos += 1
+                continue
+            self.expect("]")
+            return
+
+    def events(self):
+        """Yield (at, frame, type) for each element of the events array at the cursor."""
+        self.expect("[")
+        match = _RX_AHK_EVENT.match
+        while True:
+            # Tight loop over a run of AHK-format events within the buffer
+            buf = self._buf
+            pos = self._pos
+            m = match(buf, pos)
+            while m is not None:
+                typ, frame, at = m.groups()
+                yield int(at), int(frame), typ
+                pos = m.end()
+                m = match(buf, pos)
+            self._pos = pos
+            c = self.peek()
+            if c == ",":
+                self._pos += 1
+            elif c == "{":
+                ev = self.value()
+                yield ev["at"], ev["frame"], ev["type"]
+            elif c == "]":
+                self._pos += 1
+                return
+            else:
+                raise ValueError(f"Malformed speedscope JSON: unexpected {c!r} in events")
+
+
+def _open_speedscope(path):
+    # utf-8-sig strips the BOM that AHK's FileAppend writes by default
+    return open(path, "r", encoding="utf-8-sig")
+
+
+def _seek_events(js):
+    """Advance js to profiles[0].events. Returns True if the array was found."""
+    for key in js.members():
+        if key != "profiles":
+            js.skip_value()
+            continue
+        for _ in js.elements():
+            for pkey in js.members():
+                if pkey == "events":
+                    return True
+                js.skip_value()
+            return False
+    return False
+
+
+class SpeedscopeEvents:
+    """Re-iterable, streamed view of profiles[0].events.
+
+    Each iteration reopens the file and yields (at, frame, type) tuples, so
+    memory stays flat regardless of how many events the export holds.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        with _open_speedscope(self.path) as f:
+            js = _JsonStream(f)
+            if _seek_events(js):
+                yield from js.events()
 
-def load_speedscope(path):
-    """Load speedscope JSON, handling UTF-8 BOM."""
-    with open(path, "rb") as f:
-        raw = f.read()
-    if raw[:3] == b"\xef\xbb\xbf":
-        raw = raw[3:]
-    return json.loads(raw)
 
+def load_speedscope(path):
+    """Open a speedscope export for streaming.
 
-def build_call_data(frames, events):
-    """Process events into per-function stats and caller relationships.
+    Reads only shared.frames and the scalar fields of profiles[0]; events are
+    left on disk and streamed on demand.
 
     Returns:
-        func_stats: {frame_idx: {calls, total_us, max_us, min_us}}
-        func_self:  {frame_idx: total_self_us}
-        func_total: {frame_idx: total_us}
-        call_log:   {frame_idx: [(start_us, dur_us, parent_name)]}
+        frames:  [{name}, ...] from shared.frames
+        profile: profiles[0] without its events (startValue, endValue, ...)
+        events:  SpeedscopeEvents, iterable of (at, frame, type)
+    """
+    frames = []
+    profile = {}
+    with _open_speedscope(path) as f:
+        js = _JsonStream(f)
+        for key in js.members():
+            if key == "shared":
+                for skey in js.members():
+                    if skey == "frames":
+                        frames = js.value()
+                    else:
+                        js.skip_value()
+            elif key == "profiles":
+                for i, _ in enumerate(js.elements()):
+                    if i > 0:
+                        js.skip_value()
+                        continue
+                    for pkey in js.members():
+                        if pkey != "events":
+                            profile[pkey] = js.value()
+                        elif "endValue" in profile:
+                            # AHK exports put every scalar before the events;
+                            # no need to scan past them
+                            return frames, profile, SpeedscopeEvents(path)
+                        else:
+                            js.skip_value()
+            else:
+                js.skip_value()
+    if not profile:
+        raise ValueError(f"{path}: no profiles in speedscope export")
+    return frames, profile, SpeedscopeEvents(path)
+
+
+# Events as typed columns. "type" is kept as one byte so np.fromiter can
+# consume the (at, frame, type) stream directly.
+_EVENT_DTYPE = np.dtype([("at", "i8"), ("frame", "i4"), ("type", "S1")])
+
+EventArrays = namedtuple("EventArrays", ["at", "frame", "is_open"])
+EventArrays.__doc__ = """Columnar events: at (int64 us), frame (int32), is_open (bool)."""
+
+# One row per completed call, ordered by close time (the order calls finish).
+# parent is a row index into the same table (-1 = top-level or parent never
+# closed); parent_frame is the caller's frame index (-1 = top-level); path is
+# the interned call path (row in CallPaths). truncated marks calls whose open
+# was lost to a ring-buffer wrap and reconstructed at the buffer start (see
+# reconstruct_wrapped); their dur is a lower bound.
+Calls = namedtuple(
+    "Calls",
+    ["frame", "start", "dur", "self_us", "parent", "parent_frame", "open_idx", "close_idx", "path",
+     "truncated"],
+)
+
+# Interned call paths (the call tree). Row i is the path parent[i] + frame[i];
+# parent -1 = a top-level frame. Parents always have lower IDs than their
+# children. calls/total_us/self_us aggregate the completed calls at that node.
+CallPaths = namedtuple("CallPaths", ["parent", "frame", "calls", "total_us", "self_us"])
+
+# Per-frame aggregates, indexed by frame index. hist is (n_frames,
+# HIST_BUCKETS) latency counts; see latency_bucket. truncated counts the
+# calls that were already running when the ring buffer starts.
+FuncStats = namedtuple(
+    "FuncStats", ["calls", "total_us", "self_us", "max_us", "min_us", "hist", "truncated"]
+)
+
+# Latency histograms: log-linear buckets in the style of HdrHistogram.
+# Values below 2^HIST_SUB_BITS us get one bucket each; above that, every
+# power of two is split into 2^HIST_SUB_BITS equal buckets (<= 1.6% error
+# at the bucket midpoint). The layout is fixed, so histograms from any
+# number of profiles merge by plain addition.
+HIST_SUB_BITS = 5
+_HIST_SUB = 1 << HIST_SUB_BITS
+_HIST_MAX_BITS = 40  # 2^40 us ~ 12 days; longer calls land in the last bucket
+HIST_BUCKETS = (_HIST_MAX_BITS - HIST_SUB_BITS + 1) * _HIST_SUB
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def latency_bucket(us):
+    """Histogram bucket index for an array of durations (us)."""
+    us = np.maximum(np.asarray(us, dtype=np.int64), 0)
+    _, bits = np.frexp(us.astype(np.float64))  # bit length, exact below 2^53
+    shift = np.maximum(bits - 1 - HIST_SUB_BITS, 0)
+    bucket = np.where(us < _HIST_SUB, us, (shift + 1) * _HIST_SUB + ((us >> shift) - _HIST_SUB))
+    return np.minimum(bucket, HIST_BUCKETS - 1)
+
+
+def bucket_midpoint(bucket):
+    """Representative duration (us) for an array of bucket indices."""
+    bucket = np.asarray(bucket, dtype=np.int64)
+    shift = np.maximum(bucket // _HIST_SUB - 1, 0)
+    low = np.where(bucket < _HIST_SUB, bucket, ((bucket % _HIST_SUB) + _HIST_SUB) << shift)
+    return low + ((1 << shift) - 1) / 2.0
+
+
+def hist_percentiles(func, percentiles=PERCENTILES):
+    """Latency percentiles (us) per frame from the histograms.
+
+    Returns an (n_frames, len(percentiles)) float array, clamped to each
+    frame's observed min/max. Frames without calls get 0.
     """
-    func_stats = defaultdict(
-        lambda: {"calls": 0, "total_us": 0, "max_us": 0, "min_us": float("inf")}
+    cum = np.cumsum(func.hist, axis=1)
+    calls = cum[:, -1]
+    out = np.zeros((len(calls), len(percentiles)))
+    has = calls > 0
+    for j, pct in enumerate(percentiles):
+        rank = np.ceil(calls * (pct / 100.0)).clip(min=1)
+        bucket = (cum < rank[:, None]).sum(axis=1)
+        out[:, j] = np.where(has, bucket_midpoint(np.minimum(bucket, HIST_BUCKETS - 1)), 0)
+    lo = np.where(has, func.min_us, 0)
+    return np.clip(out, lo[:, None], func.max_us[:, None])
+
+# Caller edges: one row per (frame, caller frame) pair, grouped by frame and
+# sorted by total_us (desc) within each frame. caller -1 = top-level.
+CallerEdges = namedtuple("CallerEdges", ["frame", "caller", "count", "total_us"])
+
+# event_depth:  stack depth before each event (what --timeline indents by)
+# event_parent: for each open, the event index of the enclosing open (-1 = none)
+# event_top:    innermost open on the stack after each event (-1 = empty).
+#               Following event_parent from it yields the whole stack, so any
+#               event is a stack checkpoint and nothing has to be replayed.
+CallData = namedtuple(
+    "CallData", ["func", "calls", "edges", "paths", "event_depth", "event_parent", "event_top"]
+)
+
+
+def load_event_arrays(events):
+    """Materialize an (at, frame, type) stream into typed columns in one pass."""
+    rec = np.fromiter(events, dtype=_EVENT_DTYPE)
+    return EventArrays(
+        np.ascontiguousarray(rec["at"]),
+        np.ascontiguousarray(rec["frame"]),
+        rec["type"] == b"O",
     )
-    func_self = defaultdict(int)
-    func_total = defaultdict(int)
-    call_log = defaultdict(list)
 
-    stack = []  # (frame_idx, start_time, child_time_accumulated)
 
-    for ev in events:
-        t = ev["at"]
-        frame = ev["frame"]
-        typ = ev["type"]
+def _pair_events(ev):
+    """Match every close to its open with array operations.
 
-        if typ == "O":
-            stack.append((frame, t, 0))
-        elif typ == "C":
-            if stack and stack[-1][0] == frame:
-                fr, start, child_time = stack.pop()
-                dur = t - start
-                self_time = dur - child_time
+    A close on an empty stack (the open was lost) is ignored, as in the
+    sequential walk. Depth is a +1/-1 walk clamped at zero; an open at depth
+    d pairs with the next event that closes back to depth d, so a stable sort
+    by level lines each open up directly before its close.
 
-                s = func_stats[fr]
-                s["calls"] += 1
-                s["total_us"] += dur
-                s["max_us"] = max(s["max_us"], dur)
-                s["min_us"] = min(s["min_us"], dur)
+    Returns (open_idx, close_idx, event_depth, event_parent), or None when a
+    close names a different frame than its open (malformed nesting), in which
+    case the caller falls back to _pair_events_seq.
+    """
+    is_open = ev.is_open
+    n = len(is_open)
+    d = np.cumsum(np.where(is_open, 1, -1))
+    floor = np.minimum.accumulate(np.minimum(d, 0))
+    floor_prev = np.concatenate(([0], floor[:-1]))
+    depth_after = d - floor
+    orphan = ~is_open & (d < floor_prev)
+    level = np.where(is_open, depth_after - 1, depth_after)
+    level[orphan] = -1
 
-                func_self[fr] += self_time
-                func_total[fr] += dur
+    order = np.argsort(level, kind="stable")
+    s_open = is_open[order]
+    s_level = level[order]
+    pair = s_open[:-1] & ~s_open[1:] & (s_level[:-1] == s_level[1:])
+    open_idx = order[:-1][pair]
+    close_idx = order[1:][pair]
+    if np.any(ev.frame[open_idx] != ev.frame[close_idx]):
+        return None
 
-                # Add child time to parent
-                if stack:
-                    parent = stack[-1]
-                    stack[-1] = (parent[0], parent[1], parent[2] + dur)
+    # Enclosing open = last open one level up that precedes this one
+    opens = order[s_open]
+    keys = level[opens] * n + opens
+    child = opens[level[opens] > 0]
+    pos = np.searchsorted(keys, (level[child] - 1) * n + child) - 1
+    event_parent = np.full(n, -1, dtype=np.int64)
+    event_parent[child] = opens[pos]
 
-                # Record caller
-                parent_name = frames[stack[-1][0]]["name"] if stack else "(top-level)"
-                call_log[fr].append((start, dur, parent_name))
+    event_depth = np.concatenate(([0], depth_after[:-1])).astype(np.int32)
+    return open_idx, close_idx, event_depth, event_parent
 
-    return func_stats, func_self, func_total, call_log
 
+def _pair_events_seq(ev):
+    """Sequential stack walk; same results as _pair_events for any input."""
+    n = len(ev.at)
+    open_idx = []
+    close_idx = []
+    event_depth = np.zeros(n, dtype=np.int32)
+    event_parent = np.full(n, -1, dtype=np.int64)
+    stack = []  # (frame_idx, event_idx)
+    for i, (frame, is_open) in enumerate(zip(ev.frame.tolist(), ev.is_open.tolist())):
+        event_depth[i] = len(stack)
+        if is_open:
+            if stack:
+                event_parent[i] = stack[-1][1]
+            stack.append((frame, i))
+        elif stack and stack[-1][0] == frame:
+            open_idx.append(stack.pop()[1])
+            close_idx.append(i)
+    return (
+        np.array(open_idx, dtype=np.int64),
+        np.array(close_idx, dtype=np.int64),
+        event_depth,
+        event_parent,
+    )
 
-def cmd_summary(frames, profile, func_stats, func_self, func_total):
-    """Print summary table sorted by total time."""
-    session_us = profile["endValue"] - profile["startValue"]
+
+def reconstruct_wrapped(ev):
+    """Give orphan closes back the opens a ring-buffer wrap overwrote.
+
+    The profiler keeps the last DiagProfilerBufferSize events, so once it
+    wraps, the export starts mid-stack: calls that were running at the
+    buffer start have a close but no open. Leave() pops the profiler's own
+    (unwrapped) stack, so those closes still name the right frame; they are
+    the closes that take the depth walk below any earlier minimum. Closes of
+    frame -1 (Leave with nothing entered) are not wrap artifacts and stay
+    ignored.
+
+    Returns (ev, n_synthetic): ev with one synthetic open per orphan close
+    prepended at the buffer start (t=0 in AHK exports), outermost first, so
+    the usual pairing nests them correctly.
+    """
+    if not len(ev.at):
+        return ev, 0
+    real_close = ~ev.is_open & (ev.frame >= 0)
+    walk = np.cumsum(np.where(ev.is_open, 1, np.where(real_close, -1, 0)))
+    low = np.minimum.accumulate(np.minimum(walk, 0))
+    prev_low = np.concatenate(([0], low[:-1]))
+    orphans = np.nonzero(real_close & (walk < prev_low))[0]
+    n = len(orphans)
+    if not n:
+        return ev, 0
+    return EventArrays(
+        np.concatenate((np.full(n, ev.at[0], dtype=ev.at.dtype), ev.at)),
+        np.concatenate((ev.frame[orphans][::-1], ev.frame)),
+        np.concatenate((np.ones(n, dtype=bool), ev.is_open)),
+    ), n
+
+
+def build_call_data(frames, ev, n_synthetic=0):
+    """Pair events into calls and aggregate per-function stats.
+
+    ev is an EventArrays. Opens are matched to closes, then self/total time
+    and caller attribution are computed as batched array operations. The
+    first n_synthetic events are opens added by reconstruct_wrapped; calls
+    that pair with them are marked truncated.
+
+    Returns a CallData:
+        func:  FuncStats arrays indexed by frame (calls, total/self/max/min us,
+               latency histogram)
+        calls: Calls table, one row per completed call
+        edges: CallerEdges, calls and time per (frame, caller) pair
+        paths: CallPaths, the call tree keyed by interned full stack path
+        event_depth, event_parent, event_top: per-event stack context
+    """
+    paired = _pair_events(ev) if len(ev.at) else None
+    if paired is None:
+        paired = _pair_events_seq(ev)
+    open_idx, close_idx, event_depth, event_parent = paired
+
+    order = np.argsort(close_idx, kind="stable")
+    open_idx = open_idx[order]
+    close_idx = close_idx[order]
+    n_calls = len(open_idx)
+
+    frame = ev.frame[open_idx].astype(np.int64)
+    start = ev.at[open_idx]
+    dur = ev.at[close_idx] - start
+    truncated = open_idx < n_synthetic
+
+    parent_open = event_parent[open_idx]
+    has_parent = parent_open >= 0
+    call_of_open = np.full(len(ev.at), -1, dtype=np.int64)
+    call_of_open[open_idx] = np.arange(n_calls)
+    parent = np.where(has_parent, call_of_open[parent_open], -1)
+    parent_frame = np.where(has_parent, ev.frame[parent_open], -1).astype(np.int64)
+
+    # Parents that closed get their children's time subtracted
+    linked = parent >= 0
+    child_us = np.bincount(parent[linked], weights=dur[linked], minlength=n_calls)
+    self_us = dur - child_us.astype(np.int64)
+
+    n_frames = max(len(frames), int(max(frame.max(), parent_frame.max())) + 1 if n_calls else 0)
+    max_us = np.zeros(n_frames, dtype=np.int64)
+    np.maximum.at(max_us, frame, dur)
+    min_us = np.full(n_frames, np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(min_us, frame, dur)
+    func = FuncStats(
+        calls=np.bincount(frame, minlength=n_frames),
+        total_us=np.bincount(frame, weights=dur, minlength=n_frames).astype(np.int64),
+        self_us=np.bincount(frame, weights=self_us, minlength=n_frames).astype(np.int64),
+        max_us=max_us,
+        min_us=min_us,
+        hist=np.bincount(
+            frame * HIST_BUCKETS + latency_bucket(dur), minlength=n_frames * HIST_BUCKETS
+        ).reshape(n_frames, HIST_BUCKETS),
+        truncated=np.bincount(frame[truncated], minlength=n_frames),
+    )
+    path_parent, path_frame, path_of_open = _intern_paths(ev, event_depth, event_parent)
+    path = path_of_open[open_idx]
+    n_paths = len(path_parent)
+    paths = CallPaths(
+        parent=path_parent,
+        frame=path_frame,
+        calls=np.bincount(path, minlength=n_paths),
+        total_us=np.bincount(path, weights=dur, minlength=n_paths).astype(np.int64),
+        self_us=np.bincount(path, weights=self_us, minlength=n_paths).astype(np.int64),
+    )
+
+    calls = Calls(frame, start, dur, self_us, parent, parent_frame, open_idx, close_idx, path, truncated)
+    return CallData(
+        func, calls, _caller_edges(calls, n_frames), paths,
+        event_depth, event_parent, _stack_tops(ev, open_idx, close_idx, event_parent),
+    )
+
+
+def _intern_paths(ev, event_depth, event_parent):
+    """Assign an integer path ID to every open event.
+
+    Works one stack level at a time: a level's paths are the unique
+    (parent path, frame) pairs among its opens, so the cost is a sort per
+    level rather than a string per call.
+
+    Returns (path_parent, path_frame, path_of_open); path_of_open is -1 for
+    events that are not opens.
+    """
+    n = len(ev.at)
+    path_of_open = np.full(n, -1, dtype=np.int64)
+    opens = np.nonzero(ev.is_open)[0]
+    if not len(opens):
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, path_of_open
+    n_frames = int(ev.frame[opens].max()) + 1
+    level = event_depth[opens]
+    order = np.argsort(level, kind="stable")
+    opens = opens[order]
+    bounds = np.searchsorted(level[order], np.arange(int(level.max()) + 2))
+
+    parents = []
+    frames = []
+    next_id = 0
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        sel = opens[lo:hi]
+        if not len(sel):
+            continue
+        parent_open = event_parent[sel]
+        parent_path = np.where(parent_open >= 0, path_of_open[np.maximum(parent_open, 0)], -1)
+        key = (parent_path + 1) * n_frames + ev.frame[sel]
+        uniq, inv = np.unique(key, return_inverse=True)
+        path_of_open[sel] = next_id + inv
+        parents.append(uniq // n_frames - 1)
+        frames.append(uniq % n_frames)
+        next_id += len(uniq)
+    return np.concatenate(parents), np.concatenate(frames), path_of_open
+
+
+def path_name(frames, paths, i, sep=" > "):
+    """Full path string for one interned path (root first)."""
+    parts = []
+    while i >= 0:
+        parts.append(frames[paths.frame[i]]["name"])
+        i = int(paths.parent[i])
+    return sep.join(reversed(parts))
+
+
+def path_names(frames, paths, sep=";"):
+    """Full path string for every interned path (root first)."""
+    names = []
+    for parent, fi in zip(paths.parent.tolist(), paths.frame.tolist()):
+        name = frames[fi]["name"]
+        names.append(names[parent] + sep + name if parent >= 0 else name)
+    return names
+
+
+def _stack_tops(ev, open_idx, close_idx, event_parent):
+    """Innermost open event on the stack after each event (-1 = empty).
+
+    An open becomes the top itself; a matched close hands the top back to
+    its open's parent; an ignored close leaves the stack as it was.
+    """
+    n = len(ev.at)
+    top = np.full(n, -1, dtype=np.int64)
+    known = ev.is_open.copy()
+    top[known] = np.nonzero(known)[0]
+    top[close_idx] = event_parent[open_idx]
+    known[close_idx] = True
+    last_known = np.maximum.accumulate(np.where(known, np.arange(n), -1))
+    return np.where(last_known >= 0, top[np.maximum(last_known, 0)], -1)
+
+
+def stack_at(ev, data, t_us):
+    """Open event indices on the stack at time t_us, outermost first.
+
+    Events at exactly t_us count as already happened.
+    """
+    i = int(np.searchsorted(ev.at, t_us, side="right")) - 1
+    stack = []
+    o = int(data.event_top[i]) if i >= 0 else -1
+    while o >= 0:
+        stack.append(o)
+        o = int(data.event_parent[o])
+    stack.reverse()
+    return stack
+
+
+def _caller_edges(calls, n_frames):
+    """Aggregate calls by (frame, caller frame).
+
+    Within a frame, rows are sorted by total_us (desc), ties in order of
+    first appearance.
+    """
+    key = calls.frame * (n_frames + 1) + (calls.parent_frame + 1)
+    uniq, first, inv = np.unique(key, return_index=True, return_inverse=True)
+    count = np.bincount(inv, minlength=len(uniq))
+    total = np.bincount(inv, weights=calls.dur, minlength=len(uniq)).astype(np.int64)
+    frame = uniq // (n_frames + 1)
+    order = np.lexsort((first, -total, frame))
+    return CallerEdges(frame[order], uniq[order] % (n_frames + 1) - 1, count[order], total[order])
+
+
+# Sidecar index: <profile>.qpidx, written next to the export on first load.
+# Layout: magic, u32 header length, JSON header, then every array of the
+# loaded profile at 64-byte aligned offsets so it can be memory-mapped.
+# Bump _INDEX_VERSION whenever CallData/EventArrays gain or change fields.
+_INDEX_MAGIC = b"QPIDX\x00\x00\x00"
+_INDEX_VERSION = 6
+_INDEX_SUFFIX = ".qpidx"
+_INDEX_ALIGN = 64
+
+# Row/event/frame index columns are int64 while building but stored as
+# int32 (ev.frame already bounds frames to int32); times stay int64
+_INDEX_INT32 = frozenset((
+    "data.calls.frame", "data.calls.parent", "data.calls.parent_frame",
+    "data.calls.open_idx", "data.calls.close_idx", "data.calls.path",
+    "data.edges.frame", "data.edges.caller", "data.edges.count",
+    "data.paths.parent", "data.paths.frame", "data.paths.calls",
+    "data.event_parent", "data.event_top",
+))
+_INT32 = np.iinfo(np.int32)
+
+
+def _source_key(path, content_hash=True):
+    """Identity of a profile file: size, mtime and (optionally) a content hash."""
+    st = os.stat(path)
+    key = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if content_hash:
+        h = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(_CHUNK_CHARS), b""):
+                h.update(chunk)
+        key["blake2b"] = h.hexdigest()
+    return key
+
+
+def _flatten_arrays(prefix, value, out):
+    """Collect the arrays of nested namedtuples as {"calls.frame": array}."""
+    if isinstance(value, np.ndarray):
+        out[prefix] = value
+        return
+    for field in value._fields:
+        _flatten_arrays(f"{prefix}.{field}" if prefix else field, getattr(value, field), out)
+
+
+def _unflatten_arrays(cls, prefix, arrays):
+    """Rebuild a namedtuple written by _flatten_arrays."""
+    values = []
+    for field in cls._fields:
+        name = f"{prefix}.{field}" if prefix else field
+        sub = _NESTED_TYPES.get(name)
+        values.append(_unflatten_arrays(sub, name, arrays) if sub else arrays[name])
+    return cls(*values)
+
+
+# Nested namedtuple fields of the persisted ("ev", "data") tree
+_NESTED_TYPES = {
+    "data.func": FuncStats,
+    "data.calls": Calls,
+    "data.edges": CallerEdges,
+    "data.paths": CallPaths,
+}
+
+
+def write_index(path, source, frames, profile, ev, data):
+    """Write the sidecar index for path. Failures (read-only dir) are silent."""
+    arrays = {}
+    _flatten_arrays("ev", ev, arrays)
+    _flatten_arrays("data", data, arrays)
+
+    layout = {}
+    offset = 0
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        if name in _INDEX_INT32 and (not arr.size or (_INT32.min <= arr.min() and arr.max() <= _INT32.max)):
+            arr = arr.astype(np.int32)
+        arrays[name] = arr
+        layout[name] = {"dtype": arr.dtype.str, "shape": list(arr.shape), "offset": offset}
+        offset += -(-arr.nbytes // _INDEX_ALIGN) * _INDEX_ALIGN
+
+    header = json.dumps({
+        "version": _INDEX_VERSION,
+        "source": source,
+        "frames": frames,
+        "profile": profile,
+        "arrays": layout,
+    }).encode("utf-8")
+    data_start = len(_INDEX_MAGIC) + 4 + len(header)
+    data_start = -(-data_start // _INDEX_ALIGN) * _INDEX_ALIGN
+
+    out_path = path + _INDEX_SUFFIX
+    tmp_path = out_path + ".tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(_INDEX_MAGIC)
+            f.write(len(header).to_bytes(4, "little"))
+            f.write(header)
+            for name, arr in arrays.items():
+                f.seek(data_start + layout[name]["offset"])
+                f.write(arr.tobytes())
+            f.truncate(data_start + offset)
+        os.replace(tmp_path, out_path)
+    except OSError:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+
+def _read_index_header(index_path):
+    with open(index_path, "rb") as f:
+        if f.read(len(_INDEX_MAGIC)) != _INDEX_MAGIC:
+            return None, 0
+        size = int.from_bytes(f.read(4), "little")
+        header = json.loads(f.read(size))
+    data_start = len(_INDEX_MAGIC) + 4 + size
+    return header, -(-data_start // _INDEX_ALIGN) * _INDEX_ALIGN
+
+
+def open_index(path):
+    """Open the sidecar index for path if it is current.
+
+    The index is current when its version matches and the profile's size and
+    mtime match. If only the mtime differs (file copied or touched), the
+    content hash decides. Returns (frames, profile, ev, data) with arrays
+    memory-mapped read-only, or None when missing or stale.
+    """
+    index_path = path + _INDEX_SUFFIX
+    try:
+        header, data_start = _read_index_header(index_path)
+    except (OSError, ValueError):
+        return None
+    if header is None or header.get("version") != _INDEX_VERSION:
+        return None
+
+    cached = header["source"]
+    current = _source_key(path, content_hash=False)
+    if cached["size"] != current["size"]:
+        return None
+    if cached["mtime_ns"] != current["mtime_ns"]:
+        if _source_key(path)["blake2b"] != cached["blake2b"]:
+            return None
+
+    raw = np.memmap(index_path, dtype=np.uint8, mode="r")
+    arrays = {}
+    for name, info in header["arrays"].items():
+        dtype = np.dtype(info["dtype"])
+        count = int(np.prod(info["shape"], dtype=np.int64))
+        start = data_start + info["offset"]
+        arr = raw[start:start + count * dtype.itemsize].view(dtype)
+        arrays[name] = arr.reshape(info["shape"])
+
+    ev = _unflatten_arrays(EventArrays, "ev", arrays)
+    data = _unflatten_arrays(CallData, "data", arrays)
+    return header["frames"], header["profile"], ev, data
+
+
+# Archive: compact binary form of a speedscope export (<name>.qpa).
+# Layout: magic, u32 header length, JSON header (frames, profile scalars,
+# codec, section table), then the payload at a 64-byte aligned offset.
+# The payload holds three sections, each 64-byte aligned:
+#   delta  zigzag varint of each event's time minus the previous one
+#   flags  open/close bit per event (np.packbits, 1 = open)
+#   frame  frame index per event, narrowest signed int that fits
+# With codec "none" the payload is memory-mapped and flags/frame are views;
+# otherwise it is zstd (if the zstandard module is installed) or zlib.
+_ARCHIVE_MAGIC = b"QPARC\x00\x00\x01"
+_ARCHIVE_VERSION = 1
+_ARCHIVE_SUFFIX = ".qpa"
+_ARCHIVE_CODECS = ("zstd", "zlib", "none")
+
+# The document fields _Profiler_Export writes around shared/profiles
+_SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+_SPEEDSCOPE_VERSION = "0.0.1"
+
+
+def _varint_encode(values):
+    """LEB128 bytes for a uint64 array, vectorized one byte position at a time."""
+    values = values.astype(np.uint64)
+    nbytes = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        nbytes += rest > 0
+        rest >>= np.uint64(7)
+    starts = np.cumsum(nbytes) - nbytes
+    out = np.empty(int(nbytes.sum()), dtype=np.uint8)
+    for k in range(int(nbytes.max(initial=0))):
+        sel = nbytes > k
+        low = (values[sel] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        more = (nbytes[sel] > k + 1).astype(np.uint64) << np.uint64(7)
+        out[starts[sel] + k] = (low | more).astype(np.uint8)
+    return out
+
+
+def _varint_decode(buf):
+    """Inverse of _varint_encode: uint8 array of LEB128 bytes -> uint64 array."""
+    ends = np.nonzero(buf < 0x80)[0]
+    if not len(ends):
+        return np.zeros(0, dtype=np.uint64)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    shift = np.arange(len(buf), dtype=np.int64) - np.repeat(starts, ends - starts + 1)
+    parts = (buf & 0x7F).astype(np.uint64) << (shift * 7).astype(np.uint64)
+    return np.add.reduceat(parts, starts)
+
+
+def _default_codec():
+    return "zstd" if zstandard is not None else "zlib"
+
+
+def is_archive(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(_ARCHIVE_MAGIC)) == _ARCHIVE_MAGIC
+    except OSError:
+        return False
+
+
+def write_archive(out_path, frames, profile, ev, codec=None):
+    """Write events as a compact archive. Returns the archive size in bytes."""
+    codec = codec or _default_codec()
+    if codec == "zstd" and zstandard is None:
+        raise ValueError("zstd codec needs the zstandard module (pip install zstandard)")
+
+    at = ev.at.astype(np.int64)
+    delta = np.diff(at, prepend=np.int64(0))
+    zigzag = (delta << 1) ^ (delta >> 63)
+    frame_dtype = np.result_type(np.min_scalar_type(-1), np.min_scalar_type(int(ev.frame.max(initial=0))))
+    sections = {
+        "delta": _varint_encode(zigzag.view(np.uint64)).tobytes(),
+        "flags": np.packbits(ev.is_open).tobytes(),
+        "frame": ev.frame.astype(frame_dtype).tobytes(),
+    }
+    layout = {}
+    chunks = []
+    offset = 0
+    for name, raw in sections.items():
+        pad = -offset % _INDEX_ALIGN
+        chunks.append(b"\x00" * pad)
+        offset += pad
+        layout[name] = {"offset": offset, "size": len(raw)}
+        chunks.append(raw)
+        offset += len(raw)
+    payload = b"".join(chunks)
+    if codec == "zstd":
+        payload = zstandard.ZstdCompressor(level=9).compress(payload)
+    elif codec == "zlib":
+        payload = zlib.compress(payload, 6)
+
+    header = json.dumps({
+        "version": _ARCHIVE_VERSION,
+        "codec": codec,
+        "events": len(at),
+        "frame_dtype": np.dtype(frame_dtype).str,
+        "raw_size": offset,
+        "sections": layout,
+        "frames": frames,
+        "profile": profile,
+    }).encode("utf-8")
+    data_start = len(_ARCHIVE_MAGIC) + 4 + len(header)
+    data_start = -(-data_start // _INDEX_ALIGN) * _INDEX_ALIGN
+    with open(out_path, "wb") as f:
+        f.write(_ARCHIVE_MAGIC)
+        f.write(len(header).to_bytes(4, "little"))
+        f.write(header)
+        f.seek(data_start)
+        f.write(payload)
+    return data_start + len(payload)
+
+
+def read_archive(path):
+    """Decode an archive straight into analysis arrays.
+
+    Returns (frames, profile, ev) like load_speedscope + load_event_arrays.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(_ARCHIVE_MAGIC)) != _ARCHIVE_MAGIC:
+            raise ValueError(f"{path}: not a profile archive")
+        size = int.from_bytes(f.read(4), "little")
+        header = json.loads(f.read(size))
+        if header.get("version") != _ARCHIVE_VERSION:
+            raise ValueError(f"{path}: unsupported archive version {header.get('version')}")
+        data_start = -(-(len(_ARCHIVE_MAGIC) + 4 + size) // _INDEX_ALIGN) * _INDEX_ALIGN
+        codec = header["codec"]
+        if codec == "none":
+            payload = np.memmap(path, dtype=np.uint8, mode="r", offset=data_start)
+        else:
+            f.seek(data_start)
+            blob = f.read()
+            if codec == "zstd":
+                if zstandard is None:
+                    raise ValueError(f"{path}: zstd archive needs the zstandard module (pip install zstandard)")
+                blob = zstandard.ZstdDecompressor().decompress(blob, max_output_size=header["raw_size"])
+            elif codec == "zlib":
+                blob = zlib.decompress(blob)
+            else:
+                raise ValueError(f"{path}: unknown archive codec {codec!r}")
+            payload = np.frombuffer(blob, dtype=np.uint8)
+
+    def section(name):
+        info = header["sections"][name]
+        return payload[info["offset"]:info["offset"] + info["size"]]
+
+    n = header["events"]
+    zigzag = _varint_decode(section("delta")).view(np.int64)
+    delta = (zigzag >> 1) ^ -(zigzag & 1)
+    frame = section("frame").view(np.dtype(header["frame_dtype"]))
+    ev = EventArrays(
+        np.cumsum(delta),
+        frame if frame.dtype == np.int32 else frame.astype(np.int32),
+        np.unpackbits(section("flags"), count=n).view(bool),
+    )
+    if len(ev.at) != n or len(ev.frame) != n:
+        raise ValueError(f"{path}: archive is truncated")
+    return header["frames"], header["profile"], ev
+
+
+class _ArrayEvents:
+    """(at, frame, type) stream over decoded event arrays; re-iterable like
+    SpeedscopeEvents."""
+
+    def __init__(self, ev):
+        self.ev = ev
+
+    def __iter__(self):
+        ev = self.ev
+        types = np.where(ev.is_open, "O", "C").tolist()
+        return zip(ev.at.tolist(), ev.frame.tolist(), types)
+
+
+def open_events(path):
+    """(frames, profile, events) for a speedscope export or an archive.
+
+    Speedscope events are streamed from disk; archive events are decoded
+    to arrays first (they are ~2 bytes/event on disk and 13 in memory).
+    """
+    if is_archive(path):
+        frames, profile, ev = read_archive(path)
+        return frames, profile, _ArrayEvents(ev)
+    return load_speedscope(path)
+
+
+def write_speedscope(out_path, frames, profile, events):
+    """Write an (at, frame, type) stream as speedscope JSON.
+
+    Uses the exact layout of _Profiler_Export (BOM, key order, no
+    whitespace), so exports round-trip through an archive byte for byte.
+    """
+    head = {"$schema": _SPEEDSCOPE_SCHEMA, "version": _SPEEDSCOPE_VERSION}
+    compact = {"separators": (",", ":"), "ensure_ascii": False}
+    with open(out_path, "w", encoding="utf-8-sig", newline="") as f:
+        f.write(json.dumps(head, **compact)[:-1])
+        f.write(',"shared":{"frames":' + json.dumps(frames, **compact) + '},"profiles":[')
+        f.write(json.dumps(profile, **compact)[:-1])
+        f.write(',"events":[' if profile else '"events":[')
+        sep = ""
+        batch = []
+        for at, frame, typ in events:
+            batch.append(f'{sep}{{"type":"{typ}","frame":{frame},"at":{at}}}')
+            sep = ","
+            if len(batch) >= 65536:
+                f.write("".join(batch))
+                batch.clear()
+        f.write("".join(batch))
+        f.write("]}]}")
+
+
+def cmd_archive(path, out_path, codec=None):
+    """Convert a speedscope export (or another archive) to an archive."""
+    if is_archive(path):
+        frames, profile, ev = read_archive(path)
+    else:
+        frames, profile, events = load_speedscope(path)
+        ev = load_event_arrays(events)
+    size = write_archive(out_path, frames, profile, ev, codec)
+    src = os.path.getsize(path)
+    if size < src:
+        ratio = f"{src / max(size, 1):.1f}x smaller than"
+    else:
+        ratio = f"{size / max(src, 1):.1f}x the size of"
+    print(f"Wrote {len(ev.at)} events to {out_path}: {size / 1024:.0f} KB ({ratio} {src / 1024:.0f} KB)")
+
+
+def cmd_to_speedscope(path, out_path):
+    """Convert an archive (or a speedscope export) back to speedscope JSON."""
+    frames, profile, events = open_events(path)
+    write_speedscope(out_path, frames, profile, events)
+    print(f"Wrote {out_path}")
+
+
+def load_profile(path, use_index=True, save_index=True):
+    """Load a profile, going through the sidecar index when possible.
+
+    On a miss (no index, stale index) the JSON is streamed (or the archive
+    decoded), opens lost to a ring-buffer wrap are reconstructed, everything
+    is aggregated and, unless save_index is off, a fresh index is written
+    for the next invocation.
+
+    Returns (frames, profile, ev, data).
+    """
+    if use_index:
+        cached = open_index(path)
+        if cached is not None:
+            return cached
+
+    save_index = use_index and save_index
+    source = _source_key(path) if save_index else None
+    if is_archive(path):
+        frames, profile, ev = read_archive(path)
+    else:
+        frames, profile, events = load_speedscope(path)
+        ev = load_event_arrays(events)
+    ev, n_synthetic = reconstruct_wrapped(ev)
+    data = build_call_data(frames, ev, n_synthetic)
+    if save_index:
+        write_index(path, source, frames, profile, ev, data)
+    return frames, profile, ev, data
+
+
+def _find_frame(frames, name):
+    """Frame index for a function name, or None."""
+    for i, f in enumerate(frames):
+        if f["name"] == name:
+            return i
+    return None
+
+
+def _frame_name(frames, fi):
+    return frames[fi]["name"] if fi >= 0 else "(top-level)"
+
+
+def _ranked_frames(data):
+    """Frame indices with at least one call, sorted by total time (desc).
+
+    Ties keep the order in which each frame first completed a call.
+    """
+    func = data.func
+    first_close = np.full(len(func.calls), len(data.calls.frame), dtype=np.int64)
+    seen, first_row = np.unique(data.calls.frame, return_index=True)
+    first_close[seen] = first_row
+    ranked = np.lexsort((first_close, -func.total_us))
+    return ranked[func.calls[ranked] > 0]
+
+
+def _callers_of(edges, fi):
+    """Caller rows for one frame: [(caller_frame, count, total_us)]."""
+    lo, hi = np.searchsorted(edges.frame, [fi, fi + 1])
+    return zip(edges.caller[lo:hi].tolist(), edges.count[lo:hi].tolist(), edges.total_us[lo:hi].tolist())
+
+
+def merge_func_stats(loaded):
+    """Merge per-function stats from several profiles by frame name.
+
+    loaded is an iterable of (frames, func) pairs. Histograms add, so the
+    merged percentiles are exact to bucket precision without keeping any
+    per-call data around. Returns (frames, func) over the union of names.
+    """
+    loaded = list(loaded)
+    names = {}
+    for frames, func in loaded:
+        for i, f in enumerate(frames[:len(func.calls)]):
+            if func.calls[i] > 0:
+                names.setdefault(f["name"], len(names))
+    n = len(names)
+    calls = np.zeros(n, dtype=np.int64)
+    total_us = np.zeros(n, dtype=np.int64)
+    self_us = np.zeros(n, dtype=np.int64)
+    max_us = np.zeros(n, dtype=np.int64)
+    min_us = np.full(n, np.iinfo(np.int64).max, dtype=np.int64)
+    hist = np.zeros((n, HIST_BUCKETS), dtype=np.int64)
+    truncated = np.zeros(n, dtype=np.int64)
+    for frames, func in loaded:
+        src = [i for i, f in enumerate(frames[:len(func.calls)]) if func.calls[i] > 0]
+        dst = [names[frames[i]["name"]] for i in src]
+        calls[dst] += func.calls[src]
+        total_us[dst] += func.total_us[src]
+        self_us[dst] += func.self_us[src]
+        max_us[dst] = np.maximum(max_us[dst], func.max_us[src])
+        min_us[dst] = np.minimum(min_us[dst], func.min_us[src])
+        hist[dst] += func.hist[src]
+        truncated[dst] += func.truncated[src]
+    merged_frames = [{"name": name} for name in names]
+    return merged_frames, FuncStats(calls, total_us, self_us, max_us, min_us, hist, truncated)
+
+
+def _print_summary(frames, session_us, func, ranked, locations=None):
+    profiled_us = int(func.self_us.sum())
     print(f"Session: {session_us / 1_000_000:.1f}s")
     print(
-        f"Profiled CPU: {sum(func_self.values()) / 1_000_000:.2f}s "
-        f"({sum(func_self.values()) / session_us * 100:.1f}%)"
+        f"Profiled CPU: {profiled_us / 1_000_000:.2f}s "
+        f"({profiled_us / session_us * 100:.1f}%)"
     )
+    n_truncated = int(func.truncated.sum())
+    if n_truncated:
+        print(
+            f"Ring buffer wrapped: {n_truncated} calls were already running at the buffer start; "
+            f"their opens are reconstructed there (~ = totals are lower bounds)"
+        )
     print()
     print(
         f"{'Function':<35} {'Calls':>6} {'Total ms':>10} {'Self ms':>10} "
-        f"{'Avg ms':>10} {'Max ms':>10}"
+        f"{'Avg ms':>10} {'Max ms':>10} {'p50':>8} {'p90':>8} {'p99':>8} {'p99.9':>8}"
+        + ("  Source" if locations is not None else "")
     )
-    print("-" * 87)
+    print("-" * (163 if locations is not None else 123))
 
-    ranked = sorted(func_stats.keys(), key=lambda f: func_total.get(f, 0), reverse=True)
+    pct = hist_percentiles(func) / 1000
     for fi in ranked:
-        s = func_stats[fi]
         name = frames[fi]["name"]
-        total_ms = func_total.get(fi, 0) / 1000
-        self_ms = func_self.get(fi, 0) / 1000
-        avg_ms = (s["total_us"] / s["calls"] / 1000) if s["calls"] else 0
-        max_ms = s["max_us"] / 1000
+        label = name + (" ~" if func.truncated[fi] else "")
+        n = func.calls[fi]
+        total_ms = func.total_us[fi] / 1000
+        self_ms = func.self_us[fi] / 1000
+        avg_ms = func.total_us[fi] / n / 1000
+        max_ms = func.max_us[fi] / 1000
+        p50, p90, p99, p999 = pct[fi]
+        source = f"  {format_location(locations.get(name))}" if locations is not None else ""
         print(
-            f"{name:<35} {s['calls']:>6} {total_ms:>10.2f} {self_ms:>10.2f} "
-            f"{avg_ms:>10.2f} {max_ms:>10.2f}"
+            f"{label:<35} {n:>6} {total_ms:>10.2f} {self_ms:>10.2f} "
+            f"{avg_ms:>10.2f} {max_ms:>10.2f} {p50:>8.2f} {p90:>8.2f} {p99:>8.2f} {p999:>8.2f}{source}"
         )
 
 
-def cmd_callers(frames, func_stats, func_total, call_log):
+def cmd_summary(frames, profile, data, locations=None):
+    """Print summary table sorted by total time (percentiles in ms).
+
+    With locations (see source_locations), each row also names the
+    Profiler.Enter site and the size of the function around it.
+    """
+    session_us = profile["endValue"] - profile["startValue"]
+    _print_summary(frames, session_us, data.func, _ranked_frames(data), locations)
+
+
+def cmd_summary_merged(paths, use_index=True, locations=None):
+    """Summary table over several profiles, merged by function name."""
+    loaded = []
+    session_us = 0
+    for path in paths:
+        frames, profile, _, data = load_profile(path, use_index=use_index)
+        session_us += profile["endValue"] - profile["startValue"]
+        loaded.append((frames, data.func))
+    frames, func = merge_func_stats(loaded)
+    print(f"Merged {len(paths)} profiles")
+    ranked = np.argsort(-func.total_us, kind="stable")
+    _print_summary(frames, session_us, func, ranked, locations)
+
+
+def cmd_callers(frames, data):
     """Print caller breakdown for each function."""
-    ranked = sorted(func_stats.keys(), key=lambda f: func_total.get(f, 0), reverse=True)
-    for fi in ranked:
+    func = data.func
+    for fi in _ranked_frames(data):
         name = frames[fi]["name"]
-        calls = call_log[fi]
-        if not calls:
-            continue
 
-        # Group by caller
-        by_caller = defaultdict(lambda: {"count": 0, "total_us": 0})
-        for _, dur, parent in calls:
-            c = by_caller[parent]
-            c["count"] += 1
-            c["total_us"] += dur
-
-        print(f"\n{name} ({len(calls)} calls, {func_total[fi] / 1000:.1f}ms total)")
-        for caller, info in sorted(by_caller.items(), key=lambda x: x[1]["total_us"], reverse=True):
+        print(f"\n{name} ({func.calls[fi]} calls, {func.total_us[fi] / 1000:.1f}ms total)")
+        for caller, count, total_us in _callers_of(data.edges, fi):
             print(
-                f"  <- {caller:<40} {info['count']:>4} calls  "
-                f"{info['total_us'] / 1000:>8.1f}ms"
+                f"  <- {_frame_name(frames, caller):<40} {count:>4} calls  "
+                f"{total_us / 1000:>8.1f}ms"
             )
 
 
-def cmd_timeline(frames, events, t_start, t_end):
-    """Print event timeline for a time window."""
+def cmd_timeline(frames, ev, data, t_start, t_end):
+    """Print event timeline for a time window.
+
+    Events are in time order, so the window is located by binary search and
+    only its events are touched. Calls already open when the window starts
+    are listed first so the indentation has context.
+    """
     start_us = t_start * 1_000_000
     end_us = t_end * 1_000_000
 
-    stack = []
     print(f"Timeline: {t_start:.1f}s - {t_end:.1f}s")
+    lo = int(np.searchsorted(ev.at, start_us, side="left"))
+    hi = int(np.searchsorted(ev.at, end_us, side="right"))
+    # Reconstructed opens (reconstruct_wrapped) are the first events
+    n_synthetic = int(data.func.truncated.sum())
+    entry = [o for o in stack_at(ev, data, start_us) if o < lo]
+    if entry:
+        print("Already open at window start:")
+        for depth, o in enumerate(entry):
+            note = "  (opened before buffer start)" if o < n_synthetic else ""
+            print(f"  {ev.at[o] / 1_000_000:>8.4f}  {'  ' * depth}{frames[ev.frame[o]]['name']}{note}")
     print(f"{'t(s)':>8} {'Type':>5}  {'':>5}  Function")
     print("-" * 70)
 
-    for ev in events:
-        t = ev["at"]
-        frame = ev["frame"]
-        typ = ev["type"]
+    for i, t, frame, is_open, depth in zip(
+        range(lo, hi),
+        ev.at[lo:hi].tolist(),
+        ev.frame[lo:hi].tolist(),
+        ev.is_open[lo:hi].tolist(),
+        data.event_depth[lo:hi].tolist(),
+    ):
+        name = frames[frame]["name"]
+        typ = "OPEN" if is_open else "CLOSE"
+        note = "  (reconstructed: opened before buffer start)" if i < n_synthetic else ""
+        print(f"{t / 1_000_000:>8.4f} {typ:>5}  {depth:>5}  {'  ' * depth}{name}{note}")
 
-        if start_us <= t <= end_us:
-            depth = len(stack)
-            name = frames[frame]["name"]
-            if typ == "O":
-                print(f"{t / 1_000_000:>8.4f} {'OPEN':>5}  {depth:>5}  {'  ' * depth}{name}")
-            elif typ == "C":
-                print(f"{t / 1_000_000:>8.4f} {'CLOSE':>5}  {depth:>5}  {'  ' * depth}{name}")
 
-        if typ == "O":
-            stack.append((frame, t))
-        elif typ == "C":
-            if stack and stack[-1][0] == frame:
-                stack.pop()
+def cmd_stack_at(frames, ev, data, t):
+    """Print what was on the stack at time t (seconds)."""
+    t_us = t * 1_000_000
+    stack = stack_at(ev, data, t_us)
+    print(f"Stack at {t:.4f}s (depth {len(stack)})")
+    if not stack:
+        print("  (idle - nothing on the stack)")
+        return
 
+    # Completed calls among the stack entries report their full duration
+    calls = data.calls
+    rows = np.nonzero(np.isin(calls.open_idx, stack))[0]
+    total_by_open = dict(zip(calls.open_idx[rows].tolist(), calls.dur[rows].tolist()))
 
-def cmd_function(frames, func_stats, func_self, func_total, call_log, name):
+    print(f"  {'Entered(s)':>10} {'Running ms':>11} {'Total ms':>10}  Function")
+    for depth, o in enumerate(stack):
+        at = int(ev.at[o])
+        total = total_by_open.get(o)
+        total_str = f"{total / 1000:>10.2f}" if total is not None else f"{'(open)':>10}"
+        print(
+            f"  {at / 1_000_000:>10.4f} {(t_us - at) / 1000:>11.2f} {total_str}  "
+            f"{'  ' * depth}{frames[ev.frame[o]]['name']}"
+        )
+
+
+def cmd_function(frames, data, name, locations=None):
     """Deep dive on a single function."""
-    # Find frame index by name
-    fi = None
-    for i, f in enumerate(frames):
-        if f["name"] == name:
-            fi = i
-            break
+    fi = _find_frame(frames, name)
     if fi is None:
         print(f"Function '{name}' not found in profile.")
         print("Available:", ", ".join(f["name"] for f in frames))
         return
 
-    s = func_stats[fi]
-    total_ms = func_total.get(fi, 0) / 1000
-    self_ms = func_self.get(fi, 0) / 1000
-    calls = call_log[fi]
+    func, calls = data.func, data.calls
+    n = int(func.calls[fi])
+    total_ms = func.total_us[fi] / 1000
+    self_ms = func.self_us[fi] / 1000
 
     print(f"=== {name} ===")
-    print(f"  Calls: {s['calls']}")
+    if locations is not None:
+        print(f"  Source: {format_location(locations.get(name))}")
+    print(f"  Calls: {n}")
+    if n == 0:
+        return
     print(f"  Total: {total_ms:.1f}ms  Self: {self_ms:.1f}ms")
-    print(f"  Avg: {total_ms / s['calls']:.2f}ms  Max: {s['max_us'] / 1000:.2f}ms  Min: {s['min_us'] / 1000:.3f}ms")
+    if func.truncated[fi]:
+        print(f"  Truncated: {func.truncated[fi]} calls opened before the ring buffer start (~ below; lower bounds)")
+    print(f"  Avg: {total_ms / n:.2f}ms  Max: {func.max_us[fi] / 1000:.2f}ms  Min: {func.min_us[fi] / 1000:.3f}ms")
+    pct = hist_percentiles(func)[fi] / 1000
+    print("  " + "  ".join(f"p{p:g}: {v:.2f}ms" for p, v in zip(PERCENTILES, pct)))
 
     # Callers
-    by_caller = defaultdict(lambda: {"count": 0, "total_us": 0})
-    for _, dur, parent in calls:
-        c = by_caller[parent]
-        c["count"] += 1
-        c["total_us"] += dur
-    print(f"\n  Callers:")
-    for caller, info in sorted(by_caller.items(), key=lambda x: x[1]["total_us"], reverse=True):
-        print(f"    <- {caller:<38} {info['count']:>4} calls  {info['total_us'] / 1000:>8.1f}ms")
+    print("\n  Callers:")
+    for caller, count, total_us in _callers_of(data.edges, fi):
+        print(f"    <- {_frame_name(frames, caller):<38} {count:>4} calls  {total_us / 1000:>8.1f}ms")
 
     # Individual calls (top 15 by duration)
-    sorted_calls = sorted(calls, key=lambda x: x[1], reverse=True)
-    print(f"\n  Top calls (by duration):")
+    rows = np.nonzero(calls.frame == fi)[0]
+    top = rows[np.argsort(-calls.dur[rows], kind="stable")[:15]]
+    print("\n  Top calls (by duration):")
     print(f"    {'t(s)':>8} {'ms':>8}  Called by")
-    for start, dur, parent in sorted_calls[:15]:
-        print(f"    {start / 1_000_000:>8.3f} {dur / 1000:>8.1f}  {parent}")
+    for start, dur, parent, truncated in zip(
+        calls.start[top].tolist(), calls.dur[top].tolist(), calls.parent_frame[top].tolist(),
+        calls.truncated[top].tolist(),
+    ):
+        mark = "~" if truncated else " "
+        print(f"    {start / 1_000_000:>8.3f} {dur / 1000:>8.1f}{mark} {_frame_name(frames, parent)}")
 
 
-def cmd_reentrant(frames, events):
+def cmd_reentrant(frames, ev, data):
     """Find functions called while already on the stack (reentrancy)."""
-    stack_set = defaultdict(int)  # frame_idx -> depth count
-    reentrant = defaultdict(int)  # frame_idx -> reentrant call count
-    reentrant_examples = defaultdict(list)  # frame_idx -> [(time, parent)]
+    opens = np.nonzero(ev.is_open)[0]
+    frame = ev.frame[opens]
 
-    stack = []
-    for ev in events:
-        t = ev["at"]
-        frame = ev["frame"]
-        typ = ev["type"]
+    # Walk every open's ancestor chain at once, one stack level per step
+    reentrant = np.zeros(len(opens), dtype=bool)
+    anc = data.event_parent[opens]
+    while True:
+        live = anc >= 0
+        if not live.any():
+            break
+        reentrant |= live & (ev.frame[np.where(live, anc, 0)] == frame)
+        anc = np.where(live, data.event_parent[np.where(live, anc, 0)], -1)
 
-        if typ == "O":
-            if stack_set[frame] > 0:
-                reentrant[frame] += 1
-                parent_name = frames[stack[-1][0]]["name"] if stack else "(top-level)"
-                if len(reentrant_examples[frame]) < 5:
-                    reentrant_examples[frame].append((t, parent_name))
-            stack_set[frame] += 1
-            stack.append((frame, t))
-        elif typ == "C":
-            if stack and stack[-1][0] == frame:
-                stack.pop()
-                stack_set[frame] -= 1
-
-    if not reentrant:
+    if not reentrant.any():
         print("No reentrant calls detected.")
         return
 
+    hits = opens[reentrant]
+    hit_frames = ev.frame[hits]
+    fis, first, counts = np.unique(hit_frames, return_index=True, return_counts=True)
     print(f"{'Function':<35} {'Reentrant calls':>15}")
     print("-" * 55)
-    for fi, count in sorted(reentrant.items(), key=lambda x: x[1], reverse=True):
+    for fi, count in zip(fis[np.lexsort((first, -counts))].tolist(), counts[np.lexsort((first, -counts))].tolist()):
         name = frames[fi]["name"]
         print(f"{name:<35} {count:>15}")
-        for t, parent in reentrant_examples[fi]:
-            print(f"  e.g. t={t / 1_000_000:.3f}s via {parent}")
+        for i in hits[hit_frames == fi][:5].tolist():
+            parent = data.event_parent[i]
+            print(f"  e.g. t={ev.at[i] / 1_000_000:.3f}s via {_frame_name(frames, ev.frame[parent] if parent >= 0 else -1)}")
 
 
-def main():
-    parser = argparse.ArgumentParser(
-        description="Analyze Alt-Tabby speedscope profile exports"
+def reentry_episodes(calls):
+    """Pair every reentrant call with the invocation it interrupted.
+
+    A call re-enters when a frame of the same function is already on its
+    stack. For each such call, the nearest same-frame ancestor is the
+    outer invocation and the outer's child on the way down is the root of
+    the callback that re-entered (the timer, hook or message handler the
+    pump dispatched). The root is the reentrant call itself when nothing
+    instrumented sits in between. Only ancestors that closed are seen.
+
+    Returns (inner, outer, root) call-row arrays, one entry per reentrant
+    call, ordered by row.
+    """
+    n = len(calls.frame)
+    outer = np.full(n, -1, dtype=np.int64)
+    root = np.full(n, -1, dtype=np.int64)
+    below = np.arange(n, dtype=np.int64)
+    anc = calls.parent.astype(np.int64)
+    todo = np.nonzero(anc >= 0)[0]
+    while len(todo):
+        a = anc[todo]
+        hit = calls.frame[a] == calls.frame[todo]
+        outer[todo[hit]] = a[hit]
+        root[todo[hit]] = below[todo[hit]]
+        todo = todo[~hit]
+        below[todo] = anc[todo]
+        anc[todo] = calls.parent[anc[todo]]
+        todo = todo[anc[todo] >= 0]
+    inner = np.nonzero(outer >= 0)[0]
+    return inner, outer[inner], root[inner]
+
+
+def cmd_reentry_cost(frames, data, limit=15):
+    """What reentrancy costs, per (outer function, interrupting callback) pair.
+
+    An episode is one callback dispatched while an outer invocation was
+    suspended (Sleep, SendMessage and friends pump messages) that re-entered
+    the outer's function. Suspended time is the callback's duration. Extra
+    latency is how much longer the interrupted outer calls ran than that
+    function's uninterrupted median, capped at the suspended time and split
+    across an outer call's episodes by their suspended time.
+    """
+    calls = data.calls
+    n_frames = len(data.func.calls)
+    inner, outer, root = reentry_episodes(calls)
+    if not len(inner):
+        print("No reentrant calls detected.")
+        return
+
+    # One episode per callback root; every root's parent is its outer call
+    roots, first, reentered = np.unique(root, return_index=True, return_counts=True)
+    ep_outer = outer[first]
+    ep_inner = inner[first]
+    suspended = calls.dur[roots]
+
+    outers, ep_of_outer = np.unique(ep_outer, return_inverse=True)
+    outer_susp = np.bincount(ep_of_outer, weights=suspended)
+    interrupted = np.zeros(len(calls.frame), dtype=bool)
+    interrupted[outers] = True
+    clean = np.nonzero(~interrupted)[0]
+    baseline = _group_medians(calls.dur[clean].astype(np.float64), calls.frame[clean], n_frames)
+    base = baseline[calls.frame[outers]]
+    over = np.where(np.isnan(base), outer_susp, np.maximum(calls.dur[outers] - np.nan_to_num(base), 0))
+    outer_extra = np.minimum(over, outer_susp)
+    share = np.divide(suspended, outer_susp[ep_of_outer], out=np.zeros(len(roots)), where=outer_susp[ep_of_outer] > 0)
+    extra = outer_extra[ep_of_outer] * share
+
+    # Aggregate per (outer frame, callback root frame)
+    pair_key = calls.frame[ep_outer] * n_frames + calls.frame[roots]
+    pairs, pair_of = np.unique(pair_key, return_inverse=True)
+    n_pairs = len(pairs)
+    p_episodes = np.bincount(pair_of, minlength=n_pairs)
+    p_reentered = np.bincount(pair_of, weights=reentered, minlength=n_pairs).astype(np.int64)
+    p_susp = np.bincount(pair_of, weights=suspended, minlength=n_pairs)
+    p_extra = np.bincount(pair_of, weights=extra, minlength=n_pairs)
+    p_max = np.zeros(n_pairs, dtype=np.int64)
+    np.maximum.at(p_max, pair_of, suspended)
+    p_outers = np.bincount(np.unique(pair_of * len(outers) + ep_of_outer) // len(outers), minlength=n_pairs)
+    ranked = np.lexsort((-p_susp, -p_extra))[:limit]
+
+    print(
+        f"Reentrancy cost: {len(roots)} episodes in {n_pairs} (outer, inner) pairs; "
+        f"{len(outers)} outer calls interrupted, {suspended.sum() / 1000:.1f}ms suspended, "
+        f"{extra.sum() / 1000:.1f}ms extra latency"
     )
-    parser.add_argument("file", help="Path to speedscope JSON file")
-    parser.add_argument("--callers", action="store_true", help="Show caller breakdown per function")
-    parser.add_argument(
-        "--timeline", nargs=2, type=float, metavar=("START", "END"),
-        help="Show event timeline for time window (seconds)"
+    print()
+    print("  Inner: the callback the outer call was suspended in when its function re-entered")
+    print("  Suspended: callback duration  Extra: interrupted outer calls' excess over their clean median")
+    print()
+    print(
+        f"{'Outer':<30} {'Inner (callback)':<30} {'Episodes':>8} {'Outers':>6} {'Reent':>5} "
+        f"{'Susp ms':>9} {'Max ms':>8} {'Extra ms':>9}"
     )
-    parser.add_argument("--function", type=str, help="Deep dive on a specific function")
-    parser.add_argument("--reentrant", action="store_true", help="Find reentrant (nested) calls")
+    print("-" * 112)
+    for p in ranked.tolist():
+        fo, fr = divmod(int(pairs[p]), n_frames)
+        print(
+            f"{frames[fo]['name']:<30} {frames[fr]['name']:<30} {p_episodes[p]:>8} {p_outers[p]:>6} "
+            f"{p_reentered[p]:>5} {p_susp[p] / 1000:>9.2f} {p_max[p] / 1000:>8.2f} {p_extra[p] / 1000:>9.2f}"
+        )
+
+    # The chain is the interned path from the outer call down to the reentry
+    paths = data.paths
+    print()
+    print("Callback chains (outer > ... > re-entered call), worst episode per pair:")
+    for p in ranked.tolist():
+        fo, fr = divmod(int(pairs[p]), n_frames)
+        eps = np.nonzero(pair_of == p)[0]
+        spans = defaultdict(int)
+        for e in eps.tolist():
+            spans[(int(calls.path[ep_inner[e]]), int(calls.path[ep_outer[e]]))] += 1
+        chains = defaultdict(int)
+        for (leaf, top), count in spans.items():
+            parts = []
+            while leaf != top:
+                parts.append(frames[paths.frame[leaf]]["name"])
+                leaf = int(paths.parent[leaf])
+            parts.append(frames[fo]["name"])
+            chains[" > ".join(reversed(parts))] += count
+        print(f"  {frames[fo]['name']} <- {frames[fr]['name']}")
+        for chain, count in sorted(chains.items(), key=lambda kv: -kv[1])[:3]:
+            print(f"    {count:>5}x  {chain}")
+        w = int(eps[np.argmax(suspended[eps])])
+        o = int(ep_outer[w])
+        t0 = calls.start[o] / 1_000_000
+        t1 = (calls.start[o] + calls.dur[o]) / 1_000_000
+        print(
+            f"    worst: t={calls.start[roots[w]] / 1_000_000:.4f}s suspended {suspended[w] / 1000:.2f}ms, "
+            f"outer ran {calls.dur[o] / 1000:.2f}ms (clean median "
+            f"{'-' if np.isnan(baseline[fo]) else f'{baseline[fo] / 1000:.2f}ms'})   "
+            f"(--timeline {t0:.4f} {t1:.4f})"
+        )
+
+
+def cmd_folded(frames, data, out_path=None):
+    """Emit Brendan Gregg folded stacks: "A;B;C <self us>" per call path.
+
+    Feed to flamegraph.pl, speedscope, inferno, etc. Writes to out_path or
+    stdout.
+    """
+    paths = data.paths
+    names = path_names(frames, paths)
+    lines = (f"{names[i]} {v}" for i, v in enumerate(paths.self_us.tolist()) if v > 0)
+    if out_path:
+        with open(out_path, "w", encoding="utf-8", newline="\n") as f:
+            for line in lines:
+                f.write(line + "\n")
+        print(f"Wrote {int((paths.self_us > 0).sum())} folded stacks to {out_path}")
+    else:
+        for line in lines:
+            print(line)
+
+
+def cmd_paths(frames, data, limit, leaf=None):
+    """Print the hottest full call paths by total time.
+
+    With leaf, only paths ending in that function are shown, which separates
+    e.g. GUI_Repaint via a workspace switch from GUI_Repaint via a cosmetic
+    patch.
+    """
+    paths = data.paths
+    rows = np.nonzero(paths.calls > 0)[0]
+    if leaf is not None:
+        fi = _find_frame(frames, leaf)
+        if fi is None:
+            print(f"Function '{leaf}' not found in profile.")
+            return
+        rows = rows[paths.frame[rows] == fi]
+    rows = rows[np.argsort(-paths.total_us[rows], kind="stable")][:limit]
+
+    title = f"Hottest call paths{' ending in ' + leaf if leaf else ''}"
+    print(f"{title} ({int((paths.calls > 0).sum())} distinct paths)")
+    print(f"{'Calls':>7} {'Total ms':>10} {'Self ms':>10} {'Avg ms':>8}  Path")
+    print("-" * 90)
+    for i in rows.tolist():
+        n = int(paths.calls[i])
+        print(
+            f"{n:>7} {paths.total_us[i] / 1000:>10.2f} {paths.self_us[i] / 1000:>10.2f} "
+            f"{paths.total_us[i] / n / 1000:>8.2f}  {path_name(frames, paths, i)}"
+        )
+
+
+# Default frame budget for --jank: one frame at 60 Hz
+_FRAME_BUDGET_MS = 16.6
+
+
+def interaction_spans(ev, data, start_fi, end_fi):
+    """End-to-end spans from a START call to the END call that serves it.
+
+    A span opens when START is entered and closes when the first END call
+    that began at or after that moment returns (e.g. key hook -> the paint
+    that reflects it). STARTs arriving while a span is already waiting for
+    its END are coalesced into it, since the user only sees the first one's
+    latency.
+
+    Returns (span_start, span_end, coalesced, unterminated): arrays for the
+    spans plus how many STARTs were folded in per span, and the number of
+    STARTs with no END after them.
+    """
+    starts = np.sort(ev.at[ev.is_open & (ev.frame == start_fi)])
+    calls = data.calls
+    is_end = calls.frame == end_fi
+    end_open = calls.start[is_end]
+    end_close = end_open + calls.dur[is_end]
+
+    # Earliest close among END calls entered at or after each START
+    order = np.argsort(end_open, kind="stable")
+    end_open = end_open[order]
+    first_close = np.minimum.accumulate(np.append(end_close[order], np.iinfo(np.int64).max)[::-1])[::-1]
+    served_by = first_close[np.searchsorted(end_open, starts, side="left")]
+
+    done = served_by != np.iinfo(np.int64).max
+    unterminated = int((~done).sum())
+    starts = starts[done]
+    served_by = served_by[done]
+    # served_by is non-decreasing: equal runs share one END and coalesce
+    first = np.ones(len(starts), dtype=bool)
+    first[1:] = served_by[1:] != served_by[:-1]
+    heads = np.nonzero(first)[0]
+    coalesced = np.diff(np.append(heads, len(starts))) - 1
+    return starts[heads], served_by[heads], coalesced, unterminated
+
+
+def _print_latency_dist(label, dur_us, indent="  "):
+    pct = np.percentile(dur_us, [50, 90, 99]) / 1000
+    print(
+        f"{indent}{label:<10} n={len(dur_us):<6} mean={dur_us.mean() / 1000:.2f}ms  "
+        f"p50={pct[0]:.2f}ms  p90={pct[1]:.2f}ms  p99={pct[2]:.2f}ms  max={dur_us.max() / 1000:.2f}ms"
+    )
+
+
+def cmd_spans(frames, ev, data, spans):
+    """Print the latency distribution of each START -> END interaction span."""
+    for start_name, end_name in spans:
+        print(f"=== {start_name} -> {end_name} ===")
+        start_fi = _find_frame(frames, start_name)
+        end_fi = _find_frame(frames, end_name)
+        missing = [n for n, fi in ((start_name, start_fi), (end_name, end_fi)) if fi is None]
+        if missing:
+            print(f"  Not in profile: {', '.join(missing)}\n")
+            continue
+
+        begin, end, coalesced, unterminated = interaction_spans(ev, data, start_fi, end_fi)
+        if not len(begin):
+            print(f"  No completed spans ({unterminated} starts without an end)\n")
+            continue
+        dur = end - begin
+        _print_latency_dist("Latency", dur)
+        print(f"  Coalesced starts: {int(coalesced.sum())}  Unterminated: {unterminated}")
+        print("  Slowest:")
+        for i in np.argsort(-dur, kind="stable")[:5].tolist():
+            extra = f"  (+{coalesced[i]} coalesced)" if coalesced[i] else ""
+            print(
+                f"    t={begin[i] / 1_000_000:.4f}s  {dur[i] / 1000:>8.2f}ms  "
+                f"--timeline {begin[i] / 1_000_000:.3f} {end[i] / 1_000_000:.3f}{extra}"
+            )
+        print()
+
+
+def cmd_jank(frames, data, budget_ms, limit=20):
+    """Flag top-level call trees that overrun the frame budget.
+
+    For each offending tree, names the functions whose self time filled it,
+    so the fix targets the right descendant instead of the root.
+    """
+    calls = data.calls
+    budget_us = budget_ms * 1000
+    roots = np.nonzero((calls.parent_frame == -1) & (calls.dur > budget_us))[0]
+    n_roots = int((calls.parent_frame == -1).sum())
+    print(f"Frame budget: {budget_ms:.1f}ms  -  {len(roots)} of {n_roots} top-level call trees over budget")
+    if not len(roots):
+        return
+
+    by_root = np.bincount(calls.frame[roots])
+    print("  By root: " + ", ".join(
+        f"{frames[fi]['name']} x{by_root[fi]}" for fi in np.argsort(-by_root, kind="stable") if by_root[fi]
+    ))
+    print()
+
+    # Descendants of a call are the calls opened between its open and close
+    by_open = np.argsort(calls.open_idx, kind="stable")
+    open_sorted = calls.open_idx[by_open]
+    n_frames = len(data.func.calls)
+    print(f"{'t(s)':>9} {'ms':>8} {'xBudget':>7}  Root: where the time went (self ms)")
+    print("-" * 100)
+    for r in roots[np.argsort(-calls.dur[roots], kind="stable")][:limit].tolist():
+        lo, hi = np.searchsorted(open_sorted, [calls.open_idx[r], calls.close_idx[r]])
+        tree = by_open[lo:hi]
+        self_by_frame = np.bincount(calls.frame[tree], weights=calls.self_us[tree], minlength=n_frames)
+        top = [fi for fi in np.argsort(-self_by_frame, kind="stable")[:4] if self_by_frame[fi] > 0]
+        parts = ", ".join(f"{frames[fi]['name']} {self_by_frame[fi] / 1000:.1f}" for fi in top)
+        dur = calls.dur[r]
+        print(
+            f"{calls.start[r] / 1_000_000:>9.4f} {dur / 1000:>8.2f} {dur / budget_us:>6.1f}x  "
+            f"{frames[calls.frame[r]]['name']}: {parts}"
+        )
+
+
+def _busy_before(start, dur, edges):
+    """Busy time in [-inf, edge) for each edge, for non-overlapping calls sorted by start."""
+    cum = np.concatenate(([0], np.cumsum(dur)))
+    idx = np.searchsorted(start, edges, side="right") - 1
+    last = np.maximum(idx, 0)
+    return np.where(idx >= 0, cum[last] + np.clip(edges - start[last], 0, dur[last]), 0)
+
+
+def _top_share(frames, busy, roots, n=3):
+    """'Name 41%, Other 12%' for the biggest entries of a per-root busy vector."""
+    total = busy.sum()
+    if total <= 0:
+        return ""
+    order = np.argsort(-busy, kind="stable")[:n]
+    return ", ".join(
+        f"{frames[roots[i]]['name']} {busy[i] / total * 100:.0f}%" for i in order if busy[i] > 0
+    )
+
+
+def cmd_utilization(frames, profile, data, bucket_ms, threshold_pct, limit=20):
+    """Profiled busy time per fixed bucket, by top-level function, and bursts.
+
+    Top-level calls never overlap, so busy time up to any instant is a
+    cumulative sum plus the part of the one call straddling it; buckets are
+    differences of that at the bucket edges. A burst is a run of buckets at
+    or above threshold_pct; its window is printed as --timeline arguments.
+    Runs of buckets below the threshold are collapsed to one line each. With
+    more than limit bursts, only the limit busiest get a row; everything
+    between them is collapsed to one line, so the table stays ~2*limit rows.
+    """
+    calls = data.calls
+    bucket_us = bucket_ms * 1000
+    t0 = profile["startValue"]
+    n_buckets = max(1, math.ceil((profile["endValue"] - t0) / bucket_us))
+    edges = np.minimum(t0 + np.arange(n_buckets + 1) * bucket_us, profile["endValue"])
+
+    top = np.nonzero(calls.parent_frame == -1)[0]
+    top = top[np.argsort(calls.start[top], kind="stable")]
+    roots = np.unique(calls.frame[top])
+    busy = np.zeros((len(roots), n_buckets))
+    for i, fi in enumerate(roots.tolist()):
+        mine = top[calls.frame[top] == fi]
+        busy[i] = np.diff(_busy_before(calls.start[mine], calls.dur[mine], edges))
+    util = busy.sum(axis=0) / np.maximum(np.diff(edges), 1) * 100
+
+    hot = util >= threshold_pct
+    # Run boundaries: index where hot changes, plus both ends
+    cuts = np.concatenate(([0], np.nonzero(np.diff(hot))[0] + 1, [n_buckets]))
+    runs = list(zip(cuts[:-1].tolist(), cuts[1:].tolist()))
+    bursts = [(lo, hi) for lo, hi in runs if hot[lo]]
+
+    print(
+        f"Utilization: {n_buckets} buckets of {bucket_ms:g}ms, mean {util.mean():.1f}%, "
+        f"peak {util.max():.1f}%  -  {len(bursts)} bursts >= {threshold_pct:g}%"
+    )
+    print()
+    print(f"{'Start s':>9} {'End s':>9} {'ms':>8} {'Avg %':>6} {'Peak %':>6}  Dominant (share of busy time)")
+    print("-" * 100)
+    kept = set(sorted(bursts, key=lambda r: -busy[:, r[0]:r[1]].sum())[:limit])
+    rows = []  # (lo, hi, bursts folded in)
+    for lo, hi in runs:
+        if (lo, hi) in kept or not rows or rows[-1][:2] in kept:
+            rows.append((lo, hi, int(hot[lo] and (lo, hi) not in kept)))
+        else:
+            rows[-1] = (rows[-1][0], hi, rows[-1][2] + int(hot[lo]))
+    for lo, hi, folded in rows:
+        seg = util[lo:hi]
+        if (lo, hi) in kept:
+            mark = "BURST"
+        elif folded:
+            mark = f"{folded} small"
+        else:
+            mark = f"{hi - lo} quiet" if hi - lo > 1 else "quiet"
+        print(
+            f"{edges[lo] / 1_000_000:>9.3f} {edges[hi] / 1_000_000:>9.3f} {(edges[hi] - edges[lo]) / 1000:>8.1f} "
+            f"{seg.mean():>6.1f} {seg.max():>6.1f}  {mark:<9} {_top_share(frames, busy[:, lo:hi].sum(axis=1), roots)}"
+        )
+    if len(bursts) > len(kept):
+        print(f"  ... {len(bursts) - len(kept)} smaller bursts folded into the rows between the {len(kept)} busiest")
+
+    if bursts:
+        print()
+        print("Longest bursts (paste into --timeline):")
+        for lo, hi in sorted(bursts, key=lambda r: edges[r[0]] - edges[r[1]])[:limit]:
+            print(
+                f"  --timeline {edges[lo] / 1_000_000:.3f} {edges[hi] / 1_000_000:.3f}"
+                f"  {(edges[hi] - edges[lo]) / 1000:.0f}ms  avg {util[lo:hi].mean():.0f}%  "
+                f"{_top_share(frames, busy[:, lo:hi].sum(axis=1), roots)}"
+            )
+
+
+# Functions with fewer calls than this have no distribution to be an outlier of
+_OUTLIER_MIN_CALLS = 20
+
+# Iglewicz & Hoaglin's cutoff for the modified z-score
+_OUTLIER_Z = 3.5
+
+
+def _group_medians(values, groups, n_groups):
+    """Median of values per group index (NaN for empty groups)."""
+    order = np.lexsort((values, groups))
+    v = values[order]
+    bounds = np.searchsorted(groups[order], np.arange(n_groups + 1))
+    lo, hi = bounds[:-1], bounds[1:]
+    med = np.full(n_groups, np.nan)
+    has = hi > lo
+    mid_lo = lo[has] + (hi[has] - lo[has] - 1) // 2
+    mid_hi = lo[has] + (hi[has] - lo[has]) // 2
+    med[has] = (v[mid_lo] + v[mid_hi]) / 2
+    return med
+
+
+def robust_z(calls, n_frames):
+    """Modified z-score of every call's duration within its own function.
+
+    z = 0.6745 * (dur - median) / MAD. When over half the calls share one
+    duration the MAD is 0, so the mean absolute deviation (scaled to match
+    a normal distribution) stands in. Calls of functions with too few calls
+    or no spread at all get z = 0.
+    """
+    dur = calls.dur.astype(np.float64)
+    med = _group_medians(dur, calls.frame, n_frames)
+    dev = np.abs(dur - med[calls.frame])
+    mad = _group_medians(dev, calls.frame, n_frames)
+    counts = np.bincount(calls.frame, minlength=n_frames)
+    mean_ad = np.bincount(calls.frame, weights=dev, minlength=n_frames) / np.maximum(counts, 1)
+    # 0.6745 / 0.7979 rescales the mean absolute deviation like the MAD
+    scale = np.where(mad > 0, mad, mean_ad * 0.7979 / 0.6745)
+    usable = (counts >= _OUTLIER_MIN_CALLS) & (scale > 0)
+    z = np.zeros(len(dur))
+    ok = usable[calls.frame]
+    z[ok] = 0.6745 * (dur[ok] - med[calls.frame[ok]]) / scale[calls.frame[ok]]
+    return z, med
+
+
+def cmd_outliers(frames, data, z_min=_OUTLIER_Z, limit=15):
+    """Calls far slower than their own function's usual duration.
+
+    Scans every function at once. For each outlier, prints the stack it was
+    entered from and the calls it made while it ran, so a stalled child
+    (an icon fetch inside a repaint) stands out from slow self time.
+    """
+    calls = data.calls
+    n_frames = len(data.func.calls)
+    z, med = robust_z(calls, n_frames)
+    hits = np.nonzero(z >= z_min)[0]
+    excess = calls.dur[hits] - med[calls.frame[hits]]
+    hits = hits[np.argsort(-excess, kind="stable")]
+
+    print(f"Outliers: {len(hits)} calls with robust z >= {z_min:g} (functions with >= {_OUTLIER_MIN_CALLS} calls)")
+    if not len(hits):
+        return
+    by_frame = np.bincount(calls.frame[hits], minlength=n_frames)
+    print("  By function: " + ", ".join(
+        f"{frames[fi]['name']} x{by_frame[fi]}" for fi in np.argsort(-by_frame, kind="stable") if by_frame[fi]
+    ))
+
+    by_open = np.argsort(calls.open_idx, kind="stable")
+    open_sorted = calls.open_idx[by_open]
+    for r in hits[:limit].tolist():
+        fi = int(calls.frame[r])
+        dur = int(calls.dur[r])
+        print()
+        print(
+            f"{frames[fi]['name']} at {calls.start[r] / 1_000_000:.4f}s: {dur / 1000:.2f}ms "
+            f"(median {med[fi] / 1000:.2f}ms, z {z[r]:.1f}, self {calls.self_us[r] / 1000:.2f}ms)"
+        )
+        print(f"  Stack: {path_name(frames, data.paths, int(calls.path[r]))}")
+
+        # Direct children sit between this call's open and close events
+        lo, hi = np.searchsorted(open_sorted, [calls.open_idx[r], calls.close_idx[r]])
+        tree = by_open[lo:hi]
+        kids = tree[calls.parent[tree] == r]
+        if not len(kids):
+            continue
+        kid_calls = np.bincount(calls.frame[kids], minlength=n_frames)
+        kid_us = np.bincount(calls.frame[kids], weights=calls.dur[kids], minlength=n_frames)
+        kid_max = np.zeros(n_frames, dtype=np.int64)
+        np.maximum.at(kid_max, calls.frame[kids], calls.dur[kids])
+        print(f"  {'Calls':>7} {'Total ms':>9} {'Max ms':>8} {'Median ms':>10}  Ran during it")
+        for k in np.argsort(-kid_us, kind="stable")[:6].tolist():
+            if not kid_calls[k]:
+                break
+            print(
+                f"  {kid_calls[k]:>7} {kid_us[k] / 1000:>9.2f} {kid_max[k] / 1000:>8.2f} "
+                f"{med[k] / 1000:>10.2f}  {frames[k]['name']}"
+            )
+
+
+def call_gaps(calls):
+    """Every stretch of a call's own time not covered by an instrumented child.
+
+    A call with children k1..kn has gaps start->k1, k1->k2, ..., kn->end; a
+    call with no children is one gap. Their lengths sum to the call's self
+    time. Returns (owner, gap_start, gap_us, after_frame, before_frame) arrays,
+    where after/before are the neighbouring children's frames (-1 = the
+    call's own entry/exit).
+    """
+    n = len(calls.frame)
+    kids = np.nonzero(calls.parent >= 0)[0]
+    kids = kids[np.lexsort((calls.start[kids], calls.parent[kids]))]
+    parent = calls.parent[kids]
+    end = calls.start + calls.dur
+
+    first = np.ones(len(kids), dtype=bool)
+    first[1:] = parent[1:] != parent[:-1]
+    prev_end = np.where(first, calls.start[parent], np.roll(end[kids], 1))
+    after = np.where(first, -1, np.roll(calls.frame[kids], 1))
+
+    last = np.ones(len(kids), dtype=bool)
+    last[:-1] = parent[:-1] != parent[1:]
+    tails = kids[last]
+    has_kids = np.zeros(n, dtype=bool)
+    has_kids[parent] = True
+    leaves = np.nonzero(~has_kids)[0]
+
+    owner = np.concatenate((parent, calls.parent[tails], leaves))
+    gap_start = np.concatenate((prev_end, end[tails], calls.start[leaves]))
+    gap_end = np.concatenate((calls.start[kids], end[calls.parent[tails]], end[leaves]))
+    after_frame = np.concatenate((after, calls.frame[tails], np.full(len(leaves), -1)))
+    before_frame = np.concatenate((calls.frame[kids], np.full(len(tails) + len(leaves), -1)))
+    return owner, gap_start, gap_end - gap_start, after_frame, before_frame
+
+
+def cmd_gaps(frames, data, limit=15):
+    """Where profiled time is not explained by instrumented callees.
+
+    Ranks functions by self time (time inside them but outside any child
+    Profiler.Enter), split into the time between children and the time of
+    calls with no instrumented children at all, then lists the longest
+    single uninstrumented windows - the next places to add markers.
+    """
+    calls, func = data.calls, data.func
+    n_frames = len(func.calls)
+    owner, gap_start, gap_us, after, before = call_gaps(calls)
+    owner_frame = calls.frame[owner]
+
+    has_kids = np.zeros(len(calls.frame), dtype=bool)
+    has_kids[calls.parent[calls.parent >= 0]] = True
+    inner = has_kids[owner]
+    between_us = np.bincount(owner_frame[inner], weights=gap_us[inner], minlength=n_frames)
+    max_gap = np.zeros(n_frames, dtype=np.int64)
+    np.maximum.at(max_gap, owner_frame, gap_us)
+    inner_calls = np.bincount(calls.frame[has_kids], minlength=n_frames)
+
+    ranked = np.argsort(-func.self_us, kind="stable")
+    profiled = func.self_us.sum()
+    print(f"Instrumentation gaps: {profiled / 1000:.1f}ms profiled self time in {int((func.calls > 0).sum())} functions")
+    print()
+    print("  Around kids: self time before/between/after instrumented children (uninstrumented callees)")
+    print("  Leaf: self time of calls with no instrumented children at all")
+    print()
+    print(
+        f"{'Function':<35} {'Self ms':>9} {'Self %':>7} {'Around kids':>11} {'Leaf ms':>9} "
+        f"{'Parents':>7} {'Max gap':>8}"
+    )
+    print("-" * 92)
+    for fi in ranked[:limit].tolist():
+        if func.calls[fi] == 0:
+            break
+        self_us = func.self_us[fi]
+        print(
+            f"{frames[fi]['name']:<35} {self_us / 1000:>9.2f} "
+            f"{self_us / func.total_us[fi] * 100 if func.total_us[fi] else 0:>6.1f}% "
+            f"{between_us[fi] / 1000:>11.2f} {(self_us - between_us[fi]) / 1000:>9.2f} "
+            f"{inner_calls[fi]:>7} {max_gap[fi] / 1000:>8.2f}"
+        )
+
+    print()
+    print("Largest uninstrumented windows (add Profiler.Enter/Leave here):")
+    print(f"  {'t(s)':>9} {'ms':>8}  Inside: between")
+    for g in np.argsort(-gap_us, kind="stable")[:limit].tolist():
+        r = int(owner[g])
+        lo = "entry" if after[g] < 0 else f"{frames[after[g]]['name']} returns"
+        hi = "exit" if before[g] < 0 else f"{frames[before[g]]['name']} starts"
+        t0 = gap_start[g] / 1_000_000
+        t1 = (gap_start[g] + gap_us[g]) / 1_000_000
+        print(
+            f"  {t0:>9.4f} {gap_us[g] / 1000:>8.2f}  {path_name(frames, data.paths, int(calls.path[r]))}: "
+            f"{lo} -> {hi}   (--timeline {t0:.4f} {t1:.4f})"
+        )
+
+
+# profile_YYYYMMDD_HHMMSS.speedscope.json (see _Profiler_Export)
+_RX_PROFILE_TIME = re.compile(r"(\d{8})_(\d{6})")
+
+
+def _profile_time_key(path):
+    """Sort key and label from the timestamp in a profile's file name.
+
+    Files without one sort after all timestamped files, by mtime.
+    """
+    m = _RX_PROFILE_TIME.search(os.path.basename(path))
+    if m:
+        d, t = m.groups()
+        label = f"{d[:4]}-{d[4:6]}-{d[6:]} {t[:2]}:{t[2:4]}:{t[4:]}"
+        return (0, d + t), label
+    return (1, f"{os.path.getmtime(path):020.6f}"), os.path.basename(path)
+
+
+def _batch_load(path, use_index):
+    """Process-pool worker: per-function aggregates of one profile."""
+    try:
+        frames, profile, _, data = load_profile(path, use_index=use_index)
+    except (OSError, ValueError, KeyError) as e:
+        return path, None, f"{type(e).__name__}: {e}"
+    session_us = profile["endValue"] - profile["startValue"]
+    func = FuncStats(*(np.array(a) for a in data.func))
+    return path, (frames, session_us, func), None
+
+
+def cmd_batch(pattern, top, jobs, use_index=True, locations=None):
+    """Analyze a directory or glob of profiles in parallel.
+
+    Prints the merged summary, then a trend table per top function with one
+    row per file in file-name timestamp order.
+    """
+    if os.path.isdir(pattern):
+        paths = glob.glob(os.path.join(pattern, "*.speedscope.json"))
+        paths += glob.glob(os.path.join(pattern, "*" + _ARCHIVE_SUFFIX))
+    else:
+        paths = glob.glob(pattern)
+    if not paths:
+        print(f"No profiles match {pattern}")
+        return
+
+    results = {}
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for path, res, err in pool.map(_batch_load, paths, [use_index] * len(paths)):
+            if err:
+                print(f"Skipped {path}: {err}")
+            else:
+                results[path] = res
+    if not results:
+        return
+
+    ordered = sorted(results, key=lambda p: _profile_time_key(p)[0])
+    merged_frames, merged = merge_func_stats((results[p][0], results[p][2]) for p in ordered)
+    session_us = sum(results[p][1] for p in ordered)
+    print(f"Batch: {len(ordered)} profiles")
+    _print_summary(merged_frames, session_us, merged, np.argsort(-merged.total_us, kind="stable"), locations)
+
+    top_frames = [merged_frames[fi]["name"] for fi in np.argsort(-merged.total_us, kind="stable")[:top]]
+    per_file = []
+    for path in ordered:
+        frames, file_session_us, func = results[path]
+        by_name = {f["name"]: i for i, f in enumerate(frames[:len(func.calls)])}
+        per_file.append((_profile_time_key(path)[1], file_session_us, func, hist_percentiles(func), by_name))
+
+    for name in top_frames:
+        print(f"\n{name}")
+        print(f"  {'Profile':<20} {'Session s':>9} {'Calls':>7} {'Calls/s':>8} {'Total ms':>10} {'Self ms':>10} {'Self %':>7} {'p99 ms':>8}")
+        first_p99 = None
+        last_p99 = None
+        for label, file_session_us, func, pct, by_name in per_file:
+            fi = by_name.get(name)
+            secs = file_session_us / 1_000_000
+            if fi is None or func.calls[fi] == 0:
+                print(f"  {label:<20} {secs:>9.1f} {'-':>7}")
+                continue
+            n = int(func.calls[fi])
+            p99 = pct[fi][PERCENTILES.index(99)] / 1000
+            first_p99 = p99 if first_p99 is None else first_p99
+            last_p99 = p99
+            self_pct = func.self_us[fi] / file_session_us * 100 if file_session_us else 0
+            print(
+                f"  {label:<20} {secs:>9.1f} {n:>7} {n / secs if secs else 0:>8.1f} "
+                f"{func.total_us[fi] / 1000:>10.2f} {func.self_us[fi] / 1000:>10.2f} {self_pct:>6.1f}% {p99:>8.2f}"
+            )
+        if first_p99:
+            print(f"  p99 drift: {first_p99:.2f}ms -> {last_p99:.2f}ms ({(last_p99 - first_p99) / first_p99 * 100:+.0f}%)")
+
+
+# Budget keys: max_pNN_ms (any latency percentile), max_calls_per_sec,
+# max_self_share (fraction of the session spent in the function's self time)
+_RX_BUDGET_PCT = re.compile(r"^max_p(\d+(?:\.\d+)?)_ms$")
+_BUDGET_KEYS = ("max_calls_per_sec", "max_self_share")
+
+
+def load_budgets(path):
+    """Read a budget file: {"functions": {name: {key: limit}}}.
+
+    The name "*" applies its limits to every function that has no entry of
+    its own. Raises ValueError on unknown keys or non-numeric limits.
+    """
+    with open(path, "r", encoding="utf-8-sig") as f:
+        doc = json.load(f)
+    budgets = doc.get("functions") if isinstance(doc, dict) else None
+    if not isinstance(budgets, dict):
+        raise ValueError(f"{path}: expected an object with a \"functions\" map")
+    for name, limits in budgets.items():
+        if not isinstance(limits, dict):
+            raise ValueError(f"{path}: {name}: expected an object of limits")
+        for key, limit in limits.items():
+            if key not in _BUDGET_KEYS and not _RX_BUDGET_PCT.match(key):
+                raise ValueError(
+                    f"{path}: {name}: unknown budget '{key}' "
+                    f"(use max_pNN_ms, {', '.join(_BUDGET_KEYS)})"
+                )
+            if not isinstance(limit, (int, float)):
+                raise ValueError(f"{path}: {name}.{key}: limit must be a number")
+    return budgets
+
+
+def check_budgets(frames, profile, data, budgets):
+    """Evaluate budgets against a profile.
+
+    Returns (violations, checked) where violations is a list of
+    (function, budget key, actual, limit).
+    """
+    func = data.func
+    session_us = profile["endValue"] - profile["startValue"]
+    by_name = {f["name"]: i for i, f in enumerate(frames[:len(func.calls)]) if func.calls[i] > 0}
+    default = budgets.get("*", {})
+    targets = {name: budgets.get(name, default) for name in by_name} if default else {
+        name: limits for name, limits in budgets.items() if name in by_name
+    }
+
+    pct_keys = sorted({k for limits in targets.values() for k in limits if _RX_BUDGET_PCT.match(k)})
+    pct_values = [float(_RX_BUDGET_PCT.match(k).group(1)) for k in pct_keys]
+    pct = hist_percentiles(func, pct_values) if pct_keys else None
+
+    violations = []
+    checked = 0
+    for name, limits in targets.items():
+        fi = by_name[name]
+        for key, limit in limits.items():
+            if key == "max_calls_per_sec":
+                actual = func.calls[fi] / (session_us / 1_000_000) if session_us else 0.0
+            elif key == "max_self_share":
+                actual = func.self_us[fi] / session_us if session_us else 0.0
+            else:
+                actual = pct[fi][pct_keys.index(key)] / 1000
+            checked += 1
+            if actual > limit:
+                violations.append((name, key, float(actual), limit))
+    return violations, checked
+
+
+def _budget_detail(key, actual, limit):
+    if key == "max_self_share":
+        return f"self share {actual * 100:.2f}% > {limit * 100:.2f}%"
+    if key == "max_calls_per_sec":
+        return f"calls/s {actual:.1f} > {limit:g}"
+    return f"p{_RX_BUDGET_PCT.match(key).group(1)} {actual:.2f}ms > {limit:g}ms"
+
+
+def cmd_check(frames, profile, data, budget_path):
+    """Check a profile against a budget file. Returns the process exit code."""
+    try:
+        budgets = load_budgets(budget_path)
+    except (OSError, ValueError) as e:
+        print(f"Budget file error: {e}")
+        return 2
+    violations, checked = check_budgets(frames, profile, data, budgets)
+    session_s = (profile["endValue"] - profile["startValue"]) / 1_000_000
+    print(f"Budget check: {budget_path} ({session_s:.1f}s session, {checked} budgets checked)")
+    if not violations:
+        print("PASS")
+        return 0
+    for name, key, actual, limit in violations:
+        print(f"FAIL {name:<35} {_budget_detail(key, actual, limit)}")
+    print(f"{len(violations)} violation(s) in {len({v[0] for v in violations})} function(s)")
+    return 1
+
+
+# Seconds between directory scans in --watch
+_WATCH_POLL_S = 1.0
+
+
+def _watch_load(path, use_index, budgets):
+    """Process-pool worker for --watch: aggregates plus budget verdict.
+
+    Each profile is analyzed once, so no sidecar is written into the
+    (live) recorder directory; an existing one is still used.
+    """
+    try:
+        frames, profile, _, data = load_profile(path, use_index=use_index, save_index=False)
+    except (OSError, ValueError, KeyError) as e:
+        return path, None, f"{type(e).__name__}: {e}"
+    session_us = profile["endValue"] - profile["startValue"]
+    verdict = check_budgets(frames, profile, data, budgets) if budgets else None
+    func = FuncStats(*(np.array(a) for a in data.func))
+    return path, (frames, session_us, func, verdict), None
+
+
+def _watch_report(path, result, previous, top):
+    """Print one --watch report: headline, top movers vs previous, budgets."""
+    frames, session_us, func, verdict = result
+    secs = session_us / 1_000_000
+    label = _profile_time_key(path)[1]
+    print(
+        f"\n=== {os.path.basename(path)}  {secs:.1f}s session, "
+        f"{func.self_us.sum() / session_us * 100 if session_us else 0:.1f}% profiled CPU, "
+        f"{int(func.calls.sum())} calls"
+    )
+
+    if previous is not None:
+        prev_path, (prev_frames, prev_session_us, prev_func, _) = previous
+        prev_secs = prev_session_us / 1_000_000
+        p99 = hist_percentiles(func, [99])[:, 0] / 1000
+        prev_p99 = hist_percentiles(prev_func, [99])[:, 0] / 1000
+        prev_by_name = {f["name"]: i for i, f in enumerate(prev_frames[:len(prev_func.calls)])}
+        movers = []
+        seen = set()
+        for fi, f in enumerate(frames[:len(func.calls)]):
+            pi = prev_by_name.get(f["name"])
+            share = func.self_us[fi] / session_us * 100 if session_us else 0.0
+            prev_share = prev_func.self_us[pi] / prev_session_us * 100 if pi is not None and prev_session_us else 0.0
+            if func.calls[fi] == 0 and (pi is None or prev_func.calls[pi] == 0):
+                continue
+            seen.add(f["name"])
+            movers.append((f["name"], prev_share, share, pi, fi))
+        for name, pi in prev_by_name.items():
+            if name not in seen and prev_func.calls[pi] > 0:
+                movers.append((name, prev_func.self_us[pi] / prev_session_us * 100, 0.0, pi, None))
+        movers.sort(key=lambda m: -abs(m[2] - m[1]))
+
+        print(f"  Top movers vs {_profile_time_key(prev_path)[1]} (self % of session):")
+        for name, prev_share, share, pi, fi in movers[:top]:
+            was = f"{prev_p99[pi]:.2f}" if pi is not None and prev_func.calls[pi] else "-"
+            now = f"{p99[fi]:.2f}" if fi is not None and func.calls[fi] else "-"
+            rate_was = prev_func.calls[pi] / prev_secs if pi is not None and prev_secs else 0.0
+            rate_now = func.calls[fi] / secs if fi is not None and secs else 0.0
+            print(
+                f"    {name:<35} {prev_share:>6.2f}% -> {share:>6.2f}% ({share - prev_share:+.2f})  "
+                f"p99 {was} -> {now}ms  calls/s {rate_was:.1f} -> {rate_now:.1f}"
+            )
+    else:
+        print(f"  First profile of this watch ({label}); movers start with the next one")
+
+    if verdict is not None:
+        violations, checked = verdict
+        if not violations:
+            print(f"  Budgets: PASS ({checked} checked)")
+        for name, key, actual, limit in violations:
+            print(f"  Budget FAIL {name:<35} {_budget_detail(key, actual, limit)}")
+    sys.stdout.flush()
+
+
+def cmd_watch(directory, budget_path, top, jobs, use_index=True):
+    """Report on every new profile that lands in directory until Ctrl+C.
+
+    Files are picked up once their size has stopped changing between two
+    scans, analyzed in worker processes, and reported in the order they
+    appeared. The newest profile already present is the first baseline.
+    """
+    budgets = None
+    if budget_path:
+        try:
+            budgets = load_budgets(budget_path)
+        except (OSError, ValueError) as e:
+            print(f"Budget file error: {e}")
+            return 2
+
+    def scan():
+        found = glob.glob(os.path.join(directory, "*.speedscope.json"))
+        found += glob.glob(os.path.join(directory, "*" + _ARCHIVE_SUFFIX))
+        sizes = {}
+        for p in found:
+            try:
+                sizes[p] = os.path.getsize(p)
+            except OSError:
+                pass
+        return sizes
+
+    existing = scan()
+    seen = set(existing)
+    pending_sizes = {}
+    queue = []  # (path, future) in arrival order
+    previous = None
+    print(f"Watching {directory} for new profiles (Ctrl+C to stop)")
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        if existing:
+            newest = max(existing, key=lambda p: _profile_time_key(p)[0])
+            path, res, err = _watch_load(newest, use_index, None)
+            if res is not None:
+                previous = (path, res)
+                print(f"Baseline: {os.path.basename(newest)}")
+        sys.stdout.flush()
+        try:
+            while True:
+                for path, size in scan().items():
+                    if path in seen:
+                        continue
+                    # Still being written if it grew since the last scan
+                    if pending_sizes.get(path) != size or size == 0:
+                        pending_sizes[path] = size
+                        continue
+                    seen.add(path)
+                    pending_sizes.pop(path, None)
+                    queue.append((path, pool.submit(_watch_load, path, use_index, budgets)))
+
+                while queue and queue[0][1].done():
+                    path, future = queue.pop(0)
+                    _, res, err = future.result()
+                    if err:
+                        print(f"\nSkipped {os.path.basename(path)}: {err}")
+                        continue
+                    _watch_report(path, res, previous, top)
+                    previous = (path, res)
+                time.sleep(_WATCH_POLL_S)
+        except KeyboardInterrupt:
+            print("\nStopped watching")
+            for _, future in queue:
+                future.cancel()
+    return 0
+
+
+def _durations_by_frame(calls):
+    """Per-call durations grouped by frame, each group sorted ascending.
+
+    Returns (dur_sorted, frame_sorted); slice a frame's durations with
+    np.searchsorted(frame_sorted, [fi, fi + 1]).
+    """
+    order = np.lexsort((calls.dur, calls.frame))
+    return calls.dur[order], calls.frame[order]
+
+
+def _mann_whitney(a, b):
+    """Two-sided Mann-Whitney U test of b against a.
+
+    Normal approximation with tie and continuity correction, which is sound
+    for the sample sizes we gate on (_DIFF_MIN_CALLS per side).
+
+    Returns (p_value, p_superiority) where p_superiority is P(b > a), ties
+    counted half. 0.5 means no shift; > 0.5 means b tends to be slower.
+    """
+    n1, n2 = len(a), len(b)
+    x = np.concatenate((a, b))
+    _, inv, counts = np.unique(x, return_inverse=True, return_counts=True)
+    avg_rank = np.cumsum(counts) - (counts - 1) / 2.0
+    u2 = avg_rank[inv[n1:]].sum() - n2 * (n2 + 1) / 2.0
+    n = n1 + n2
+    ties = float(((counts.astype(np.float64) ** 3) - counts).sum())
+    var = n1 * n2 / 12.0 * ((n + 1) - ties / (n * (n - 1)))
+    delta = u2 - n1 * n2 / 2.0
+    if var <= 0:
+        return 1.0, 0.5
+    z = (abs(delta) - 0.5) / math.sqrt(var)
+    p = math.erfc(max(z, 0.0) / math.sqrt(2))
+    return p, u2 / (n1 * n2)
+
+
+def _rate_test(k1, t1, k2, t2):
+    """Two-sided test that k1 events in t1 seconds and k2 in t2 share a rate.
+
+    Conditioned on k1 + k2, k2 is Binomial(k1 + k2, t2 / (t1 + t2)) when the
+    Poisson rates are equal. Exact for small totals (sum of outcomes no more
+    likely than the observed one), normal approximation with continuity
+    correction above _RATE_EXACT_MAX. Returns the p-value.
+    """
+    n = k1 + k2
+    if n == 0 or t1 <= 0 or t2 <= 0:
+        return 1.0
+    q = t2 / (t1 + t2)
+    if n <= _RATE_EXACT_MAX:
+        pmf = [math.comb(n, k) * q ** k * (1 - q) ** (n - k) for k in range(n + 1)]
+        return min(1.0, sum(x for x in pmf if x <= pmf[k2] * (1 + 1e-9)))
+    z = (abs(k2 - n * q) - 0.5) / math.sqrt(n * q * (1 - q))
+    return math.erfc(max(z, 0.0) / math.sqrt(2))
+
+
+# Fewer calls than this on either side and the latency test is not run
+_DIFF_MIN_CALLS = 8
+
+# Call totals up to this get the exact binomial rate test
+_RATE_EXACT_MAX = 100
+
+
+def cmd_diff(base_path, cand_path, alpha, use_index=True):
+    """Compare two profiles function by function.
+
+    Functions are matched by name. Each row shows call count, total and self
+    time in both profiles plus median per-call latency, with a Mann-Whitney
+    test on the per-call durations deciding whether the latency shift is real.
+    Call counts get a rate test (calls per second of session), since the two
+    sessions rarely last equally long. Total time is calls x latency, so a
+    dTotal with neither test significant is noise.
+    """
+    sides = []
+    for path in (base_path, cand_path):
+        frames, profile, _, data = load_profile(path, use_index=use_index)
+        dur_sorted, frame_sorted = _durations_by_frame(data.calls)
+        by_name = {f["name"]: i for i, f in enumerate(frames) if data.func.calls[i] > 0}
+        session_s = (profile["endValue"] - profile["startValue"]) / 1_000_000
+        sides.append((data.func, dur_sorted, frame_sorted, by_name, session_s))
+
+    for label, path, side in (("Base", base_path, sides[0]), ("Candidate", cand_path, sides[1])):
+        func, _, _, by_name, session_s = side
+        print(f"{label + ':':<11} {path}  ({session_s:.1f}s, {int(func.calls.sum())} calls, {len(by_name)} functions)")
+    print(f"Latency test: Mann-Whitney U on per-call durations, alpha={alpha}")
+    print(f"Call test:    binomial on calls per second of session (p calls), alpha={alpha}")
+    print("dTotal is not tested itself: it is significant only through one of the two tests")
+    print()
+
+    rows = []
+    for name in set(sides[0][3]) | set(sides[1][3]):
+        stat = []
+        for func, dur_sorted, frame_sorted, by_name, _ in sides:
+            fi = by_name.get(name)
+            if fi is None:
+                stat.append(None)
+                continue
+            lo, hi = np.searchsorted(frame_sorted, [fi, fi + 1])
+            stat.append((int(func.calls[fi]), int(func.total_us[fi]), int(func.self_us[fi]), dur_sorted[lo:hi]))
+        rows.append((name, stat[0], stat[1]))
+
+    def total_delta(row):
+        _, b, c = row
+        return abs((c[1] if c else 0) - (b[1] if b else 0))
+
+    rows.sort(key=total_delta, reverse=True)
+
+    def rate_p(b, c):
+        p = _rate_test(b[0] if b else 0, sides[0][4], c[0] if c else 0, sides[1][4])
+        p_str = f"{p:.4f}" if p >= 0.0001 else "<.0001"
+        if p >= alpha:
+            return p_str, ""
+        rate_b = (b[0] if b else 0) / sides[0][4]
+        rate_c = (c[0] if c else 0) / sides[1][4]
+        return p_str, "MORE calls/s" if rate_c > rate_b else "fewer calls/s"
+
+    print(
+        f"{'Function':<30} {'Calls':>13} {'p calls':>7} {'Total ms':>19} {'dTotal':>7} {'Self ms':>19} "
+        f"{'p50 ms':>15} {'p':>7}  Verdict"
+    )
+    print("-" * 137)
+    for name, b, c in rows:
+        pc_str, rate_verdict = rate_p(b, c)
+        if b is None or c is None:
+            only = b or c
+            tag = "(gone)" if c is None else "(new)"
+            tag += f" {rate_verdict}" if rate_verdict else " ~ within call-count noise"
+            print(f"{name:<30} {only[0]:>13} {pc_str:>7} {only[1] / 1000:>19.2f} {'':>7} {only[2] / 1000:>19.2f} "
+                  f"{np.median(only[3]) / 1000:>15.3f} {'':>7}  {tag}")
+            continue
+        d_total = (c[1] - b[1]) / b[1] * 100 if b[1] else 0.0
+        calls = f"{b[0]}>{c[0]}"
+        total = f"{b[1] / 1000:.2f}>{c[1] / 1000:.2f}"
+        self_ = f"{b[2] / 1000:.2f}>{c[2] / 1000:.2f}"
+        p50 = f"{np.median(b[3]) / 1000:.3f}>{np.median(c[3]) / 1000:.3f}"
+        if b[0] < _DIFF_MIN_CALLS or c[0] < _DIFF_MIN_CALLS:
+            p_str, verdict = "", "too few calls"
+        else:
+            p, sup = _mann_whitney(b[3], c[3])
+            p_str = f"{p:.4f}" if p >= 0.0001 else "<.0001"
+            if p >= alpha:
+                verdict = "~ no significant change"
+            else:
+                verdict = f"{'SLOWER' if sup > 0.5 else 'faster'} (P(cand>base)={sup:.2f})"
+        if rate_verdict:
+            verdict = rate_verdict if verdict.startswith(("~", "too")) else f"{verdict}, {rate_verdict}"
+        print(f"{name:<30} {calls:>13} {pc_str:>7} {total:>19} {d_total:>+6.0f}% {self_:>19} {p50:>15} {p_str:>7}  {verdict}")
+
+
+# ========================= SOURCE INDEX =========================
+#
+# Frames are the strings passed to Profiler.Enter(name), so to point a
+# hotspot at code we index the AHK tree: every function definition (with
+# its line span) and every Profiler.Enter site (with the function it sits
+# in). The index lives in the user cache directory (one .qpsrc per tree,
+# never in the working tree) and is refreshed per file by size + mtime, so
+# only edited files are re-read.
+
+_SRC_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+_SRC_INDEX_SUFFIX = ".qpsrc"
+_SRC_INDEX_VERSION = 1
+
+_AHK_KEYWORDS = frozenset((
+    "if", "else", "while", "for", "loop", "switch", "case", "catch", "finally",
+    "try", "class", "return", "throw", "static", "global", "local", "until",
+    "not", "and", "or", "is", "in", "contains", "new", "super", "this",
+))
+_RX_AHK_STRING = re.compile(r'"[^"]*"|\'[^\']*\'')
+_RX_AHK_COMMENT = re.compile(r"(^|\s);.*$")
+_RX_AHK_CLASS = re.compile(r"^\s*class\s+(\w+)", re.IGNORECASE)
+_RX_AHK_FUNC = re.compile(r"^\s*(?:static\s+)?(\w+)\s*\((.*)$", re.IGNORECASE)
+_RX_PROFILER_ENTER = re.compile(r"Profiler\.Enter\(\s*(?:\"([^\"]*)\"|'([^']*)')?")
+
+
+def _ahk_clean(line):
+    """Code part of an AHK line: strings blanked, trailing comment removed."""
+    return _RX_AHK_COMMENT.sub("", _RX_AHK_STRING.sub('""', line)).strip()
 
-    args = parser.parse_args()
-    data = load_speedscope(args.file)
 
-    frames = data["shared"]["frames"]
-    profile = data["profiles"][0]
-    events = profile["events"]
+def scan_ahk_file(path):
+    """Function definitions and Profiler.Enter sites of one .ahk file.
+
+    Returns (functions, enters): functions are [name, first_line, last_line]
+    (1-based; methods as Class.Method), enters are [label, line, function]
+    where label is None when the name is not a string literal.
+    """
+    with open(path, "r", encoding="utf-8-sig", errors="replace") as f:
+        lines = f.read().splitlines()
+
+    functions = []
+    enters = []
+    depth = 0
+    in_block_comment = False
+    classes = []  # (name, depth inside its braces)
+    open_funcs = []  # [name, first_line, depth inside its braces]
+    pending = None  # definition whose "{" is on a following line
+    for i, raw in enumerate(lines, 1):
+        stripped = raw.strip()
+        if in_block_comment:
+            in_block_comment = not stripped.endswith("*/")
+            continue
+        if stripped.startswith("/*"):
+            in_block_comment = not stripped.endswith("*/")
+            continue
+        code = _ahk_clean(raw)
+        if not code:
+            continue
+
+        m = _RX_PROFILER_ENTER.search(raw)
+        if m and not stripped.startswith(";"):
+            label = m.group(1) if m.group(1) is not None else m.group(2)
+            enters.append([label, i, open_funcs[-1][0] if open_funcs else None])
+
+        if pending is not None and code.startswith("{"):
+            open_funcs.append([pending[0], pending[1], depth + 1])
+            pending = None
+        elif pending is not None:
+            pending = None
+
+        at_definition_level = not open_funcs and depth == (classes[-1][1] if classes else 0)
+        cm = _RX_AHK_CLASS.match(code) if at_definition_level else None
+        fm = _RX_AHK_FUNC.match(code) if at_definition_level and not cm else None
+        if cm and "{" in code:
+            classes.append((cm.group(1), depth + 1))
+        elif fm and fm.group(1).lower() not in _AHK_KEYWORDS:
+            name = f"{classes[-1][0]}.{fm.group(1)}" if classes else fm.group(1)
+            rest = fm.group(2)
+            if "=>" in rest:
+                functions.append([name, i, i])
+            elif rest.rstrip().endswith("{"):
+                open_funcs.append([name, i, depth + 1])
+            elif rest.rstrip().endswith(")"):
+                pending = (name, i)
+
+        depth += code.count("{") - code.count("}")
+        while open_funcs and depth < open_funcs[-1][2]:
+            name, first, _ = open_funcs.pop()
+            functions.append([name, first, i])
+        while classes and depth < classes[-1][1]:
+            classes.pop()
+    return functions, enters
+
+
+def _src_index_path(src_dir):
+    """Cache file for src_dir's index: %LOCALAPPDATA% or $XDG_CACHE_HOME/~/.cache."""
+    if os.name == "nt":
+        base = os.environ.get("LOCALAPPDATA") or os.path.expanduser(r"~\AppData\Local")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    src_dir = os.path.normcase(os.path.abspath(src_dir))
+    tag = hashlib.blake2b(src_dir.encode("utf-8"), digest_size=6).hexdigest()
+    name = os.path.basename(os.path.dirname(src_dir)) or "src"
+    return os.path.join(base, "alt-tabby", f"{name}-{tag}{_SRC_INDEX_SUFFIX}")
+
+
+def load_source_index(src_dir=_SRC_DIR, include_lib=False):
+    """Source index of src_dir, re-reading only files changed since last time.
+
+    Returns {relpath: {"functions": [...], "enters": [...]}} (see
+    scan_ahk_file). Files under lib/ (third-party) are skipped unless
+    include_lib is set.
+    """
+    index_path = _src_index_path(src_dir)
+    cached = {}
+    try:
+        with open(index_path, "r", encoding="utf-8") as f:
+            doc = json.load(f)
+        if doc.get("version") == _SRC_INDEX_VERSION:
+            cached = doc["files"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    files = {}
+    changed = False
+    for root, dirs, names in os.walk(src_dir):
+        if not include_lib:
+            dirs[:] = [d for d in dirs if d.lower() != "lib"]
+        for fname in names:
+            if not fname.lower().endswith(".ahk"):
+                continue
+            full = os.path.join(root, fname)
+            rel = os.path.relpath(full, os.path.dirname(src_dir)).replace(os.sep, "/")
+            st = os.stat(full)
+            entry = cached.get(rel)
+            if entry is None or entry["size"] != st.st_size or entry["mtime_ns"] != st.st_mtime_ns:
+                functions, enters = scan_ahk_file(full)
+                entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "functions": functions, "enters": enters}
+                changed = True
+            files[rel] = entry
+    if changed or len(files) != len(cached):
+        try:
+            os.makedirs(os.path.dirname(index_path), exist_ok=True)
+            with open(index_path, "w", encoding="utf-8") as f:
+                json.dump({"version": _SRC_INDEX_VERSION, "files": files}, f)
+        except OSError:
+            pass
+    return files
+
+
+def source_locations(files):
+    """Frame name -> (file, line, function, function lines, other sites).
+
+    A literal Profiler.Enter("X") site wins; otherwise a function named X
+    (or Class.X) is used. Size is the line span of the function containing
+    the site.
+    """
+    spans = {}
+    for rel, entry in files.items():
+        for name, first, last in entry["functions"]:
+            spans.setdefault(name, (rel, first, last))
+            if "." in name:
+                spans.setdefault(name.rsplit(".", 1)[1], (rel, first, last))
+
+    by_file_func = {(rel, name): (first, last) for rel, entry in files.items()
+                    for name, first, last in entry["functions"]}
+    locations = {}
+    for rel in sorted(files):
+        for label, line, func in files[rel]["enters"]:
+            if label is None:
+                continue
+            first, last = by_file_func.get((rel, func), (line, line))
+            if label in locations:
+                loc = locations[label]
+                locations[label] = loc[:4] + (loc[4] + 1,)
+            else:
+                locations[label] = (rel, line, func, last - first + 1, 0)
+    for name, (rel, first, last) in spans.items():
+        locations.setdefault(name, (rel, first, name, last - first + 1, 0))
+    return locations
+
+
+def format_location(loc):
+    """'src/gui/gui_paint.ahk:120 (84 lines)' for a source_locations entry."""
+    if loc is None:
+        return "(not found in src)"
+    rel, line, func, size, extra = loc
+    more = f", +{extra} more sites" if extra else ""
+    return f"{rel}:{line} ({size} lines{more})"
+
+
+# ========================= EXPORTERS =========================
+#
+# Exporters stream straight from the speedscope JSON with a bounded stack,
+# so they work on exports far larger than the analysis arrays would allow.
+
+
+def wrapped_opens(events):
+    """Streaming counterpart of reconstruct_wrapped for the exporters.
+
+    One pass over events with a counter. Returns (frames, t0): the frames
+    whose opens a ring-buffer wrap overwrote, outermost first, and the
+    buffer start time to open them at.
+    """
+    depth = 0
+    orphans = []
+    t0 = None
+    for at, frame, typ in events:
+        if t0 is None:
+            t0 = at
+        if typ == "O":
+            depth += 1
+        elif frame >= 0:
+            if depth:
+                depth -= 1
+            else:
+                orphans.append(frame)
+    return orphans[::-1], t0 or 0
+
+
+def iter_calls(events, paths, wrapped=((), 0)):
+    """Stream calls out of an (at, frame, type) event stream.
+
+    Uses the same pairing rules as build_call_data (a close must match the
+    frame on top of the stack). paths is a dict {(parent_path, frame): id}
+    that is grown as new stacks appear, so memory is bounded by stack depth
+    plus distinct paths, not by event count. wrapped is wrapped_opens()
+    output; those frames start on the stack, as reconstruct_wrapped does.
+
+    Yields (frame, start, dur, self_us, path_id, closed, truncated) in close
+    order. Calls still open at the end of the stream are yielded last
+    (innermost first) with closed=False, ending at the last timestamp seen;
+    truncated marks the calls seeded from wrapped.
+    """
+    stack = []  # [frame, start, child_us, path_id, truncated]
+    seed, t = wrapped
+    for frame in seed:
+        parent = stack[-1][3] if stack else -1
+        path = paths.setdefault((parent, frame), len(paths))
+        stack.append([frame, t, 0, path, True])
+    for t, frame, typ in events:
+        if typ == "O":
+            parent = stack[-1][3] if stack else -1
+            key = (parent, frame)
+            path = paths.get(key)
+            if path is None:
+                path = paths[key] = len(paths)
+            stack.append([frame, t, 0, path, False])
+        elif stack and stack[-1][0] == frame:
+            fr, start, child_us, path, truncated = stack.pop()
+            dur = t - start
+            if stack:
+                stack[-1][2] += dur
+            yield fr, start, dur, dur - child_us, path, True, truncated
+    while stack:
+        fr, start, child_us, path, truncated = stack.pop()
+        dur = t - start
+        if stack:
+            stack[-1][2] += dur
+        yield fr, start, dur, dur - child_us, path, False, truncated
+
+
+def export_chrome(path, out_path):
+    """Convert a speedscope export to Chrome Trace Event JSON ("X" events).
+
+    Loads in Perfetto (ui.perfetto.dev) and chrome://tracing.
+    """
+    frames, profile, events = open_events(path)
+    names = [json.dumps(f["name"]) for f in frames]
+    count = 0
+    with open(out_path, "w", encoding="utf-8", newline="\n") as f:
+        f.write('{"displayTimeUnit":"ms","traceEvents":[\n')
+        f.write('{"name":"thread_name","ph":"M","pid":1,"tid":1,"args":{"name":"Alt-Tabby"}}')
+        for fr, start, dur, _, _, closed, truncated in iter_calls(events, {}, wrapped_opens(events)):
+            flags = ([] if closed else ['"unclosed":true']) + (['"truncated":true'] if truncated else [])
+            extra = ',"args":{' + ",".join(flags) + "}" if flags else ""
+            f.write(f',\n{{"name":{names[fr]},"ph":"X","ts":{start},"dur":{dur},"pid":1,"tid":1{extra}}}')
+            count += 1
+        f.write("\n]}\n")
+    print(f"Wrote {count} trace events to {out_path}")
+
+
+def _pb_varint(value):
+    out = bytearray()
+    value &= (1 << 64) - 1  # negative int64 as two's complement
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _pb_int(field, value):
+    return _pb_varint(field << 3) + _pb_varint(value) if value else b""
+
+
+def _pb_bytes(field, payload):
+    return _pb_varint((field << 3) | 2) + _pb_varint(len(payload)) + payload
+
+
+def _pb_packed(field, values):
+    return _pb_bytes(field, b"".join(_pb_varint(v) for v in values)) if values else b""
+
+
+def export_pprof(path, out_path):
+    """Convert a speedscope export to a gzipped pprof profile.
+
+    One sample per distinct call path, leaf first, with values
+    [calls, self nanoseconds]. Works with `pprof -top`, `-diff_base`, etc.
+    """
+    frames, profile, events = open_events(path)
+    paths = {}
+    calls = defaultdict(int)
+    self_us = defaultdict(int)
+    for _, _, _, self_time, path_id, closed, _ in iter_calls(events, paths, wrapped_opens(events)):
+        calls[path_id] += closed
+        self_us[path_id] += self_time
+
+    strings = {"": 0}
+
+    def string_id(text):
+        return strings.setdefault(text, len(strings))
+
+    chunks = [
+        _pb_bytes(1, _pb_int(1, string_id("calls")) + _pb_int(2, string_id("count"))),
+        _pb_bytes(1, _pb_int(1, string_id("self")) + _pb_int(2, string_id("nanoseconds"))),
+    ]
+
+    # Walk each path back to the root: location IDs leaf first
+    by_id = [None] * len(paths)
+    for (parent, frame), pid in paths.items():
+        by_id[pid] = (parent, frame)
+    for pid in sorted(self_us):
+        locs = []
+        p = pid
+        while p >= 0:
+            parent, frame = by_id[p]
+            locs.append(frame + 1)
+            p = parent
+        sample = _pb_packed(1, locs) + _pb_packed(2, [calls[pid], self_us[pid] * 1000])
+        chunks.append(_pb_bytes(2, sample))
+
+    # One function + location per frame (IDs are frame index + 1)
+    for i in range(len(frames)):
+        chunks.append(_pb_bytes(4, _pb_int(1, i + 1) + _pb_bytes(4, _pb_int(1, i + 1))))
+    for i, f in enumerate(frames):
+        name_id = string_id(f["name"])
+        chunks.append(_pb_bytes(5, _pb_int(1, i + 1) + _pb_int(2, name_id) + _pb_int(3, name_id)))
+
+    duration_us = profile.get("endValue", 0) - profile.get("startValue", 0)
+    chunks.append(_pb_int(10, duration_us * 1000))
+    chunks.append(_pb_bytes(11, _pb_int(1, string_id("wall")) + _pb_int(2, string_id("nanoseconds"))))
+    table = sorted(strings, key=strings.get)
+    body = b"".join(chunks) + b"".join(_pb_bytes(6, t.encode("utf-8")) for t in table)
+    with gzip.open(out_path, "wb") as f:
+        f.write(body)
+    print(f"Wrote {len(self_us)} pprof samples ({len(frames)} functions) to {out_path}")
+
+
+# ========================= QUERY LANGUAGE =========================
+#
+#   query   := [expr] ["group by" FIELD] ["sort by" FIELD [asc|desc]] ["limit" N]
+#   expr    := term ("or" term)* ; term := factor ("and" factor)*
+#   factor  := "not" factor | "(" expr ")" | FIELD OP value | FIELD "in" value ".." value
+#   OP      := == != < <= > >= ~ !~           (~ is a regex search)
+#
+# Fields: name, caller, path (full stack "A > B > C"), dur, self, t (start),
+# end, depth, truncated (1 = opened before a ring-buffer wrap). Times take
+# us/ms/s suffixes; bare numbers are ms for dur/self and seconds for t/end.
+# Strings may be quoted or bare words. Inside quotes only \" (or \') and
+# \\ are escapes; other backslashes are kept, so "\d+" is a regex digit run.
+
+_RX_QUERY_TOKEN = re.compile(r"""\s*(?:
+    (?P<str>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+   |(?P<num>-?\d+(?:\.\d+)?(?:us|ms|s)?(?!\w))
+   |(?P<op>==|!=|<=|>=|!~|\.\.|[<>~()])
+   |(?P<word>[A-Za-z_][\w]*)
+)""", re.X)
+
+_QUERY_NAME_FIELDS = ("name", "caller", "path")
+_QUERY_NUM_FIELDS = {"dur": "ms", "self": "ms", "t": "s", "end": "s", "depth": "", "truncated": ""}
+_QUERY_UNITS = {"us": 1, "ms": 1000, "s": 1_000_000}
+_QUERY_GROUP_SORTS = ("count", "total", "self", "avg", "max", "name")
+
+
+class QueryError(ValueError):
+    pass
+
+
+def _tokenize_query(text):
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        m = _RX_QUERY_TOKEN.match(text, pos)
+        if not m or m.end() == pos:
+            raise QueryError(f"unexpected input at: {text[pos:pos + 20]!r}")
+        kind = m.lastgroup
+        val = m.group(kind)
+        if kind == "str":
+            # Only \<quote> and \\ are escapes; \d etc. reach the regex as written
+            val = re.sub(r"\\([%s\\])" % val[0], r"\1", val[1:-1])
+        tokens.append((kind, val))
+        pos = m.end()
+    return tokens
+
+
+class _QueryContext:
+    """Columns of the call table, with name-derived columns built on demand."""
+
+    def __init__(self, frames, data):
+        self.frames = frames
+        self.data = data
+        calls = data.calls
+        self.columns = {
+            "dur": calls.dur,
+            "self": calls.self_us,
+            "t": calls.start,
+            "end": calls.start + calls.dur,
+            "depth": data.event_depth[calls.open_idx].astype(np.int64),
+            "truncated": calls.truncated.astype(np.int64),
+        }
+        self._path_names = None
+
+    def path_names(self):
+        if self._path_names is None:
+            self._path_names = path_names(self.frames, self.data.paths, sep=" > ")
+        return self._path_names
+
+    def name_mask(self, field, op, value):
+        """Boolean mask over calls for a string comparison on a name field."""
+        calls = self.data.calls
+        if field == "path":
+            names = self.path_names()
+            column = calls.path
+            offset = 0
+        else:
+            # Caller -1 is "(top-level)"; shift so it indexes slot 0
+            names = ["(top-level)"] + [f["name"] for f in self.frames]
+            column = calls.frame if field == "name" else calls.parent_frame
+            offset = 1
+        if op in ("~", "!~"):
+            try:
+                rx = re.compile(value)
+            except re.error as e:
+                raise QueryError(f"bad regex {value!r}: {e}") from None
+            hit = np.fromiter((rx.search(n) is not None for n in names), dtype=bool, count=len(names))
+        elif op in ("==", "!="):
+            hit = np.fromiter((n == value for n in names), dtype=bool, count=len(names))
+        else:
+            raise QueryError(f"{field} supports ==, !=, ~, !~ (got {op})")
+        mask = hit[column + offset]
+        return ~mask if op in ("!=", "!~") else mask
+
+
+class _QueryParser:
+    def __init__(self, tokens, ctx):
+        self.tokens = tokens
+        self.pos = 0
+        self.ctx = ctx
+
+    def peek(self, offset=0):
+        i = self.pos + offset
+        return self.tokens[i] if i < len(self.tokens) else (None, None)
+
+    def next(self):
+        tok = self.peek()
+        if tok[0] is None:
+            raise QueryError("unexpected end of query")
+        self.pos += 1
+        return tok
+
+    def keyword(self, *words):
+        kind, val = self.peek()
+        if kind == "word" and val.lower() in words:
+            self.pos += 1
+            return val.lower()
+        return None
+
+    def at_clause(self):
+        kind, val = self.peek()
+        return kind is None or (kind == "word" and val.lower() in ("group", "sort", "limit"))
+
+    def expr(self):
+        mask = self.term()
+        while self.keyword("or"):
+            mask = mask | self.term()
+        return mask
+
+    def term(self):
+        mask = self.factor()
+        while self.keyword("and"):
+            mask = mask & self.factor()
+        return mask
+
+    def factor(self):
+        if self.keyword("not"):
+            return ~self.factor()
+        if self.peek() == ("op", "("):
+            self.next()
+            mask = self.expr()
+            if self.next() != ("op", ")"):
+                raise QueryError("expected )")
+            return mask
+        kind, field = self.next()
+        field = field.lower() if kind == "word" else field
+        if field not in _QUERY_NAME_FIELDS and field not in _QUERY_NUM_FIELDS:
+            raise QueryError(
+                f"unknown field {field!r} (fields: {', '.join(_QUERY_NAME_FIELDS + tuple(_QUERY_NUM_FIELDS))})"
+            )
+        if self.keyword("in"):
+            lo = self.number(field)
+            if self.next() != ("op", ".."):
+                raise QueryError("expected .. in range")
+            hi = self.number(field)
+            col = self.ctx.columns[field]
+            return (col >= lo) & (col <= hi)
+        kind, op = self.next()
+        if kind != "op" or op in ("(", ")", ".."):
+            raise QueryError(f"expected a comparison after {field}")
+        if field in _QUERY_NAME_FIELDS:
+            kind, value = self.next()
+            if kind not in ("str", "word", "num"):
+                raise QueryError(f"expected a name after {field} {op}")
+            return self.ctx.name_mask(field, op, value)
+        value = self.number(field)
+        col = self.ctx.columns[field]
+        ops = {"==": np.equal, "!=": np.not_equal, "<": np.less, "<=": np.less_equal,
+               ">": np.greater, ">=": np.greater_equal}
+        if op not in ops:
+            raise QueryError(f"{field} supports ==, !=, <, <=, >, >= (got {op})")
+        return ops[op](col, value)
+
+    def number(self, field):
+        kind, val = self.next()
+        if kind != "num":
+            raise QueryError(f"expected a number for {field}, got {val!r}")
+        m = re.match(r"(-?\d+(?:\.\d+)?)(us|ms|s)?$", val)
+        num, unit = float(m.group(1)), m.group(2)
+        default = _QUERY_NUM_FIELDS[field]
+        if not default:
+            if unit:
+                raise QueryError(f"{field} takes a plain number")
+            return num
+        return num * _QUERY_UNITS[unit or default]
+
+    def field_name(self, allowed):
+        kind, val = self.next()
+        if kind != "word" or val.lower() not in allowed:
+            raise QueryError(f"expected one of {', '.join(allowed)}, got {val!r}")
+        return val.lower()
+
+    def parse(self):
+        n_calls = len(self.ctx.data.calls.frame)
+        mask = np.ones(n_calls, dtype=bool) if self.at_clause() else self.expr()
+        group = sort = None
+        desc = True
+        limit = None
+        while self.peek()[0] is not None:
+            if self.keyword("group"):
+                if not self.keyword("by"):
+                    raise QueryError("expected 'group by'")
+                group = self.field_name(_QUERY_NAME_FIELDS)
+            elif self.keyword("sort"):
+                if not self.keyword("by"):
+                    raise QueryError("expected 'sort by'")
+                sort = self.next()[1].lower()
+                order = self.keyword("asc", "desc")
+                desc = order != "asc"
+            elif self.keyword("limit"):
+                kind, val = self.next()
+                if kind != "num" or not val.isdigit():
+                    raise QueryError("limit takes a whole number")
+                limit = int(val)
+            else:
+                raise QueryError(f"unexpected {self.peek()[1]!r}")
+        return mask, group, sort, desc, limit
+
+
+def run_query(frames, data, text):
+    """Compile and evaluate a query. Returns (ctx, mask, group, sort, desc, limit)."""
+    ctx = _QueryContext(frames, data)
+    parser = _QueryParser(_tokenize_query(text), ctx)
+    mask, group, sort, desc, limit = parser.parse()
+    if group:
+        if sort is not None and sort not in _QUERY_GROUP_SORTS:
+            raise QueryError(f"grouped results sort by {', '.join(_QUERY_GROUP_SORTS)}")
+    elif sort is not None and sort not in _QUERY_NUM_FIELDS:
+        raise QueryError(f"calls sort by {', '.join(_QUERY_NUM_FIELDS)}")
+    return ctx, mask, group, sort, desc, limit
+
+
+def cmd_query(frames, data, text):
+    """Print the calls (or groups of calls) matching a query."""
+    try:
+        ctx, mask, group, sort, desc, limit = run_query(frames, data, text)
+    except QueryError as e:
+        print(f"Query error: {e}")
+        return
+    calls = data.calls
+    rows = np.nonzero(mask)[0]
+    print(f"{len(rows)} of {len(calls.frame)} calls match")
+    if not len(rows):
+        return
+
+    if group is None:
+        col = ctx.columns[sort or "dur"]
+        key = col[rows]
+        order = np.argsort(-key if desc else key, kind="stable")
+        rows = rows[order][:limit if limit is not None else 50]
+        print(f"{'t(s)':>9} {'ms':>9} {'self ms':>9} {'depth':>5}  {'Function':<30} Caller")
+        print("-" * 90)
+        depth = ctx.columns["depth"]
+        for i in rows.tolist():
+            print(
+                f"{calls.start[i] / 1_000_000:>9.4f} {calls.dur[i] / 1000:>9.2f} "
+                f"{calls.self_us[i] / 1000:>9.2f} {depth[i]:>5}  {frames[calls.frame[i]]['name']:<30} "
+                f"{_frame_name(frames, calls.parent_frame[i])}"
+            )
+        return
+
+    key_col = {"name": calls.frame, "caller": calls.parent_frame, "path": calls.path}[group][rows]
+    keys, inv = np.unique(key_col, return_inverse=True)
+    dur = calls.dur[rows]
+    count = np.bincount(inv, minlength=len(keys))
+    total = np.bincount(inv, weights=dur, minlength=len(keys))
+    self_us = np.bincount(inv, weights=calls.self_us[rows], minlength=len(keys))
+    max_us = np.zeros(len(keys), dtype=np.int64)
+    np.maximum.at(max_us, inv, dur)
+    if group == "path":
+        labels = [path_name(frames, data.paths, k) for k in keys.tolist()]
+    else:
+        labels = [_frame_name(frames, k) for k in keys.tolist()]
+    sort_cols = {"count": count, "total": total, "self": self_us, "avg": total / count, "max": max_us}
+    if sort == "name":
+        order = np.argsort(np.array(labels, dtype=object), kind="stable")
+        order = order[::-1] if desc else order
+    else:
+        col = sort_cols[sort or "total"]
+        order = np.argsort(-col if desc else col, kind="stable")
+    print(f"{'Calls':>7} {'Total ms':>10} {'Self ms':>10} {'Avg ms':>8} {'Max ms':>8}  {group.capitalize()}")
+    print("-" * 90)
+    for g in order[:limit if limit is not None else 50].tolist():
+        print(
+            f"{count[g]:>7} {total[g] / 1000:>10.2f} {self_us[g] / 1000:>10.2f} "
+            f"{total[g] / count[g] / 1000:>8.2f} {max_us[g] / 1000:>8.2f}  {labels[g]}"
+        )
+
+
+class ProfileSession:
+    """One loaded profile answering text commands.
+
+    Shared by the --repl shell and the --serve socket server: the profile is
+    parsed (or its index mapped) once and every command runs against the
+    arrays already in memory.
+    """
+
+    COMMANDS = {
+        "summary": "summary",
+        "callers": "callers",
+        "function": "function NAME",
+        "timeline": "timeline START END      (seconds)",
+        "stack": "stack T                  (seconds)",
+        "reentrant": "reentrant",
+        "reentry": "reentry [N]",
+        "paths": "paths [N] [NAME]",
+        "span": "span START END",
+        "jank": "jank [BUDGET_MS]",
+        "util": "util [BUCKET_MS] [THRESHOLD_PCT]",
+        "outliers": "outliers [Z]",
+        "gaps": "gaps [N]",
+        "check": "check BUDGETS.json",
+        "query": 'query EXPR               (e.g. query name~"^GUI_" and dur>2ms limit 20)',
+    }
+
+    def __init__(self, path, use_index=True):
+        self.path = path
+        self.frames, self.profile, self.ev, self.data = load_profile(path, use_index=use_index)
+        self.names = sorted(f["name"] for f in self.frames)
+
+    def run(self, line):
+        """Execute one command line, printing its output to stdout."""
+        try:
+            words = shlex.split(line)
+        except ValueError as e:
+            print(f"Parse error: {e}")
+            return
+        if not words:
+            return
+        cmd, args = words[0].lower(), words[1:]
+        frames, profile, ev, data = self.frames, self.profile, self.ev, self.data
+        try:
+            if cmd == "summary":
+                cmd_summary(frames, profile, data)
+            elif cmd == "callers":
+                cmd_callers(frames, data)
+            elif cmd == "function" and len(args) == 1:
+                cmd_function(frames, data, args[0])
+            elif cmd == "timeline" and len(args) == 2:
+                cmd_timeline(frames, ev, data, float(args[0]), float(args[1]))
+            elif cmd == "stack" and len(args) == 1:
+                cmd_stack_at(frames, ev, data, float(args[0]))
+            elif cmd == "reentrant":
+                cmd_reentrant(frames, ev, data)
+            elif cmd == "reentry" and len(args) <= 1:
+                cmd_reentry_cost(frames, data, int(args[0]) if args else 15)
+            elif cmd == "paths" and len(args) <= 2:
+                limit = int(args[0]) if args and args[0].isdigit() else 20
+                leaf = args[-1] if args and not args[-1].isdigit() else None
+                cmd_paths(frames, data, limit, leaf=leaf)
+            elif cmd == "span" and len(args) == 2:
+                cmd_spans(frames, ev, data, [tuple(args)])
+            elif cmd == "jank" and len(args) <= 1:
+                cmd_jank(frames, data, float(args[0]) if args else _FRAME_BUDGET_MS)
+            elif cmd == "gaps" and len(args) <= 1:
+                cmd_gaps(frames, data, int(args[0]) if args else 15)
+            elif cmd == "outliers" and len(args) <= 1:
+                cmd_outliers(frames, data, float(args[0]) if args else _OUTLIER_Z)
+            elif cmd == "util" and len(args) <= 2:
+                cmd_utilization(frames, profile, data, *(float(a) for a in args + ["10", "50"][len(args):]))
+            elif cmd == "check" and len(args) == 1:
+                cmd_check(frames, profile, data, args[0])
+            elif cmd == "query":
+                cmd_query(frames, data, line.split(None, 1)[1] if args else "")
+            else:
+                print("Commands:")
+                for usage in self.COMMANDS.values():
+                    print(f"  {usage}")
+        except ValueError as e:
+            print(f"Error: {e}")
+
+    def complete(self, prefix):
+        """Frame names starting with prefix (tab completion)."""
+        lo = bisect.bisect_left(self.names, prefix)
+        hi = bisect.bisect_right(self.names, prefix + "\U0010ffff")
+        return self.names[lo:hi]
+
+
+class ProfileShell(cmd.Cmd):
+    """Interactive shell over a ProfileSession, with frame-name completion."""
+
+    def __init__(self, session):
+        super().__init__()
+        self.session = session
+        self.prompt = "profile> "
+        self.intro = (
+            f"{session.path}: {len(session.frames)} functions, {len(session.ev.at)} events. "
+            f"'help' for commands, 'quit' to exit."
+        )
+
+    def default(self, line):
+        self.session.run(line)
+
+    def do_help(self, arg):
+        self.session.run("help")
+
+    def do_quit(self, arg):
+        return True
+
+    do_exit = do_quit
+    do_EOF = do_quit
+
+    def emptyline(self):
+        pass
+
+    def completenames(self, text, *ignored):
+        return [c for c in list(ProfileSession.COMMANDS) + ["quit"] if c.startswith(text)]
+
+    def completedefault(self, text, line, begidx, endidx):
+        return self.session.complete(text)
+
+
+class _SessionRequestHandler(socketserver.StreamRequestHandler):
+    # One command line per connection; the reply is its output, then close
+    def handle(self):
+        line = self.rfile.readline().decode("utf-8", "replace").strip()
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.server.session.run(line)
+        self.wfile.write(out.getvalue().encode("utf-8"))
+
+
+def cmd_serve(session, port):
+    """Serve session commands on 127.0.0.1:port until interrupted."""
+    with socketserver.TCPServer(("127.0.0.1", port), _SessionRequestHandler) as server:
+        server.session = session
+        print(f"Serving {session.path} on 127.0.0.1:{port} (Ctrl+C to stop)")
+        print(f"  python tools/query_profile.py --ask {port} \"function GUI_Repaint\"")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def cmd_ask(port, line):
+    """Send one command to a --serve instance and print the reply."""
+    with socket.create_connection(("127.0.0.1", port)) as sock:
+        sock.sendall(line.encode("utf-8") + b"\n")
+        sock.shutdown(socket.SHUT_WR)
+        chunks = []
+        while True:
+            chunk = sock.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    sys.stdout.write(b"".join(chunks).decode("utf-8"))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Analyze Alt-Tabby speedscope profile exports"
+    )
+    parser.add_argument(
+        "files", nargs="*", metavar="file",
+        help="Path to speedscope JSON file (several files: merged summary)"
+    )
+    parser.add_argument("--callers", action="store_true", help="Show caller breakdown per function")
+    parser.add_argument(
+        "--timeline", nargs=2, type=float, metavar=("START", "END"),
+        help="Show event timeline for time window (seconds)"
+    )
+    parser.add_argument(
+        "--stack-at", type=float, metavar="T",
+        help="Show the call stack at time T (seconds)"
+    )
+    parser.add_argument("--function", type=str, help="Deep dive on a specific function")
+    parser.add_argument("--reentrant", action="store_true", help="Find reentrant (nested) calls")
+    parser.add_argument(
+        "--reentry-cost", nargs="?", type=int, const=15, metavar="N",
+        help="Suspended time and extra latency per (outer, interrupting callback) pair (top N, default 15)"
+    )
+    parser.add_argument(
+        "--paths", type=int, nargs="?", const=20, metavar="N",
+        help="Hottest full call paths (default 20; with --function: paths ending there)"
+    )
+    parser.add_argument(
+        "--folded", nargs="?", const="-", metavar="OUT",
+        help="Export folded stacks (self us per path) for flame graph tools"
+    )
+    parser.add_argument(
+        "--span", nargs=2, action="append", metavar=("START", "END"),
+        help="Interaction latency from entering START to the END call that serves it (repeatable)"
+    )
+    parser.add_argument(
+        "--jank", action="store_true",
+        help="Top-level call trees over the frame budget and what filled them"
+    )
+    parser.add_argument(
+        "--budget", type=float, default=_FRAME_BUDGET_MS, metavar="MS",
+        help=f"Frame budget for --jank (default: {_FRAME_BUDGET_MS})"
+    )
+    parser.add_argument(
+        "--utilization", nargs="?", type=float, const=10.0, metavar="MS",
+        help="Busy %% per MS bucket (default 10) by top-level function, with burst detection"
+    )
+    parser.add_argument(
+        "--burst-threshold", type=float, default=50.0, metavar="PCT",
+        help="Utilization at or above which buckets form a burst (default: 50)"
+    )
+    parser.add_argument(
+        "--outliers", nargs="?", type=float, const=_OUTLIER_Z, metavar="Z",
+        help=f"Calls far outside their function's distribution (robust z >= Z, default {_OUTLIER_Z})"
+    )
+    parser.add_argument(
+        "--gaps", nargs="?", type=int, const=15, metavar="N",
+        help="Self time not covered by instrumented callees, and the largest uninstrumented windows"
+    )
+    parser.add_argument(
+        "--query", metavar="EXPR",
+        help='Filter/group calls, e.g. \'name~"^GUI_" and dur>2ms sort by dur limit 20\''
+    )
+    parser.add_argument(
+        "--check", metavar="BUDGETS",
+        help="Check the profile against a JSON budget file; exit 1 on violations"
+    )
+    parser.add_argument(
+        "--batch", metavar="DIR|GLOB",
+        help="Analyze every profile in a directory (or glob) in parallel, with per-file trends"
+    )
+    parser.add_argument(
+        "--top", type=int, default=5, metavar="N",
+        help="Functions to show trend tables for in --batch, movers in --watch (default: 5)"
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=None, metavar="N",
+        help="Worker processes for --batch and --watch (default: CPU count)"
+    )
+    parser.add_argument(
+        "--watch", metavar="DIR",
+        help="Report on each new profile saved to DIR (top movers, --check budgets) until Ctrl+C"
+    )
+    parser.add_argument(
+        "--export-chrome", metavar="OUT",
+        help="Convert to Chrome Trace Event JSON (Perfetto, chrome://tracing); streaming"
+    )
+    parser.add_argument(
+        "--export-pprof", metavar="OUT",
+        help="Convert to gzipped pprof protobuf (pprof -top, -diff_base); streaming"
+    )
+    parser.add_argument(
+        "--archive", metavar="OUT",
+        help="Convert to a compact binary archive (.qpa) that all modes can read directly"
+    )
+    parser.add_argument(
+        "--codec", choices=_ARCHIVE_CODECS,
+        help="Archive compression (default: zstd if installed, else zlib)"
+    )
+    parser.add_argument(
+        "--to-speedscope", metavar="OUT",
+        help="Convert an archive back to speedscope JSON (lossless)"
+    )
+    parser.add_argument(
+        "--diff", nargs=2, metavar=("BASE", "CANDIDATE"),
+        help="Compare two profiles function by function with significance tests"
+    )
+    parser.add_argument(
+        "--alpha", type=float, default=0.01,
+        help="Significance level for --diff latency verdicts (default: 0.01)"
+    )
+    parser.add_argument(
+        "--repl", action="store_true",
+        help="Interactive shell: load once, then run commands against the in-memory profile"
+    )
+    parser.add_argument(
+        "--serve", type=int, metavar="PORT",
+        help="Serve shell commands on 127.0.0.1:PORT (query with --ask)"
+    )
+    parser.add_argument(
+        "--ask", nargs=2, metavar=("PORT", "COMMAND"),
+        help="Send one command (e.g. \"function GUI_Repaint\") to a --serve instance"
+    )
+    parser.add_argument(
+        "--source", nargs="?", const=_SRC_DIR, metavar="SRC",
+        help="Annotate summary/--function rows with file:line and function size from the AHK tree (default: src/)"
+    )
+    parser.add_argument(
+        "--no-index", action="store_true",
+        help="Parse the JSON directly; do not read or write the .qpidx sidecar (~1.5-1.7x the JSON's size)"
+    )
+
+    args = parser.parse_args()
+    if args.gaps is not None and args.gaps < 1:
+        parser.error("--gaps needs N >= 1")
+    if args.outliers is not None and args.outliers <= 0:
+        parser.error("--outliers needs Z > 0")
+    if args.utilization is not None and args.utilization <= 0:
+        parser.error("--utilization needs a bucket size MS > 0")
+    if args.paths is not None and args.paths < 1:
+        parser.error("--paths needs N >= 1")
+    if args.reentry_cost is not None and args.reentry_cost < 1:
+        parser.error("--reentry-cost needs N >= 1")
+    if args.ask:
+        cmd_ask(int(args.ask[0]), args.ask[1])
+        return
+    if args.watch:
+        sys.exit(cmd_watch(args.watch, args.check, args.top, args.jobs, use_index=not args.no_index))
+    locations = None
+    if args.source:
+        if not os.path.isdir(args.source):
+            parser.error(f"--source: {args.source} is not a directory")
+        locations = source_locations(load_source_index(os.path.abspath(args.source)))
+    if args.batch:
+        cmd_batch(args.batch, args.top, args.jobs, use_index=not args.no_index, locations=locations)
+        return
+    if args.diff:
+        cmd_diff(args.diff[0], args.diff[1], args.alpha, use_index=not args.no_index)
+        return
+    if not args.files:
+        parser.error("a profile file is required")
+    if args.export_chrome or args.export_pprof or args.archive or args.to_speedscope:
+        if len(args.files) != 1:
+            parser.error("exports take exactly one profile file")
+        if args.codec == "zstd" and zstandard is None:
+            parser.error("--codec zstd needs the zstandard module (pip install zstandard)")
+        if args.archive:
+            cmd_archive(args.files[0], args.archive, args.codec)
+        if args.to_speedscope:
+            cmd_to_speedscope(args.files[0], args.to_speedscope)
+        if args.export_chrome:
+            export_chrome(args.files[0], args.export_chrome)
+        if args.export_pprof:
+            export_pprof(args.files[0], args.export_pprof)
+        return
+    if len(args.files) > 1:
+        if (args.timeline or args.stack_at is not None or args.function or args.callers
+                or args.reentrant or args.paths is not None or args.folded or args.span or args.jank
+                or args.check or args.repl or args.serve or args.query is not None
+                or args.utilization is not None or args.outliers is not None or args.gaps is not None
+                or args.reentry_cost is not None):
+            parser.error("only the summary supports several files")
+        cmd_summary_merged(args.files, use_index=not args.no_index, locations=locations)
+        return
+
+    if args.repl or args.serve:
+        session = ProfileSession(args.files[0], use_index=not args.no_index)
+        if args.serve:
+            cmd_serve(session, args.serve)
+        else:
+            ProfileShell(session).cmdloop()
+        return
 
-    func_stats, func_self, func_total, call_log = build_call_data(frames, events)
+    frames, profile, ev, data = load_profile(args.files[0], use_index=not args.no_index)
 
-    if args.timeline:
-        cmd_timeline(frames, events, args.timeline[0], args.timeline[1])
+    if args.query is not None:
+        cmd_query(frames, data, args.query)
+    elif args.check:
+        sys.exit(cmd_check(frames, profile, data, args.check))
+    elif args.gaps is not None:
+        cmd_gaps(frames, data, args.gaps)
+    elif args.outliers is not None:
+        cmd_outliers(frames, data, args.outliers)
+    elif args.utilization is not None:
+        cmd_utilization(frames, profile, data, args.utilization, args.burst_threshold)
+    elif args.span or args.jank:
+        if args.span:
+            cmd_spans(frames, ev, data, args.span)
+        if args.jank:
+            cmd_jank(frames, data, args.budget)
+    elif args.folded:
+        cmd_folded(frames, data, None if args.folded == "-" else args.folded)
+    elif args.paths is not None:
+        cmd_paths(frames, data, args.paths, leaf=args.function)
+    elif args.timeline:
+        cmd_timeline(frames, ev, data, args.timeline[0], args.timeline[1])
+    elif args.stack_at is not None:
+        cmd_stack_at(frames, ev, data, args.stack_at)
     elif args.function:
-        cmd_function(frames, func_stats, func_self, func_total, call_log, args.function)
+        cmd_function(frames, data, args.function, locations)
     elif args.callers:
-        cmd_callers(frames, func_stats, func_total, call_log)
+        cmd_callers(frames, data)
     elif args.reentrant:
-        cmd_reentrant(frames, events)
+        cmd_reentrant(frames, ev, data)
+    elif args.reentry_cost is not None:
+        cmd_reentry_cost(frames, data, args.reentry_cost)
     else:
-        cmd_summary(frames, profile, func_stats, func_self, func_total)
+        cmd_summary(frames, profile, data, locations)
 
 
 if __name__ == "__main__":
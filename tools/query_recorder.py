@@ -0,0 +1,1296 @@
+# query_recorder.py - Flight recorder dump analyzer for Alt-Tabby
+#
+# Parses the fr_*.txt dumps the flight recorder writes on its hotkey (F12;
+# see docs/USING_RECORDER.md and _FR_DumpPhase2 in
+# src/gui/gui_flight_recorder.ahk) into structured records:
+#   - Header: dump time, QPC tick, build, user note
+#   - Global state and window list state (name = value snapshots)
+#   - Live items (hwnd, title, process, workspace, on-current flag)
+#   - Event trace, re-ordered oldest first, with every event's details
+#     parsed into named fields (hwnds as ints, their titles kept aside)
+#
+# and computes latency distributions for the key interactions:
+#   - ALT_DN -> STATE ACTIVE            Alt press until the session goes active
+#   - TAB_DN -> TAB_DECIDE_INNER        Tab press until the Alt+Tab decision
+#   - ACTIVATE_START -> ACTIVATE_RESULT Activation round trip, per outcome
+#   - FREEZE -> GRACE_FIRE              Grace timer delay (vs. AltTabGraceMs)
+#
+# --throughput aggregates the data layer instead: pump round trips
+# (ENRICH_REQ -> ENRICH_RESP) and hwnds/s, PRODUCER_BACKOFF -> RECOVER
+# episodes, snapshot Icon/PID/Z queue depths (enrichment queues against
+# recent batch sizes), and store churn (WINDOW_ADD/REMOVE, SCAN_COMPLETE,
+# COSMETIC_PATCH).
+#
+# Usage:
+#   python tools/query_recorder.py <dump|dir|glob>...          Latency distributions across dumps
+#   python tools/query_recorder.py <dump> --show               Parsed sections of one dump
+#   python tools/query_recorder.py <dump|dir|glob>... --json OUT  Structured records as JSON ("-" = stdout)
+#   python tools/query_recorder.py recorder --grace-ms 200     Grace lateness against a non-default GraceMs
+#   python tools/query_recorder.py <dump|dir|glob>... --throughput  Enrichment round trips + hwnds/s, backoffs, queue depth
+#   python tools/query_recorder.py <dump|dir|glob>... --ingest fr.db   Load into SQLite (parallel, incremental)
+#   python tools/query_recorder.py --db fr.db --canned NAME [ARG]     Canned query (no NAME: list them)
+#   python tools/query_recorder.py --db fr.db --sql "SELECT ..."      Ad-hoc SQL (dumps, events, items, hwnd_names)
+#
+# Input:  fr_YYYYMMDD_HHMMSS.txt (typically release/recorder/ or recorder/).
+#         Handles UTF-8 BOM (AHK's FileAppend writes BOM by default).
+#         Directories are searched for fr_*.txt.
+#
+# Timing: Trace offsets are printed relative to the dump with 1ms
+#         resolution, so latencies are exact to about +-1ms. Dumps taken in
+#         one session overlap (each holds the last N events); events are
+#         placed on the shared QPC clock and an interaction seen in several
+#         dumps is counted once.
+#
+# Requires: Python 3 standard library only.
+#
+# Examples:
+#   # Is the overlay slow to go active, or is Tab slow to be decided?
+#   python tools/query_recorder.py release/recorder
+#
+#   # Every failed activation in the testers' corpus, with the 10 events before it
+#   python tools/query_recorder.py testers/recorder --ingest fr.db
+#   python tools/query_recorder.py --db fr.db --canned failed-activations
+#
+#   # Did a build change how often komorebi transitions suppress focus?
+#   python tools/query_recorder.py --db fr.db --canned focus-suppress-by-build
+#
+#   # Read one dump without scrolling through the raw file
+#   python tools/query_recorder.py release/recorder/fr_20260221_203727.txt --show
+
+import argparse
+import glob
+import hashlib
+import itertools
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Event trace line: "  T-00012.345  ALT_DN               session=0"
+_RX_EVENT = re.compile(r"^  T([+-])(\d+(?:\.\d+)?)  (\S+) ?(.*)$")
+_RX_HEADER_TIME = re.compile(r"^\s+(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)\s+\(tick (-?[\d.]+)\)")
+_RX_HEADER_BUILD = re.compile(r"^\s+Build: (.*?)\s*$")
+_RX_SECTION = re.compile(r"^--- ([A-Z ]+?)(?: \((.*)\))? -+$")
+_RX_LIVE_COUNTS = re.compile(r"(\d+) windows, (\d+) displayed")
+_RX_ITEM = re.compile(r'^  #(\d+)  0x([0-9A-Fa-f]+)  "(.*)"  (.*?)  ws=(.*?)  cur=(.*)$')
+_RX_TEMPLATE_FIELD = re.compile(r"\{(\w+)(?::(\w+))?\}")
+
+# Event details as _FR_FormatDetails writes them. {name} is an integer,
+# {name:hwnd} a "0x%08X  title (process)" reference (the title part is
+# absent when the hwnd could not be resolved), {name:word} a bare token
+# (state and mode names) and {name:code} an integer with an optional
+# "(label)" suffix.
+_DETAIL_TEMPLATES = {
+    "ALT_DN": "session={session}",
+    "ALT_UP": "session={session}  presses={presses}  tabPending={tabPending}  async={async}",
+    "TAB_DN": "session={session}  altDown={altDown}  pending={pending}  held={held}",
+    "TAB_UP": "held={held}",
+    "TAB_DECIDE": "altDown={altDown}  altUpFlag={altUpFlag}",
+    "TAB_DECIDE_INNER": "isAltTab={isAltTab}  altDown={altDown}  altUpFlag={altUpFlag}  altRecent={altRecent}",
+    "ESC": "session={session}  presses={presses}",
+    "BYPASS": "{mode:word}",
+    "STATE": "-> {state:word}",
+    "FREEZE": "items={items}  sel={sel}",
+    "GRACE_FIRE": "state={state:word}  visible={visible}",
+    "ACTIVATE_START": "{hwnd:hwnd}  onCurrentWS={onCurrentWS}",
+    "ACTIVATE_RESULT": "{hwnd:hwnd}  success={success:code}  fg={fg:hwnd}",
+    "MRU_UPDATE": "{hwnd:hwnd}  result={result}",
+    "BUFFER_PUSH": "event={event:word}  bufLen={bufLen}",
+    "QUICK_SWITCH": "timeSinceTab={timeSinceTab}ms",
+    "REFRESH": "items={items}",
+    "ENRICH_REQ": "hwnds={hwnds}",
+    "ENRICH_RESP": "applied={applied}",
+    "WINDOW_ADD": "{hwnd:hwnd}  storeCount={storeCount}",
+    "WINDOW_REMOVE": "{hwnd:hwnd}  storeCount={storeCount}",
+    "GHOST_PURGE": "removed={removed}",
+    "BLACKLIST_PURGE": "removed={removed}",
+    "COSMETIC_PATCH": "patched={patched}  baseCount={baseCount}",
+    "SCAN_COMPLETE": "found={found}  storeCount={storeCount}",
+    "SESSION_START": "",
+    "PRODUCER_INIT": "{producer:word}  ok={ok}",
+    "ACTIVATE_GONE": "{hwnd:hwnd}",
+    "ACTIVATE_RETRY": "dead={dead:hwnd}  retry={retry:hwnd}  ok={ok}",
+    "WS_SWITCH": "",
+    "WS_TOGGLE": "mode={mode:word}  displayCount={displayCount}",
+    "MON_TOGGLE": "mode={mode:word}  displayCount={displayCount}",
+    "FOCUS": "{hwnd:hwnd}",
+    "FOCUS_SUPPRESS": "{hwnd:hwnd}  remainMs={remainMs}",
+    "FOCUS_PROBE_FAIL": "{hwnd:hwnd}",
+    "FOCUS_RETRY": "{hwnd:hwnd}  success={success}",
+    "KSUB_MRU_STALE": "ksub={ksub:hwnd}  fg={fg:hwnd}",
+    "FG_GUARD": "{hwnd:hwnd}",
+    "PRODUCER_BACKOFF": "errCount={errCount}  backoffMs={backoffMs}",
+    "PRODUCER_RECOVER": "errCount={errCount}  wasBackoffMs={wasBackoffMs}",
+    "PAINT_RESIZE": "rows={oldRows}\u2192{newRows}  size={newW}x{newH}",
+    "PAINT_BLOCKED": "reason={reason:word}",
+    "DISPLAY_EVICT": "{hwnd:hwnd}  remaining={remaining}  wasSel={wasSel}",
+    "ALT_RECOVERED": "layer={layer:word}",
+    "UNKNOWN": "d1={d1} d2={d2} d3={d3} d4={d4}",
+}
+
+_FIELD_PATTERNS = {
+    None: r"(?P<{0}>-?\d+)",
+    "code": r"(?P<{0}>-?\d+)(?:\([^)]*\))?",
+    "word": r"(?P<{0}>\S*)",
+    "hwnd": r"0x(?P<{0}>[0-9A-Fa-f]+)(?:  (?P<{0}__desc>.*?))?",
+}
+
+
+def _compile_template(template):
+    """Regex for one details template; hwnd titles are matched lazily."""
+    parts, pos, kinds = [], 0, {}
+    for m in _RX_TEMPLATE_FIELD.finditer(template):
+        parts.append(re.escape(template[pos:m.start()]))
+        parts.append(_FIELD_PATTERNS[m.group(2)].format(m.group(1)))
+        kinds[m.group(1)] = m.group(2)
+        pos = m.end()
+    parts.append(re.escape(template[pos:]))
+    return re.compile("".join(parts) + r"\s*$"), kinds
+
+
+_DETAIL_PARSERS = {name: _compile_template(t) for name, t in _DETAIL_TEMPLATES.items()}
+
+# Interaction names, in report order
+INTERACTIONS = (
+    ("alt_active", "ALT_DN -> STATE ACTIVE"),
+    ("tab_decide", "TAB_DN -> TAB_DECIDE_INNER"),
+    ("activate_ok", "ACTIVATE_START -> RESULT ok"),
+    ("activate_transitional", "ACTIVATE_START -> RESULT transitional"),
+    ("activate_failed", "ACTIVATE_START -> RESULT failed"),
+    ("grace", "FREEZE -> GRACE_FIRE"),
+)
+_ACTIVATE_OUTCOMES = {0: "activate_failed", 1: "activate_ok", 2: "activate_transitional"}
+
+# AltTab.GraceMs default (src/shared/config_registry.ahk)
+_DEFAULT_GRACE_MS = 150
+PERCENTILES = (50, 90, 99)
+
+
+# One trace event. offset_ms is relative to the dump (<= 0); tick is the
+# absolute QPC time in ms (dump tick + offset), comparable across dumps of
+# one session. fields holds the parsed details (ints, or str for word
+# fields); hwnd fields are ints. details is the raw text.
+Event = namedtuple("Event", ["offset_ms", "tick", "name", "fields", "details"])
+
+LiveItem = namedtuple("LiveItem", ["index", "hwnd", "title", "process", "ws", "on_current"])
+
+# A parsed dump. build is the app version from the header ("" for dumps
+# written before the Build line existed). state and window_list map the
+# snapshot names to their raw value strings. events are oldest first. hwnd_names maps every hwnd seen in
+# the dump to the "title (process)" text it was resolved to at dump time.
+Dump = namedtuple(
+    "Dump",
+    ["path", "time", "tick", "build", "note", "state", "window_list", "live_count", "display_count",
+     "items", "events", "hwnd_names"],
+)
+
+# One measured interaction: start/end are event indexes into dump.events
+Interaction = namedtuple("Interaction", ["kind", "dump", "start", "end", "ms"])
+
+
+def parse_details(name, details):
+    """Parse one event's details text into (fields, hwnd_names).
+
+    Unknown event names and details that do not match the expected layout
+    yield empty fields; the raw text is always kept on the Event.
+    """
+    parser = _DETAIL_PARSERS.get("UNKNOWN" if name.startswith("UNKNOWN(") else name)
+    if parser is None:
+        return {}, {}
+    rx, kinds = parser
+    m = rx.match(details)
+    if not m:
+        return {}, {}
+    fields, names = {}, {}
+    for key, kind in kinds.items():
+        value = m.group(key)
+        if kind == "word":
+            fields[key] = value
+        elif kind == "hwnd":
+            fields[key] = int(value, 16)
+            desc = m.group(key + "__desc")
+            if desc:
+                names[fields[key]] = desc
+        else:
+            fields[key] = int(value)
+    return fields, names
+
+
+def _parse_assignments(lines):
+    """"name   = value" snapshot lines -> {name: value}."""
+    out = {}
+    for line in lines:
+        key, sep, value = line.partition("=")
+        if sep:
+            out[key.strip()] = value[1:] if value.startswith(" ") else value
+    return out
+
+
+def parse_dump(path, text=None):
+    """Parse one fr_*.txt dump into a Dump.
+
+    text, when given, is the file's already-decoded content. Raises
+    ValueError when the file is not a flight recorder dump.
+    """
+    if text is None:
+        with open(path, "r", encoding="utf-8-sig", errors="replace") as f:
+            text = f.read()
+    lines = text.splitlines()
+    if not any("Flight Recorder Dump" in line for line in lines[:4]):
+        raise ValueError(f"{path}: not a flight recorder dump")
+
+    time_str, tick, build = "", 0.0, ""
+    note_lines = None
+    sections = {}
+    current = None
+    live_count = display_count = 0
+    for line in lines:
+        m = _RX_SECTION.match(line)
+        if m:
+            current = m.group(1)
+            sections[current] = []
+            counts = _RX_LIVE_COUNTS.search(m.group(2) or "")
+            if counts:
+                live_count, display_count = int(counts.group(1)), int(counts.group(2))
+            continue
+        if current is not None:
+            sections[current].append(line)
+        elif line.startswith("USER NOTE: "):
+            note_lines = [line[len("USER NOTE: "):]]
+        elif note_lines is not None:
+            note_lines.append(line)
+        else:
+            m = _RX_HEADER_TIME.match(line)
+            if m:
+                time_str, tick = m.group(1), float(m.group(2))
+            m = _RX_HEADER_BUILD.match(line)
+            if m:
+                build = m.group(1)
+    if "EVENT TRACE" not in sections:
+        raise ValueError(f"{path}: no EVENT TRACE section")
+
+    items = []
+    for line in sections.get("LIVE ITEMS", ()):
+        m = _RX_ITEM.match(line)
+        if m:
+            items.append(LiveItem(
+                int(m.group(1)), int(m.group(2), 16), m.group(3), m.group(4), m.group(5), m.group(6),
+            ))
+
+    hwnd_names = {}
+    events = []
+    for line in sections["EVENT TRACE"]:
+        m = _RX_EVENT.match(line)
+        if not m:
+            continue
+        offset = float(m.group(2)) * 1000.0
+        if m.group(1) == "-":
+            offset = -offset
+        name, details = m.group(3), m.group(4).strip()
+        fields, names = parse_details(name, details)
+        hwnd_names.update(names)
+        events.append(Event(offset, round(tick + offset), name, fields, details))
+    events.reverse()
+    for item in items:
+        desc = item.title[:30] + (f" ({item.process})" if item.process not in ("", "?") else "")
+        hwnd_names.setdefault(item.hwnd, desc)
+
+    note = "\n".join(note_lines).strip() if note_lines is not None else ""
+    return Dump(
+        path, time_str, tick, build, note,
+        _parse_assignments(sections.get("GLOBAL STATE", ())),
+        _parse_assignments(sections.get("WINDOW LIST STATE", ())),
+        live_count, display_count, items, events, hwnd_names,
+    )
+
+
+def find_dumps(patterns):
+    """Expand files, directories (fr_*.txt inside) and globs, in name order."""
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            paths += glob.glob(os.path.join(pattern, "fr_*.txt"))
+        elif os.path.exists(pattern):
+            paths.append(pattern)
+        else:
+            paths += glob.glob(pattern)
+    return sorted(set(paths), key=lambda p: (os.path.basename(p), p))
+
+
+def load_dumps(patterns):
+    """Parse every dump matching patterns; unreadable files are reported and skipped."""
+    dumps = []
+    for path in find_dumps(patterns):
+        try:
+            dumps.append(parse_dump(path))
+        except (OSError, ValueError) as e:
+            print(f"Skipped {path}: {e}")
+    return dumps
+
+
+def interactions(dump):
+    """Measure the key interactions in one dump's trace.
+
+    Each start event pairs with the first matching end after it:
+      alt_active   ALT_DN, then STATE -> ACTIVE (abandoned at STATE -> IDLE)
+      tab_decide   TAB_DN, then TAB_DECIDE_INNER (a newer TAB_DN restarts it)
+      activate_*   ACTIVATE_START, then ACTIVATE_RESULT, split by success.
+                   ACTIVATE_GONE abandons it; a RESULT for a retry target
+                   still closes it.
+      grace        FREEZE (where the grace timer is armed), then GRACE_FIRE
+                   (abandoned at STATE -> IDLE, i.e. the timer was cancelled)
+
+    Returns (list of Interaction, {kind: unmatched start count}). Starts
+    still open at the end of the trace are not counted as unmatched.
+    """
+    found = []
+    unmatched = {"alt_active": 0, "tab_decide": 0, "activate": 0, "grace": 0}
+    open_at = {}
+
+    def close(kind, key, i):
+        start = open_at.pop(key, None)
+        if start is not None:
+            events = dump.events
+            found.append(Interaction(kind, dump, start, i, events[i].offset_ms - events[start].offset_ms))
+
+    def restart(key, i):
+        if key in open_at:
+            unmatched[key] += 1
+        open_at[key] = i
+
+    for i, ev in enumerate(dump.events):
+        name = ev.name
+        if name == "ALT_DN":
+            restart("alt_active", i)
+        elif name == "TAB_DN":
+            restart("tab_decide", i)
+        elif name == "TAB_DECIDE_INNER":
+            close("tab_decide", "tab_decide", i)
+        elif name == "STATE":
+            state = ev.fields.get("state")
+            if state == "ACTIVE":
+                close("alt_active", "alt_active", i)
+            elif state == "IDLE":
+                for key in ("alt_active", "grace"):
+                    if open_at.pop(key, None) is not None:
+                        unmatched[key] += 1
+        elif name == "FREEZE":
+            restart("grace", i)
+        elif name == "GRACE_FIRE":
+            close("grace", "grace", i)
+        elif name == "ACTIVATE_START":
+            restart("activate", i)
+        elif name == "ACTIVATE_RESULT":
+            close(_ACTIVATE_OUTCOMES.get(ev.fields.get("success"), "activate_failed"), "activate", i)
+        elif name == "ACTIVATE_GONE":
+            if open_at.pop("activate", None) is not None:
+                unmatched["activate"] += 1
+    return found, unmatched
+
+
+def _percentile(sorted_values, pct):
+    """Nearest-rank percentile of an ascending list."""
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[min(int(rank), len(sorted_values)) - 1]
+
+
+def _fmt_offset(ev):
+    return f"T{ev.offset_ms / 1000:+.3f}"
+
+
+def cmd_latency(dumps, grace_ms=_DEFAULT_GRACE_MS, worst=3):
+    """Latency distribution per interaction, pooled across dumps."""
+    seen = set()
+    by_kind = {kind: [] for kind, _ in INTERACTIONS}
+    unmatched = {}
+    duplicates = 0
+    for dump in dumps:
+        found, missing = interactions(dump)
+        for kind, count in missing.items():
+            unmatched[kind] = unmatched.get(kind, 0) + count
+        for it in found:
+            if not _first_seen(seen, it.kind, dump.events[it.start].tick, dump.events[it.end].tick):
+                duplicates += 1
+                continue
+            by_kind[it.kind].append(it)
+
+    n_events = sum(len(d.events) for d in dumps)
+    print(f"Flight recorder: {len(dumps)} dumps, {n_events} events")
+    if duplicates:
+        print(f"  {duplicates} interactions repeated in overlapping dumps counted once")
+    print()
+    cols = "".join(f"{'p' + format(p, 'g'):>8}" for p in PERCENTILES)
+    print(f"{'Interaction (ms)':<40} {'Count':>6} {'Min':>8}{cols} {'Max':>8} {'Mean':>8}")
+    print("-" * (40 + 7 + 9 + 8 * len(PERCENTILES) + 18))
+    for kind, label in INTERACTIONS:
+        its = by_kind[kind]
+        if not its:
+            print(f"{label:<40} {0:>6}")
+            continue
+        ms = sorted(it.ms for it in its)
+        pcts = "".join(f"{_percentile(ms, p):>8.0f}" for p in PERCENTILES)
+        print(
+            f"{label:<40} {len(ms):>6} {ms[0]:>8.0f}{pcts} {ms[-1]:>8.0f} {sum(ms) / len(ms):>8.1f}"
+        )
+
+    grace = by_kind["grace"]
+    if grace:
+        late = sorted(it.ms - grace_ms for it in grace)
+        print()
+        print(
+            f"Grace timer lateness vs. GraceMs={grace_ms:g}: p50 {_percentile(late, 50):+.0f}ms, "
+            f"p90 {_percentile(late, 90):+.0f}ms, max {late[-1]:+.0f}ms"
+        )
+    notes = [
+        (unmatched.get("alt_active", 0), "ALT_DN sessions ended (STATE -> IDLE) without going ACTIVE"),
+        (unmatched.get("tab_decide", 0), "TAB_DN superseded before a TAB_DECIDE_INNER"),
+        (unmatched.get("activate", 0), "activations abandoned (ACTIVATE_GONE or a newer ACTIVATE_START)"),
+        (unmatched.get("grace", 0), "grace timers cancelled before firing (quick switches)"),
+    ]
+    notes = [(count, text) for count, text in notes if count]
+    if notes:
+        print()
+        for count, text in notes:
+            print(f"  {count:>5}  {text}")
+
+    print()
+    print("Slowest:")
+    for kind, label in INTERACTIONS:
+        its = sorted(by_kind[kind], key=lambda it: -it.ms)[:worst]
+        for it in its:
+            start, end = it.dump.events[it.start], it.dump.events[it.end]
+            print(
+                f"  {label:<40} {it.ms:>7.0f}ms  {os.path.basename(it.dump.path)} "
+                f"{_fmt_offset(start)} .. {_fmt_offset(end)}"
+            )
+
+
+def _first_seen(seen, kind, *ticks):
+    """Record (kind, ticks); False when already seen, give or take 1ms per tick.
+
+    Overlapping dumps of one session repeat events at the same tick, give
+    or take the 1ms rounding of each dump's offsets.
+    """
+    for deltas in itertools.product((-1, 0, 1), repeat=len(ticks)):
+        if (kind,) + tuple(t + d for t, d in zip(ticks, deltas)) in seen:
+            return False
+    seen.add((kind,) + ticks)
+    return True
+
+
+# ENRICH_REQ batches hold up to 32 icon-queue hwnds plus the windows of up
+# to 32 queued PIDs (WL_PopIconBatch / WL_PopPidBatch in gui_pump.ahk)
+_ENRICH_BATCH_CAP = 32
+# Store.PumpHangTimeoutMs default: a request unanswered this long is lost
+_DEFAULT_HANG_MS = 15000
+_BATCH_BUCKETS = ((1, 1), (2, 4), (5, 8), (9, 16), (17, 31), (32, None))
+_QUEUE_BUCKETS = ((0, 0), (1, 31), (32, 63), (64, 127), (128, None))
+# Batches before the dump that the queue snapshot is compared with
+_QUEUE_RECENT = 5
+# Window list queues in the dump snapshot. Icon + PID feed ENRICH_REQ; the Z
+# queue is drained by the full winenum scan (gui_main.ahk), not the pump
+_QUEUES = ("IconQueue", "PidQueue", "ZQueue")
+_ENRICH_QUEUES = ("IconQueue", "PidQueue")
+_CHURN_EVENTS = ("WINDOW_ADD", "WINDOW_REMOVE", "SCAN_COMPLETE", "COSMETIC_PATCH", "GHOST_PURGE")
+
+# One paired enrichment request: event indexes into dump.events
+EnrichTrip = namedtuple("EnrichTrip", ["dump", "req", "resp", "hwnds", "applied", "ms"])
+
+# A backoff episode: the first PRODUCER_BACKOFF until PRODUCER_RECOVER (end
+# None = not recovered by the end of the trace). steps counts the
+# escalations, max_backoff_ms the longest backoff announced.
+Backoff = namedtuple("Backoff", ["dump", "start", "end", "steps", "max_backoff_ms", "err_count", "ms"])
+
+
+def enrich_trips(dump, hang_ms=_DEFAULT_HANG_MS):
+    """Pair ENRICH_REQ with ENRICH_RESP in one dump's trace.
+
+    The pump answers requests in order over one pipe, so responses pair
+    first-in first-out. Requests older than hang_ms when a response
+    arrives, and requests outstanding when the pump is re-initialized
+    (PRODUCER_INIT Pump), were never answered and are counted as lost.
+    Responses with no outstanding request answer a request from before the
+    trace start and are skipped.
+
+    Returns (list of EnrichTrip, event indexes of the lost requests).
+    """
+    trips = []
+    pending = []
+    lost = []
+    events = dump.events
+    for i, ev in enumerate(events):
+        if ev.name == "ENRICH_REQ":
+            pending.append(i)
+        elif ev.name == "ENRICH_RESP":
+            while pending and ev.offset_ms - events[pending[0]].offset_ms > hang_ms:
+                lost.append(pending.pop(0))
+            if pending:
+                req = pending.pop(0)
+                trips.append(EnrichTrip(
+                    dump, req, i, events[req].fields.get("hwnds", 0), ev.fields.get("applied", 0),
+                    ev.offset_ms - events[req].offset_ms,
+                ))
+        elif ev.name == "PRODUCER_INIT" and ev.fields.get("producer") == "Pump":
+            lost += pending
+            pending = []
+    return trips, lost
+
+
+def backoff_episodes(dump):
+    """Backoff episodes in one dump's trace (see Backoff)."""
+    episodes = []
+    open_ep = None
+    events = dump.events
+    for i, ev in enumerate(events):
+        if ev.name == "PRODUCER_BACKOFF":
+            backoff = ev.fields.get("backoffMs", 0)
+            if open_ep is None:
+                open_ep = [i, 1, backoff, ev.fields.get("errCount", 0)]
+            else:
+                open_ep[1] += 1
+                open_ep[2] = max(open_ep[2], backoff)
+                open_ep[3] = ev.fields.get("errCount", open_ep[3])
+        elif ev.name == "PRODUCER_RECOVER" and open_ep is not None:
+            start, steps, max_backoff, errs = open_ep
+            episodes.append(Backoff(dump, start, i, steps, max_backoff, errs, ev.offset_ms - events[start].offset_ms))
+            open_ep = None
+    if open_ep is not None:
+        start, steps, max_backoff, errs = open_ep
+        episodes.append(Backoff(dump, start, None, steps, max_backoff, errs, -events[start].offset_ms))
+    return episodes
+
+
+def _queue_depths(dump):
+    """{queue: length} from the window list snapshot, for the queues present."""
+    depths = {}
+    for name in _QUEUES:
+        value = dump.window_list.get(name + ".Length", "").strip()
+        if value.isdigit():
+            depths[name] = int(value)
+    return depths
+
+
+def _busy_ms(trips):
+    """Time with at least one request in flight (union of round trips)."""
+    spans = sorted((it.dump.events[it.req].tick, it.dump.events[it.resp].tick) for it in trips)
+    busy, end = 0, None
+    for lo, hi in spans:
+        if end is None or lo > end:
+            busy += hi - lo
+            end = hi
+        elif hi > end:
+            busy += hi - end
+            end = hi
+    return busy
+
+
+def _bucket_label(lo, hi):
+    return f"{lo}" if lo == hi else f"{lo}+" if hi is None else f"{lo}-{hi}"
+
+
+def _dist_row(label, values, unit=""):
+    values = sorted(values)
+    if not values:
+        return f"{label:<26} {0:>6}"
+    pcts = "".join(f"{_percentile(values, p):>8.0f}" for p in PERCENTILES)
+    return (
+        f"{label:<26} {len(values):>6} {values[0]:>8.0f}{pcts} {values[-1]:>8.0f} "
+        f"{sum(values) / len(values):>8.1f}{unit}"
+    )
+
+
+def cmd_throughput(dumps, hang_ms=_DEFAULT_HANG_MS, worst=5):
+    """Data-layer throughput: enrichment round trips, backoffs, queue depth, churn."""
+    seen = set()
+    trips = []
+    episodes = {}
+    lost = 0
+    churn = {name: [] for name in _CHURN_EVENTS}
+    queue_rows = []
+    span_ms = 0
+    sessions = []
+    for dump in dumps:
+        found, missing = enrich_trips(dump, hang_ms)
+        lost += sum(1 for i in missing if _first_seen(seen, "lost", dump.events[i].tick))
+        trips += [
+            it for it in found
+            if _first_seen(seen, "enrich", dump.events[it.req].tick, dump.events[it.resp].tick)
+        ]
+        # A later dump of the session may see an episode recover; keep the
+        # longest view of each
+        for ep in backoff_episodes(dump):
+            tick = dump.events[ep.start].tick
+            key = next((tick + d for d in (0, -1, 1) if tick + d in episodes), tick)
+            if key not in episodes or ep.ms > episodes[key].ms:
+                episodes[key] = ep
+        for ev in dump.events:
+            if ev.name in churn and _first_seen(seen, ev.name + ev.details, ev.tick):
+                churn[ev.name].append(ev)
+        if dump.events:
+            # Trace time covered, without counting overlap between dumps twice
+            lo, hi = dump.events[0].tick, dump.events[-1].tick
+            for s_lo, s_hi in sessions:
+                if lo < s_hi and hi > s_lo:
+                    lo, hi = min(lo, s_lo), max(hi, s_hi)
+                    span_ms -= s_hi - s_lo
+                    sessions.remove((s_lo, s_hi))
+                    break
+            sessions.append((lo, hi))
+            span_ms += hi - lo
+
+        depths = _queue_depths(dump)
+        if depths:
+            recent = [ev.fields.get("hwnds", 0) for ev in dump.events if ev.name == "ENRICH_REQ"][-_QUEUE_RECENT:]
+            queue_rows.append((depths, recent))
+
+    minutes = span_ms / 60000.0
+    print(f"Data layer: {len(dumps)} dumps, {minutes:.1f} min of trace")
+    print()
+
+    # --- Enrichment round trips ---
+    hwnds = sum(it.hwnds for it in trips)
+    print(f"Enrichment (ENRICH_REQ -> ENRICH_RESP, paired in order): {len(trips)} round trips, {lost} requests lost")
+    if lost:
+        print(f"  Lost: no response within {hang_ms:g}ms (--hang-ms) or pump re-initialized while outstanding")
+    if trips:
+        cols = "".join(f"{'p' + format(p, 'g'):>8}" for p in PERCENTILES)
+        print()
+        print(f"{'':<26} {'Count':>6} {'Min':>8}{cols} {'Max':>8} {'Mean':>8}")
+        print(_dist_row("Round trip (ms)", [it.ms for it in trips]))
+        print(_dist_row("Batch size (hwnds)", [it.hwnds for it in trips]))
+        print(_dist_row("Applied (changed)", [it.applied for it in trips]))
+        busy = _busy_ms(trips)
+        print()
+        print(
+            f"  Throughput: {hwnds / max(span_ms / 1000.0, 1e-9):.1f} hwnds/s over the trace, "
+            f"{hwnds / max(busy / 1000.0, 1e-9):.1f} hwnds/s while a request was in flight "
+            f"(busy {busy / max(span_ms, 1) * 100:.1f}% of the time)"
+        )
+        applied = sum(it.applied for it in trips)
+        full = sum(1 for it in trips if it.hwnds >= _ENRICH_BATCH_CAP)
+        print(
+            f"  Applied: {applied} of {hwnds} requested hwnds changed the store ({applied / max(hwnds, 1) * 100:.0f}%); "
+            f"{full} batches ({full / len(trips) * 100:.0f}%) at the {_ENRICH_BATCH_CAP}-hwnd icon batch cap"
+        )
+        print()
+        print(f"  {'Batch':>7} {'Trips':>6} {'p50 ms':>7} {'p90 ms':>7} {'ms/hwnd':>8} {'hwnds/s':>8}")
+        for lo, hi in _BATCH_BUCKETS:
+            rows = [it for it in trips if it.hwnds >= lo and (hi is None or it.hwnds <= hi)]
+            if not rows:
+                continue
+            ms = sorted(it.ms for it in rows)
+            n = sum(it.hwnds for it in rows)
+            total_ms = sum(ms)
+            print(
+                f"  {_bucket_label(lo, hi):>7} {len(rows):>6} {_percentile(ms, 50):>7.0f} {_percentile(ms, 90):>7.0f} "
+                f"{total_ms / max(n, 1):>8.2f} {n / max(total_ms / 1000.0, 1e-9):>8.0f}"
+            )
+        print()
+        print("  Slowest round trips:")
+        for it in sorted(trips, key=lambda it: -it.ms)[:worst]:
+            print(
+                f"    {it.ms:>7.0f}ms  {it.hwnds:>3} hwnds  {os.path.basename(it.dump.path)} "
+                f"{_fmt_offset(it.dump.events[it.req])} .. {_fmt_offset(it.dump.events[it.resp])}"
+            )
+
+    # --- Backoff episodes ---
+    episodes = list(episodes.values())
+    print()
+    recovered = [ep for ep in episodes if ep.end is not None]
+    print(f"Producer backoff: {len(episodes)} episodes, {len(episodes) - len(recovered)} not recovered by the dump")
+    if episodes:
+        total = sum(ep.ms for ep in episodes)
+        print(f"  In backoff {total / 1000:.1f}s ({total / max(span_ms, 1) * 100:.1f}% of the trace)")
+        if recovered:
+            print(_dist_row("  Recovered after (ms)", [ep.ms for ep in recovered]))
+        for ep in sorted(episodes, key=lambda ep: -ep.ms)[:worst]:
+            end = "not recovered" if ep.end is None else f"recovered {_fmt_offset(ep.dump.events[ep.end])}"
+            print(
+                f"    {ep.ms / 1000:>7.1f}s  {ep.steps} step(s), up to {ep.max_backoff_ms}ms, {ep.err_count} errors  "
+                f"{os.path.basename(ep.dump.path)} {_fmt_offset(ep.dump.events[ep.start])}, {end}"
+            )
+
+    # --- Queue depth vs batch size ---
+    print()
+    print(f"Queue depth at dump time, {len(queue_rows)} dumps:")
+    if queue_rows:
+        cols = "".join(f"{'p' + format(p, 'g'):>8}" for p in PERCENTILES)
+        print(f"{'':<26} {'Count':>6} {'Min':>8}{cols} {'Max':>8} {'Mean':>8}")
+        for name in _QUEUES:
+            values = [depths[name] for depths, _ in queue_rows if name in depths]
+            if values:
+                print(_dist_row(f"  {name}", values))
+        print()
+        print(f"  Enrichment queues ({' + '.join(_ENRICH_QUEUES)}) vs. the last {_QUEUE_RECENT} batch sizes:")
+        print(f"  {'Queue':>7} {'Dumps':>6} {'Batches':>8} {'Median':>7} {'Max':>5} {'At cap':>7} {'ZQueue':>7}")
+        enrich_depth = [sum(depths.get(name, 0) for name in _ENRICH_QUEUES) for depths, _ in queue_rows]
+        for lo, hi in _QUEUE_BUCKETS:
+            rows = [row for row, depth in zip(queue_rows, enrich_depth) if depth >= lo and (hi is None or depth <= hi)]
+            if not rows:
+                continue
+            z = sorted(depths["ZQueue"] for depths, _ in rows if "ZQueue" in depths)
+            z_str = str(_percentile(z, 50)) if z else "-"
+            sizes = sorted(size for _, recent in rows for size in recent)
+            if sizes:
+                at_cap = sum(1 for size in sizes if size >= _ENRICH_BATCH_CAP) / len(sizes) * 100
+                print(
+                    f"  {_bucket_label(lo, hi):>7} {len(rows):>6} {len(sizes):>8} {_percentile(sizes, 50):>7} "
+                    f"{sizes[-1]:>5} {at_cap:>6.0f}% {z_str:>7}"
+                )
+            else:
+                print(f"  {_bucket_label(lo, hi):>7} {len(rows):>6} {0:>8} {'':>7} {'':>5} {'':>7} {z_str:>7}")
+        print("  Deep queues with batches at the cap mean the pump is the bottleneck (batch size or tick rate);")
+        print("  deep queues with small batches point at the collect timer not keeping up.")
+        print("  ZQueue (median per row) is drained by the full winenum scan, not ENRICH_REQ: a deep ZQueue")
+        print("  means scans are deferred (overlay active or scan backoff).")
+
+    # --- Store churn ---
+    print()
+    print("Store churn:")
+    per_min = max(minutes, 1e-9)
+    adds, removes = churn["WINDOW_ADD"], churn["WINDOW_REMOVE"]
+    print(f"  WINDOW_ADD      {len(adds):>6}  ({len(adds) / per_min:.1f}/min)")
+    print(f"  WINDOW_REMOVE   {len(removes):>6}  ({len(removes) / per_min:.1f}/min)")
+    scans = churn["SCAN_COMPLETE"]
+    if scans:
+        found = sum(ev.fields.get("found", 0) for ev in scans) / len(scans)
+        store = sum(ev.fields.get("storeCount", 0) for ev in scans) / len(scans)
+        print(f"  SCAN_COMPLETE   {len(scans):>6}  (avg found {found:.1f}, store {store:.1f})")
+    else:
+        print(f"  SCAN_COMPLETE   {0:>6}")
+    patches = churn["COSMETIC_PATCH"]
+    print(
+        f"  COSMETIC_PATCH  {len(patches):>6}  ({sum(ev.fields.get('patched', 0) for ev in patches)} items patched)"
+    )
+    purges = churn["GHOST_PURGE"]
+    print(f"  GHOST_PURGE     {len(purges):>6}  ({sum(ev.fields.get('removed', 0) for ev in purges)} removed)")
+    if trips:
+        print(
+            f"  Enrichment demand: {len(adds) / per_min:.1f} new windows/min vs. "
+            f"{hwnds / per_min:.1f} hwnds/min enriched"
+        )
+
+
+def cmd_show(dump, limit=None):
+    """Print one dump's parsed sections."""
+    print(f"{dump.path}: {dump.time}  (tick {dump.tick:.3f})  build {dump.build or '?'}")
+    if dump.note:
+        print(f"Note: {dump.note}")
+    print()
+    print("Global state:")
+    for key, value in dump.state.items():
+        print(f"  {key:<24} {value}")
+    print()
+    print("Window list:")
+    for key, value in dump.window_list.items():
+        print(f"  {key:<24} {value}")
+    print()
+    print(f"Live items: {dump.live_count} windows, {dump.display_count} displayed")
+    for item in dump.items:
+        print(
+            f"  #{item.index:02}  0x{item.hwnd:08X}  {item.title[:40]:<40}  {item.process:<20} "
+            f"ws={item.ws}  cur={item.on_current}"
+        )
+    print()
+    events = dump.events if limit is None else dump.events[-limit:]
+    print(f"Event trace: {len(dump.events)} events, oldest first")
+    for ev in events:
+        fields = "  ".join(f"{k}=0x{v:08X}" if k in _hwnd_fields(ev.name) else f"{k}={v}" for k, v in ev.fields.items())
+        print(f"  {_fmt_offset(ev):>11}  {ev.name:<20} {fields if ev.fields else ev.details}")
+
+
+def _hwnd_fields(name):
+    parser = _DETAIL_PARSERS.get(name)
+    return {k for k, kind in parser[1].items() if kind == "hwnd"} if parser else set()
+
+
+def dump_to_json(dump):
+    """JSON-serializable form of a Dump."""
+    return {
+        "path": dump.path,
+        "time": dump.time,
+        "tick": dump.tick,
+        "build": dump.build,
+        "note": dump.note,
+        "state": dump.state,
+        "window_list": dump.window_list,
+        "live_count": dump.live_count,
+        "display_count": dump.display_count,
+        "items": [item._asdict() for item in dump.items],
+        "events": [ev._asdict() for ev in dump.events],
+        "hwnd_names": {f"0x{h:08X}": name for h, name in dump.hwnd_names.items()},
+    }
+
+
+# ============================================================
+# SQLITE STORE
+# ============================================================
+#
+# --ingest loads dumps into one database so the whole corpus can be queried
+# without re-parsing. Files are parsed in worker processes and written by
+# the main process in one transaction per batch. A dump is skipped when its
+# path, size and mtime are already recorded, or when a file with the same
+# content hash was loaded from another path.
+#
+# Dumps of one session share events (each holds the last N). While loading,
+# an event that matches an event of an already-loaded dump of the same
+# session (same type and details, tick within 1ms) is stored with dup = 1;
+# the canned queries count dup = 0 rows only, so every event is counted
+# once. Two dumps are taken to be one session when they share at least
+# _SESSION_MIN_SHARED such events; candidates are found by looking up
+# _SESSION_PROBES evenly spaced events of the new dump.
+
+_DB_VERSION = 1
+_SESSION_MIN_SHARED = 16
+_SESSION_PROBES = 64
+_INGEST_BATCH = 64
+
+_DB_SCHEMA = """
+CREATE TABLE IF NOT EXISTS dumps (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha1 TEXT NOT NULL UNIQUE,
+    time TEXT,
+    tick REAL,
+    build TEXT,
+    note TEXT,
+    state TEXT,
+    window_list TEXT,
+    live_count INTEGER,
+    display_count INTEGER,
+    n_events INTEGER,
+    span_ms REAL
+);
+CREATE INDEX IF NOT EXISTS dumps_path ON dumps(path, size, mtime_ns);
+CREATE INDEX IF NOT EXISTS dumps_build ON dumps(build);
+
+-- seq is the event's position in its dump, oldest first. hwnd is the
+-- event's primary hwnd (first hwnd field); all fields are in the fields
+-- JSON object.
+CREATE TABLE IF NOT EXISTS events (
+    dump_id INTEGER NOT NULL REFERENCES dumps(id),
+    seq INTEGER NOT NULL,
+    tick INTEGER NOT NULL,
+    offset_ms REAL NOT NULL,
+    type TEXT NOT NULL,
+    hwnd INTEGER,
+    fields TEXT NOT NULL,
+    details TEXT NOT NULL,
+    dup INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (dump_id, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS events_type ON events(type, dup);
+CREATE INDEX IF NOT EXISTS events_hwnd ON events(hwnd) WHERE hwnd IS NOT NULL;
+CREATE INDEX IF NOT EXISTS events_tick ON events(tick);
+
+CREATE TABLE IF NOT EXISTS items (
+    dump_id INTEGER NOT NULL REFERENCES dumps(id),
+    idx INTEGER NOT NULL,
+    hwnd INTEGER NOT NULL,
+    title TEXT,
+    process TEXT,
+    ws TEXT,
+    on_current TEXT,
+    PRIMARY KEY (dump_id, idx)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS items_hwnd ON items(hwnd);
+
+CREATE TABLE IF NOT EXISTS hwnd_names (
+    dump_id INTEGER NOT NULL REFERENCES dumps(id),
+    hwnd INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    PRIMARY KEY (hwnd, dump_id)
+) WITHOUT ROWID;
+"""
+
+
+def open_db(db_path):
+    """Open (creating if needed) the dump database."""
+    conn = sqlite3.connect(db_path)
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version not in (0, _DB_VERSION):
+        conn.close()
+        raise ValueError(f"{db_path}: database version {version}, expected {_DB_VERSION}; delete it to rebuild")
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_DB_SCHEMA)
+    conn.execute(f"PRAGMA user_version={_DB_VERSION}")
+    return conn
+
+
+def _ingest_parse(job):
+    """Worker: hash and parse one dump, and serialize its event rows.
+
+    Returns (job, sha1, dump, rows, error); rows are the events table
+    columns after dump_id, minus dup.
+    """
+    path = job[0]
+    try:
+        with open(path, "rb") as f:
+            raw = f.read()
+        sha1 = hashlib.sha1(raw).hexdigest()
+        dump = parse_dump(path, raw.decode("utf-8-sig", errors="replace"))
+    except (OSError, ValueError) as e:
+        return job, None, None, None, str(e)
+    rows = [
+        (i, ev.tick, ev.offset_ms, ev.name, _primary_hwnd(ev), json.dumps(ev.fields), ev.details)
+        for i, ev in enumerate(dump.events)
+    ]
+    return job, sha1, dump, rows, None
+
+
+def _primary_hwnd(ev):
+    for key in _hwnd_fields(ev.name):
+        return ev.fields[key]
+    return None
+
+
+def _mark_duplicates(conn, dump):
+    """dup flag per event: already loaded from another dump of this session."""
+    dup = [0] * len(dump.events)
+    if not dump.events:
+        return dup
+    # Find loaded dumps of this session from a sample of events (tick index
+    # probes), then match every event against those dumps only
+    events = dump.events
+    step = max(1, len(events) // _SESSION_PROBES)
+    probed = defaultdict(int)
+    for ev in events[::step]:
+        for (dump_id,) in conn.execute(
+            "SELECT DISTINCT dump_id FROM events INDEXED BY events_tick"
+            " WHERE tick BETWEEN ? AND ? AND type = ? AND details = ? AND dup = 0",
+            (ev.tick - 1, ev.tick + 1, ev.name, ev.details),
+        ):
+            probed[dump_id] += 1
+    hits = {}
+    for dump_id, count in probed.items():
+        if count < 2 and len(events) > step:
+            continue
+        loaded = set(conn.execute(
+            "SELECT tick, type, details FROM events WHERE dump_id = ? AND dup = 0", (dump_id,)
+        ))
+        hits[dump_id] = [
+            i for i, ev in enumerate(events)
+            if any((ev.tick + d, ev.name, ev.details) in loaded for d in (0, -1, 1))
+        ]
+    for shared in hits.values():
+        if len(shared) >= min(_SESSION_MIN_SHARED, len(dump.events)):
+            for i in shared:
+                dup[i] = 1
+    return dup
+
+
+def _insert_dump(conn, job, sha1, dump, rows):
+    path, size, mtime_ns = job
+    offsets = [ev.offset_ms for ev in dump.events]
+    cur = conn.execute(
+        "INSERT INTO dumps (path, name, size, mtime_ns, sha1, time, tick, build, note, state, window_list,"
+        " live_count, display_count, n_events, span_ms) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            os.path.abspath(path), os.path.basename(path), size, mtime_ns, sha1, dump.time, dump.tick,
+            dump.build, dump.note, json.dumps(dump.state), json.dumps(dump.window_list),
+            dump.live_count, dump.display_count, len(dump.events),
+            max(offsets) - min(offsets) if offsets else 0.0,
+        ),
+    )
+    dump_id = cur.lastrowid
+    dup = _mark_duplicates(conn, dump)
+    conn.executemany(
+        "INSERT INTO events (dump_id, seq, tick, offset_ms, type, hwnd, fields, details, dup)"
+        " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        ((dump_id,) + row + (flag,) for row, flag in zip(rows, dup)),
+    )
+    conn.executemany(
+        "INSERT INTO items (dump_id, idx, hwnd, title, process, ws, on_current) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        ((dump_id,) + tuple(item) for item in dump.items),
+    )
+    conn.executemany(
+        "INSERT INTO hwnd_names (dump_id, hwnd, name) VALUES (?, ?, ?)",
+        ((dump_id, h, name) for h, name in dump.hwnd_names.items()),
+    )
+    return sum(dup)
+
+
+def cmd_ingest(db_path, patterns, jobs=None, build=None):
+    """Load new dumps into the database in parallel; skip ones already loaded.
+
+    build, when given, labels dumps whose header has no Build line.
+    """
+    conn = open_db(db_path)
+    known = set(conn.execute("SELECT path, size, mtime_ns FROM dumps"))
+    paths = find_dumps(patterns)
+    todo = []
+    for path in paths:
+        st = os.stat(path)
+        job = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+        if job not in known:
+            todo.append(job)
+    skipped = len(paths) - len(todo)
+    if not todo:
+        print(f"Nothing to ingest: {db_path} already has all {len(paths)} matching dumps")
+        conn.close()
+        return
+
+    start = time.perf_counter()
+    loaded = events = dups = same_content = 0
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        results = pool.map(_ingest_parse, todo, chunksize=8)
+        batch = 0
+        for job, sha1, dump, rows, err in results:
+            if err:
+                print(f"Skipped {job[0]}: {err}")
+                continue
+            if conn.execute("SELECT 1 FROM dumps WHERE sha1 = ?", (sha1,)).fetchone():
+                same_content += 1
+                continue
+            if build and not dump.build:
+                dump = dump._replace(build=build)
+            dups += _insert_dump(conn, job, sha1, dump, rows)
+            loaded += 1
+            events += len(dump.events)
+            batch += 1
+            if batch >= _INGEST_BATCH:
+                conn.commit()
+                batch = 0
+    conn.commit()
+    conn.execute("ANALYZE")
+    conn.close()
+    elapsed = time.perf_counter() - start
+    print(
+        f"Ingested {loaded} dumps ({events} events, {dups} shared with earlier dumps of the same session) "
+        f"into {db_path} in {elapsed:.1f}s"
+    )
+    if skipped or same_content:
+        print(f"  Skipped {skipped} already loaded, {same_content} identical to a loaded dump")
+
+
+def _print_rows(cursor, rows):
+    names = [c[0] for c in cursor.description]
+    cells = [[("" if v is None else f"0x{v:08X}" if n == "hwnd" and isinstance(v, int) else str(v))
+              for n, v in zip(names, row)] for row in rows]
+    widths = [max([len(n)] + [len(r[i]) for r in cells]) for i, n in enumerate(names)]
+    print("  ".join(n.ljust(w) for n, w in zip(names, widths)).rstrip())
+    print("  ".join("-" * w for w in widths))
+    for r in cells:
+        print("  ".join(v.ljust(w) for v, w in zip(r, widths)).rstrip())
+
+
+def _canned_failed_activations(conn, arg):
+    """ACTIVATE_RESULT success=0, each with the N events before it (default 10)."""
+    context = int(arg) if arg else 10
+    cur = conn.execute(
+        """
+        SELECT d.name AS dump, d.build, f.seq AS failure, e.seq, e.offset_ms, e.type, e.details
+        FROM events f
+        JOIN dumps d ON d.id = f.dump_id
+        JOIN events e ON e.dump_id = f.dump_id AND e.seq BETWEEN f.seq - ? AND f.seq
+        WHERE f.type = 'ACTIVATE_RESULT' AND f.dup = 0 AND json_extract(f.fields, '$.success') = 0
+        ORDER BY d.name, f.seq, e.seq
+        """,
+        (context,),
+    )
+    rows = cur.fetchall()
+    failures = 0
+    key = None
+    for dump, build, failure, seq, offset_ms, name, details in rows:
+        if (dump, failure) != key:
+            key = (dump, failure)
+            failures += 1
+            print(f"\n{dump} (build {build or '?'}), event #{failure}:")
+        mark = ">" if seq == failure else " "
+        print(f"  {mark} T{offset_ms / 1000:+.3f}  {name:<20} {details}")
+    return failures
+
+
+def _canned_focus_suppress(conn, arg):
+    """FOCUS_SUPPRESS frequency per build (events per dump and per trace minute)."""
+    cur = conn.execute(
+        """
+        SELECT COALESCE(NULLIF(d.build, ''), '?') AS build, COUNT(*) AS dumps,
+               COALESCE(SUM(s.n), 0) AS suppressed,
+               ROUND(COALESCE(SUM(s.n), 0) * 1.0 / COUNT(*), 2) AS per_dump,
+               ROUND(COALESCE(SUM(s.n), 0) * 60000.0 / MAX(SUM(d.span_ms), 1), 2) AS per_min,
+               COUNT(s.n) AS dumps_with
+        FROM dumps d
+        LEFT JOIN (
+            SELECT dump_id, COUNT(*) AS n FROM events
+            WHERE type = 'FOCUS_SUPPRESS' AND dup = 0 GROUP BY dump_id
+        ) s ON s.dump_id = d.id
+        GROUP BY 1
+        ORDER BY per_min DESC
+        """
+    )
+    rows = cur.fetchall()
+    _print_rows(cur, rows)
+    return len(rows)
+
+
+def _canned_event_counts(conn, arg):
+    """Events per type across the corpus (shared events counted once)."""
+    cur = conn.execute(
+        """
+        SELECT type, COUNT(*) AS events, COUNT(DISTINCT dump_id) AS dumps
+        FROM events WHERE dup = 0 GROUP BY type ORDER BY events DESC
+        """
+    )
+    rows = cur.fetchall()
+    _print_rows(cur, rows)
+    return len(rows)
+
+
+def _canned_hwnd(conn, arg):
+    """Every event whose primary hwnd is ARG (hex or decimal)."""
+    if not arg:
+        raise ValueError("hwnd needs an hwnd argument, e.g. --canned hwnd 0x000A0B2C")
+    hwnd = int(arg, 0)
+    cur = conn.execute(
+        """
+        SELECT d.name AS dump, d.build, e.seq, e.offset_ms, e.type, e.details
+        FROM events e JOIN dumps d ON d.id = e.dump_id
+        WHERE e.hwnd = ? AND e.dup = 0
+        ORDER BY d.name, e.seq
+        """,
+        (hwnd,),
+    )
+    rows = cur.fetchall()
+    _print_rows(cur, rows)
+    return len(rows)
+
+
+CANNED_QUERIES = {
+    "failed-activations": _canned_failed_activations,
+    "focus-suppress-by-build": _canned_focus_suppress,
+    "event-counts": _canned_event_counts,
+    "hwnd": _canned_hwnd,
+}
+
+
+def cmd_db_query(db_path, name=None, arg=None, sql=None):
+    """Run a canned query (or raw SQL) against the dump database."""
+    if not os.path.exists(db_path):
+        print(f"{db_path} does not exist; create it with --ingest {db_path} <dumps>")
+        return 1
+    conn = open_db(db_path)
+    start = time.perf_counter()
+    if sql is not None:
+        cur = conn.execute(sql)
+        rows = cur.fetchall()
+        if cur.description:
+            _print_rows(cur, rows)
+        count = len(rows)
+    elif name in CANNED_QUERIES:
+        count = CANNED_QUERIES[name](conn, arg)
+    else:
+        print("Canned queries:")
+        for key, func in CANNED_QUERIES.items():
+            print(f"  {key:<25} {func.__doc__}")
+        return 1
+    elapsed = (time.perf_counter() - start) * 1000
+    n_dumps, n_events = conn.execute("SELECT COUNT(*), COALESCE(SUM(n_events), 0) FROM dumps").fetchone()
+    print(f"\n({count} results over {n_dumps} dumps / {n_events} events in {elapsed:.1f}ms)")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Analyze Alt-Tabby flight recorder dumps (fr_*.txt)"
+    )
+    parser.add_argument(
+        "dumps", nargs="*", metavar="dump",
+        help="Dump file, directory of fr_*.txt, or glob (several allowed)"
+    )
+    parser.add_argument(
+        "--show", nargs="?", type=int, const=-1, metavar="N",
+        help="Print the parsed sections of each dump (trace limited to the newest N events)"
+    )
+    parser.add_argument(
+        "--json", metavar="OUT",
+        help="Write the parsed dumps as JSON to OUT (- for stdout)"
+    )
+    parser.add_argument(
+        "--grace-ms", type=float, default=_DEFAULT_GRACE_MS, metavar="MS",
+        help=f"AltTab GraceMs the grace timer was armed with (default: {_DEFAULT_GRACE_MS})"
+    )
+    parser.add_argument(
+        "--throughput", action="store_true",
+        help="Data-layer report: enrichment round trips and hwnds/s, backoff episodes, queue depth vs. batch size"
+    )
+    parser.add_argument(
+        "--hang-ms", type=float, default=_DEFAULT_HANG_MS, metavar="MS",
+        help=f"Store PumpHangTimeoutMs: requests unanswered this long count as lost (default: {_DEFAULT_HANG_MS})"
+    )
+    parser.add_argument(
+        "--ingest", metavar="DB",
+        help="Load the dumps into SQLite database DB (incremental; already loaded dumps are skipped)"
+    )
+    parser.add_argument(
+        "--jobs", type=int, default=None, metavar="N",
+        help="Worker processes for --ingest (default: CPU count)"
+    )
+    parser.add_argument(
+        "--build", metavar="LABEL",
+        help="Build label for ingested dumps whose header has no Build line"
+    )
+    parser.add_argument(
+        "--db", metavar="DB",
+        help="Query a database made by --ingest (with --canned or --sql)"
+    )
+    parser.add_argument(
+        "--canned", nargs="*", metavar="NAME [ARG]",
+        help="Canned query: " + ", ".join(CANNED_QUERIES) + " (without NAME: list them)"
+    )
+    parser.add_argument("--sql", metavar="QUERY", help="Raw SQL against --db (tables: dumps, events, items, hwnd_names)")
+    args = parser.parse_args()
+
+    if args.db:
+        if args.dumps or (args.canned is None) == (args.sql is None):
+            parser.error("--db takes exactly one of --canned or --sql, and no dump files")
+        canned = args.canned or [None]
+        if len(canned) > 2:
+            parser.error("--canned takes NAME and at most one ARG")
+        try:
+            sys.exit(cmd_db_query(args.db, canned[0], canned[1] if len(canned) > 1 else None, args.sql))
+        except (ValueError, sqlite3.Error) as e:
+            print(f"Query failed: {e}")
+            sys.exit(1)
+    if not args.dumps:
+        parser.error("no dump files given")
+    if args.ingest:
+        cmd_ingest(args.ingest, args.dumps, args.jobs, args.build)
+        return
+
+    dumps = load_dumps(args.dumps)
+    if not dumps:
+        print(f"No flight recorder dumps match {' '.join(args.dumps)}")
+        sys.exit(1)
+
+    if args.json:
+        records = [dump_to_json(d) for d in dumps]
+        if args.json == "-":
+            json.dump(records, sys.stdout, indent=1, ensure_ascii=False)
+            print()
+        else:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(records, f, indent=1, ensure_ascii=False)
+            print(f"Wrote {len(records)} dumps ({sum(len(d.events) for d in dumps)} events) to {args.json}")
+    elif args.throughput:
+        cmd_throughput(dumps, args.hang_ms)
+    elif args.show is not None:
+        for i, dump in enumerate(dumps):
+            if i:
+                print()
+            cmd_show(dump, None if args.show < 0 else args.show)
+    else:
+        cmd_latency(dumps, args.grace_ms)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Tests for query_profile.py.
+
+Usage: python -m pytest tools/test_query_profile.py
+"""
+
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import query_profile  # noqa: E402
+
+
+def write_profile(path, calls):
+    """Minimal speedscope export: calls are (name, start_us, end_us), top level."""
+    names = sorted({name for name, _, _ in calls})
+    events = []
+    for name, start, end in calls:
+        events.append({"type": "O", "frame": names.index(name), "at": start})
+        events.append({"type": "C", "frame": names.index(name), "at": end})
+    doc = {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": [{"name": name} for name in names]},
+        "profiles": [{
+            "type": "evented", "name": "test", "unit": "microseconds",
+            "startValue": 0, "endValue": calls[-1][2], "events": events,
+        }],
+    }
+    path.write_text(json.dumps(doc), encoding="utf-8")
+    return str(path)
+
+
+def test_query_string_keeps_regex_escapes():
+    tokens = query_profile._tokenize_query(r'name ~ "\d+\\.x" or name == "a\"b"')
+    assert tokens[2] == ("str", r"\d+\.x")
+    assert tokens[-1] == ("str", 'a"b')
+
+
+def test_query_regex_digit_class_matches_digits(tmp_path):
+    path = write_profile(tmp_path / "p.json", [
+        ("Func_012", 0, 100),
+        ("GUI_Repaint", 200, 300),
+        ("Func_abc", 400, 500),
+    ])
+    frames, _, _, data = query_profile.load_profile(path, use_index=False)
+    _, mask, _, _, _, _ = query_profile.run_query(frames, data, r'name ~ "_\d+$"')
+    matched = {frames[fi]["name"] for fi in data.calls.frame[np.asarray(mask)]}
+    assert matched == {"Func_012"}